@@ -6,25 +6,42 @@ blog.
 """
 
 import cgi
+import datetime
 import logging
-import xmlrpc
-import xmlrpclib
+import time
+import urllib
 
 from google.appengine.api import users
 from google.appengine.ext import webapp
 from google.appengine.ext.webapp import util
-from google.appengine.api import urlfetch
+
+try:
+    from google.appengine.api import taskqueue
+except ImportError:
+    # Older SDKs
+    from google.appengine.api.labs import taskqueue
 
 from models import *
+import cache
+import pings
 import request
+import search
+import stats
 import defs
 
 # -----------------------------------------------------------------------------
 # Constants
 # -----------------------------------------------------------------------------
 
-TECHNORATI_PING_RPC_URL = 'http://rpc.technorati.com/rpc/ping'
-FAKE_TECHNORATI_PING_RPC_URL = 'http://localhost/~bmc/technorati-mock/'
+# Task queue (see queue.yaml) and handler for publish pings
+PING_QUEUE_NAME = 'pings'
+PING_TASK_URL = '/admin/tasks/ping/'
+
+# Handler for the task that rebuilds the article aggregates
+REBUILD_TASK_URL = '/admin/tasks/rebuild/'
+
+# Latency percentiles shown on the stats page
+STATS_PERCENTILES = [('p50', 0.5), ('p95', 0.95), ('p99', 0.99)]
 
 # -----------------------------------------------------------------------------
 # Classes
@@ -32,12 +49,52 @@ FAKE_TECHNORATI_PING_RPC_URL = 'http://localhost/~bmc/technorati-mock/'
 
 class ShowArticlesHandler(request.BlogRequestHandler):
     """
-    Handles the main admin page, which lists all articles in the blog,
-    with links to their corresponding edit pages.
+    Handles the main admin page, which lists the articles in the blog,
+    a page at a time, with links to their corresponding edit pages. The
+    listing can be limited to drafts, to a tag and to a month (given as
+    ``YYYY-MM``). Article bodies aren't loaded; see
+    ``Article.summary_page()``.
     """
     def get(self):
-        articles = Article.get_all()
-        template_vars = {'articles' : articles}
+        drafts_only = bool(self.request.get('drafts'))
+        tag = self.request.get('tag').strip()
+        month_string = self.request.get('month').strip()
+        try:
+            year, month = [int(s) for s in month_string.split('-')]
+            datetime.date(year, month, 1)
+            month_filter = (year, month)
+        except ValueError:
+            month_string = ''
+            month_filter = None
+
+        cursor = self.request.get('cursor')
+        page = Article.summary_page(defs.ADMIN_ARTICLES_PER_PAGE,
+                                    cursor,
+                                    drafts_only,
+                                    tag or None,
+                                    month_filter)
+
+        filters = {}
+        if drafts_only:
+            filters['drafts'] = '1'
+        if tag:
+            filters['tag'] = tag.encode('utf-8')
+        if month_string:
+            filters['month'] = month_string
+
+        first_path = next_path = None
+        if cursor:
+            first_path = '/admin/?' + urllib.urlencode(filters)
+        if page.older_cursor:
+            filters['cursor'] = page.older_cursor
+            next_path = '/admin/?' + urllib.urlencode(filters)
+
+        template_vars = {'articles'    : page.articles,
+                         'drafts_only' : drafts_only,
+                         'tag'         : tag,
+                         'month'       : month_string,
+                         'first_path'  : first_path,
+                         'next_path'   : next_path}
         self.response.out.write(self.render_template('admin-main.html',
                                                      template_vars))
 
@@ -62,14 +119,9 @@ class SaveArticleHandler(request.BlogRequestHandler):
         body = cgi.escape(self.request.get('content'))
         s_id = cgi.escape(self.request.get('id'))
         id = int(s_id) if s_id else None
-        tags = cgi.escape(self.request.get('tags'))
+        tags = parse_tags(self.request.get('tags'))
         published_when = cgi.escape(self.request.get('published_when'))
         draft = cgi.escape(self.request.get('draft'))
-        if tags:
-            tags = [t.strip() for t in tags.split(',')]
-        else:
-            tags = []
-        tags = Article.convert_string_tags(tags)
 
         if not draft:
             draft = False
@@ -86,17 +138,17 @@ class SaveArticleHandler(request.BlogRequestHandler):
             article.draft = draft
         else:
             # It's new.
-            article = Article(title=title,
-                              body=body,
-                              tags=tags,
-                              draft=draft)
+            article = Article.create(title=title,
+                                     body=body,
+                                     tags=tags,
+                                     draft=draft)
             just_published = not draft
 
         article.save()
 
         if just_published:
             logging.debug('Article %d just went from draft to published. '
-                          'Alerting the media.' % article.id)
+                          'Queueing an alert to the media.' % article.id)
             alert_the_media()
 
         edit_again = cgi.escape(self.request.get('edit_again'))
@@ -133,48 +185,309 @@ class DeleteArticleHandler(request.BlogRequestHandler):
 
         self.redirect('/admin/')
 
+class BulkArticlesHandler(request.BlogRequestHandler):
+    """
+    Handles form submissions that publish, unpublish, retag or delete
+    many articles at once. The articles are selected either by ID (the
+    checked articles on the admin page) or by query (all articles with a
+    tag, or all drafts). Changes are written with batched datastore
+    calls; see ``Article.save_all()`` and ``Article.delete_all()``.
+    """
+    def post(self):
+        action = self.request.get('bulk_action')
+        articles = self.select_articles()
+        logging.info('Bulk %s of %d article(s).' % (action, len(articles)))
+
+        if action == 'delete':
+            Article.delete_all(articles)
+
+        elif action == 'publish':
+            articles = [a for a in articles if a.draft]
+            for article in articles:
+                article.draft = False
+            Article.save_all(articles)
+            if articles:
+                alert_the_media()
+
+        elif action == 'unpublish':
+            articles = [a for a in articles if not a.draft]
+            for article in articles:
+                article.draft = True
+            Article.save_all(articles)
+
+        elif action == 'retag':
+            add_tags = parse_tags(self.request.get('add_tags'))
+            remove_tags = parse_tags(self.request.get('remove_tags'))
+            changed = []
+            for article in articles:
+                tags = [t for t in article.tags if t not in remove_tags]
+                tags += [t for t in add_tags if t not in tags]
+                if tags != article.tags:
+                    article.tags = tags
+                    changed.append(article)
+            Article.save_all(changed)
+
+        else:
+            raise ValueError, 'Unknown bulk action "%s"' % action
+
+        self.redirect('/admin/')
+
+    def select_articles(self):
+        scope = self.request.get('scope')
+        if scope == 'selected':
+            ids = [int(id) for id in self.request.get_all('id')]
+            return Article.get_many(ids)
+
+        q = db.Query(Article)
+        if scope == 'tag':
+            q.filter('tags = ', self.request.get('scope_tag').strip())
+        elif scope == 'drafts':
+            q.filter('draft = ', True)
+        else:
+            raise ValueError, 'Unknown article selection "%s"' % scope
+        return q.fetch(FETCH_THEM_ALL)
+
+class AbstractTaskHandler(request.BlogRequestHandler):
+    """
+    Abstract base class for the handlers of background tasks. Only the
+    task queue may run these: App Engine strips the
+    ``X-AppEngine-QueueName`` header from outside requests, so requests
+    without it are refused. Subclasses implement ``run_task()``, rather
+    than ``post()``.
+    """
+    def post(self):
+        if 'X-AppEngine-QueueName' not in self.request.headers:
+            logging.warning('Refusing task %s from outside the task queue.' %
+                            self.request.path)
+            self.error(403)
+            return
+
+        self.run_task()
+
+    def run_task(self):
+        raise NotImplementedError
+
+class PingTaskHandler(AbstractTaskHandler):
+    """
+    Handles the background tasks, queued by ``alert_the_media()``, that
+    ping the outside world about newly published articles.
+
+    Without parameters, the task notifies every configured endpoint at
+    once, then queues a separate retry task for each endpoint that
+    failed. A retry task (with a ``service`` or ``hub`` parameter)
+    notifies just that endpoint; if it fails again, it returns an error
+    status, which makes the task queue retry it with exponential backoff,
+    as configured in queue.yaml. Endpoints that succeeded are never
+    pinged twice.
+
+    A retry task's endpoint must be one of the configured ones, so the
+    handler can't be used to fetch arbitrary URLs.
+    """
+    def run_task(self):
+        service = self.request.get('service')
+        hub = self.request.get('hub')
+        if ((service and (service not in pings.ping_services())) or
+            (hub and (hub not in pings.websub_hubs()))):
+            # Not retried, since it would never succeed.
+            logging.error('Dropping ping task for unknown endpoint "%s".' %
+                          (service or hub))
+            return
+
+        if service or hub:
+            services = [u for u in [service] if u]
+            hubs = [u for u in [hub] if u]
+        else:
+            services = pings.ping_services()
+            hubs = pings.websub_hubs()
+
+        failed_services, failed_hubs = pings.send_pings(services, hubs)
+        if not (failed_services or failed_hubs):
+            return
+
+        if service or hub:
+            retries = self.request.headers.get('X-AppEngine-TaskRetryCount',
+                                               '0')
+            logging.warning('Ping retry %s failed; will retry.' % retries)
+            self.error(500)
+        else:
+            for url in failed_services:
+                taskqueue.add(url=PING_TASK_URL,
+                              queue_name=PING_QUEUE_NAME,
+                              params={'service' : url})
+            for url in failed_hubs:
+                taskqueue.add(url=PING_TASK_URL,
+                              queue_name=PING_QUEUE_NAME,
+                              params={'hub' : url})
+
+class RebuildAggregatesHandler(request.BlogRequestHandler):
+    """
+    Handles requests to rebuild the denormalized article data (the tag
+    and month counts, the archive index and the search index) from
+    scratch. Use this to recover if the aggregates ever drift from the
+    articles themselves. It only accepts posts, since it changes data.
+
+    The work reads every article, so it's done in the background, by
+    ``RebuildTaskHandler``, which isn't held to the deadline of a user
+    request.
+    """
+    def post(self):
+        taskqueue.add(url=REBUILD_TASK_URL)
+        self.redirect('/admin/')
+
+class RebuildTaskHandler(AbstractTaskHandler):
+    """
+    Handles the background task, queued by ``RebuildAggregatesHandler``,
+    that rebuilds the tag and month counts and the archive index, then
+    starts rebuilding the search index (which goes on in tasks of its
+    own; see ``SearchIndexTaskHandler``).
+    """
+    def run_task(self):
+        logging.info('Rebuilding article aggregates.')
+        ArticleCounts.rebuild()
+        ArchiveIndex.rebuild()
+        search.start_rebuild()
+        cache.bump_generation()
+
+class SearchIndexTaskHandler(AbstractTaskHandler):
+    """
+    Handles the background tasks, queued by ``search.start_rebuild()``
+    and by each other, that build a new generation of the search index a
+    batch of articles at a time (``generation`` and ``cursor``
+    parameters), and that remove the generations it replaces
+    (``remove`` parameter).
+    """
+    def run_task(self):
+        remove = self.request.get('remove')
+        if remove:
+            search.remove_batch(int(remove))
+            return
+
+        generation = int(self.request.get('generation'))
+        cursor = self.request.get('cursor') or None
+        if search.rebuild_batch(Article.published_query(keys_only=True),
+                                generation,
+                                cursor):
+            # Cached search results came from the old generation.
+            cache.bump_generation()
+
+class StatsHandler(request.BlogRequestHandler):
+    """
+    Shows the performance dashboard: latency percentiles for each route,
+    the slowest article renders and the cache statistics. Posting to it
+    resets the statistics.
+    """
+    def get(self):
+        shared = stats.load()
+        routes = []
+        for route, histogram in sorted(shared.routes.items()):
+            row = {'name' : route, 'requests' : histogram.total}
+            for name, fraction in STATS_PERCENTILES:
+                row[name] = format_bucket(histogram.percentile(fraction))
+            routes.append(row)
+
+        slow_renders = shared.get_slow_renders()
+        # Not get_many(), which leaves out deleted articles.
+        articles = db.get([db.Key.from_path('Article', id)
+                           for id, ms in slow_renders])
+        renders = []
+        for (id, ms), article in zip(slow_renders, articles):
+            renders.append({'id'    : id,
+                            'title' : article and article.title,
+                            'ms'    : '%.1f' % ms})
+
+        cache_stats = sorted(cache.get_stats().items())
+        since = datetime.datetime.fromtimestamp(shared.since)
+        template_vars = {'since'       : since,
+                         'routes'      : routes,
+                         'renders'     : renders,
+                         'cache_stats' : cache_stats}
+        self.response.out.write(self.render_template('admin-stats.html',
+                                                     template_vars))
+
+    def post(self):
+        logging.info('Resetting request statistics.')
+        stats.reset()
+        self.redirect('/admin/stats/')
+
 # -----------------------------------------------------------------------------
 # Functions
 # -----------------------------------------------------------------------------
 
-def ping_technorati():
-    if defs.ON_GAE:
-        url = TECHNORATI_PING_RPC_URL
-    else:
-        url = FAKE_TECHNORATI_PING_RPC_URL
+def format_bucket(ms):
+    """
+    Format a latency from ``stats.Histogram.percentile()``.
 
-    logging.debug('Pinging Technorati at: %s' % url)
-    try:
-        transport = xmlrpc.GoogleXMLRPCTransport()
-        rpc_server = xmlrpclib.ServerProxy(url, transport=transport)
-        result = rpc_server.weblogUpdates.ping(defs.BLOG_NAME,
-                                               defs.CANONICAL_BLOG_URL)
-        if result.get('flerror', False) == True:
-            logging.error('Technorati ping error from server: %s' %
-                          result.get('message', '(No message in RPC result)'))
-        else:
-            logging.debug('Technorati ping successful.')
-    except:
-        raise urlfetch.DownloadError, \
-              "Can't ping Technorati: %s" % sys.exc_info()[1]
+    :Parameters:
+        ms : int
+            the latency bucket's upper bound, in milliseconds, or ``None``
+
+    :rtype: str
+    :return: the formatted latency
+    """
+    if ms is None:
+        return '> %d ms' % stats.LATENCY_BUCKETS_MS[-1]
+    return '<= %d ms' % ms
+
+def parse_tags(s):
+    """
+    Parse a comma-separated list of tags from a form field.
+
+    :Parameters:
+        s : str
+            the field's value
+
+    :rtype: list
+    :return: list of ``db.Category`` tags
+    """
+    s = cgi.escape(s)
+    if s:
+        tags = [t.strip() for t in s.split(',')]
+    else:
+        tags = []
+    return Article.convert_string_tags(tags)
 
 def alert_the_media():
-    # Right now, we only alert Technorati
-    ping_technorati()
+    """
+    Queue a background task to tell the outside world that an article
+    has been published. This returns as soon as the task is queued, so
+    saving an article never waits on (or fails because of) a slow or
+    unavailable ping endpoint.
+
+    Publishes are coalesced: the task is named for the current
+    ``defs.PING_COALESCE_SECONDS`` window and runs when the window ends,
+    so any number of publishes within one window result in one ping per
+    endpoint.
+    """
+    now = int(time.time())
+    window = now // defs.PING_COALESCE_SECONDS
+    countdown = defs.PING_COALESCE_SECONDS - (now % defs.PING_COALESCE_SECONDS)
+    try:
+        taskqueue.add(url=PING_TASK_URL,
+                      queue_name=PING_QUEUE_NAME,
+                      name='ping-%d' % window,
+                      countdown=countdown)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        logging.debug('Ping already queued for window %d.' % window)
 
 # -----------------------------------------------------------------------------
 # Main program
 # -----------------------------------------------------------------------------
 
-application = webapp.WSGIApplication(
+application = stats.StatsMiddleware(webapp.WSGIApplication(
     [('/admin/?', ShowArticlesHandler),
      ('/admin/article/new/?', NewArticleHandler),
      ('/admin/article/delete/?', DeleteArticleHandler),
      ('/admin/article/save/?', SaveArticleHandler),
      ('/admin/article/edit/?', EditArticleHandler),
+     ('/admin/articles/bulk/?', BulkArticlesHandler),
+     ('/admin/rebuild/?', RebuildAggregatesHandler),
+     ('/admin/stats/?', StatsHandler),
+     ('/admin/tasks/ping/?', PingTaskHandler),
+     ('/admin/tasks/rebuild/?', RebuildTaskHandler),
+     ('/admin/tasks/search/?', SearchIndexTaskHandler),
      ],
 
-    debug=True)
+    debug=True))
 
 def main():
     util.run_wsgi_app(application)
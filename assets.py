@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# $Id$
+
+"""
+Fingerprinted static assets.
+
+Run this script before deploying. It copies every file under ``static/``
+into ``assets/``, under a name that includes a hash of the file's
+content (e.g., ``style.1a2b3c4d5e.css``), and writes a manifest,
+``asset-manifest.json``, mapping each original name to its fingerprinted
+one. ``app.yaml`` serves ``/assets`` with far-future, immutable caching
+headers: a fingerprinted file never changes, since changing it gives it
+a new name, so browsers never need to revalidate it.
+
+Templates get asset URLs through the ``asset`` filter (e.g.,
+``{{ "style.css"|asset }}``), which looks them up in the manifest. An
+asset that isn't in the manifest (e.g., in development, before the first
+build) is served from ``/static`` instead.
+
+Old fingerprinted files are kept, so that pages rendered before a deploy
+keep working; ``--clean`` removes the ones the new manifest doesn't
+mention. Python 2.6 or later is required to build.
+
+Usage: python assets.py [--clean]
+"""
+
+__docformat__ = 'restructuredtext'
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import hashlib
+import optparse
+import os
+import shutil
+
+try:
+    import json
+except ImportError:
+    # Python 2.5, on App Engine
+    from django.utils import simplejson as json
+
+try:
+    from google.appengine.ext.webapp import template
+except ImportError:
+    # Building, outside the App Engine environment
+    template = None
+
+import defs
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(APP_DIR, defs.MEDIA_URL_PATH)
+ASSET_DIR = os.path.join(APP_DIR, defs.ASSET_URL_PATH)
+MANIFEST_FILE = os.path.join(APP_DIR, 'asset-manifest.json')
+
+# Number of hex digits of the content hash in a fingerprinted name.
+FINGERPRINT_LENGTH = 10
+
+# -----------------------------------------------------------------------------
+# Globals
+# -----------------------------------------------------------------------------
+
+# The loaded manifest, as a (manifest, mtime) tuple. mtime is only
+# recorded (and checked) in development.
+_manifest = None
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def asset_url(name):
+    """
+    Get the URL of a static asset: its fingerprinted URL, if it's in the
+    manifest, or its plain ``/static`` URL if not. This is the ``asset``
+    template filter.
+
+    :Parameters:
+        name : str
+            the asset's path within ``static/`` (e.g., ``style.css``)
+
+    :rtype: str
+    :return: the URL
+    """
+    fingerprinted = load_manifest()['assets'].get(name)
+    if fingerprinted is None:
+        return '/%s/%s' % (defs.MEDIA_URL_PATH, name)
+    return '/%s/%s' % (defs.ASSET_URL_PATH, fingerprinted)
+
+def manifest_digest():
+    """
+    :rtype: str
+    :return: a hash of the manifest, which changes whenever any asset
+             does, or an empty string if there's no manifest
+    """
+    return load_manifest()['digest']
+
+def load_manifest():
+    """
+    Get the manifest, reading it only the first time it's used in this
+    process. In development (i.e., when not running on GAE), it's read
+    again whenever it changes.
+
+    :rtype: dict
+    :return: a dictionary with an ``assets`` entry, mapping each asset's
+             original name to its fingerprinted name, and a ``digest``
+             entry (see ``manifest_digest()``)
+    """
+    global _manifest
+
+    if defs.ON_GAE:
+        if _manifest is not None:
+            return _manifest[0]
+        mtime = None
+    else:
+        try:
+            mtime = os.path.getmtime(MANIFEST_FILE)
+        except OSError:
+            mtime = 0
+        if (_manifest is not None) and (_manifest[1] == mtime):
+            return _manifest[0]
+
+    manifest = {'assets' : {}, 'digest' : ''}
+    if os.path.exists(MANIFEST_FILE):
+        f = open(MANIFEST_FILE)
+        try:
+            text = f.read()
+        finally:
+            f.close()
+        manifest['assets'] = json.loads(text)
+        manifest['digest'] = hashlib.sha1(text).hexdigest()
+
+    _manifest = (manifest, mtime)
+    return manifest
+
+def fingerprint_name(name, digest):
+    """
+    Build an asset's fingerprinted name.
+
+    :Parameters:
+        name : str
+            the asset's path within ``static/``
+
+        digest : str
+            hex hash of the asset's content
+
+    :rtype: str
+    :return: the name, with part of the hash inserted before the
+             extension (e.g., ``style.1a2b3c4d5e.css``)
+    """
+    base, extension = os.path.splitext(name)
+    return '%s.%s%s' % (base, digest[:FINGERPRINT_LENGTH], extension)
+
+def build(static_dir, asset_dir, manifest_file, clean=False):
+    """
+    Copy the static files to fingerprinted names, and write the manifest.
+    Files already copied under the same fingerprint aren't copied again.
+
+    :Parameters:
+        static_dir : str
+            the directory holding the original files
+
+        asset_dir : str
+            the directory to copy them to
+
+        manifest_file : str
+            the path of the manifest
+
+        clean : bool
+            ``True`` to remove fingerprinted files the new manifest
+            doesn't mention
+
+    :rtype: tuple
+    :return: a ``(manifest, copied, removed)`` tuple: the manifest, and
+             the number of files copied and removed
+    """
+    manifest = {}
+    copied = 0
+    for directory, subdirs, files in os.walk(static_dir):
+        for name in files:
+            if name.startswith('.'):
+                continue
+
+            source = os.path.join(directory, name)
+            relative = os.path.relpath(source, static_dir)
+            relative = relative.replace(os.sep, '/')
+            f = open(source, 'rb')
+            try:
+                digest = hashlib.sha1(f.read()).hexdigest()
+            finally:
+                f.close()
+
+            fingerprinted = fingerprint_name(relative, digest)
+            manifest[relative] = fingerprinted
+            target = os.path.join(asset_dir, *fingerprinted.split('/'))
+            if not os.path.exists(target):
+                if not os.path.isdir(os.path.dirname(target)):
+                    os.makedirs(os.path.dirname(target))
+                shutil.copyfile(source, target)
+                copied += 1
+
+    removed = 0
+    if clean:
+        keep = set(manifest.values())
+        for directory, subdirs, files in os.walk(asset_dir):
+            for name in files:
+                path = os.path.join(directory, name)
+                relative = os.path.relpath(path, asset_dir)
+                if relative.replace(os.sep, '/') not in keep:
+                    os.remove(path)
+                    removed += 1
+
+    f = open(manifest_file, 'w')
+    try:
+        json.dump(manifest, f, indent=2, sort_keys=True,
+                  separators=(',', ': '))
+        f.write('\n')
+    finally:
+        f.close()
+
+    return (manifest, copied, removed)
+
+# -----------------------------------------------------------------------------
+# Template library
+# -----------------------------------------------------------------------------
+
+# Loaded by request.py, with template.register_template_library().
+if template is not None:
+    register = template.create_template_register()
+    register.filter('asset', asset_url)
+
+# -----------------------------------------------------------------------------
+# Main program
+# -----------------------------------------------------------------------------
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [--clean]')
+    parser.add_option('--clean', action='store_true', default=False,
+                      help='remove fingerprinted files no longer in use')
+    options, args = parser.parse_args()
+
+    manifest, copied, removed = build(STATIC_DIR,
+                                      ASSET_DIR,
+                                      MANIFEST_FILE,
+                                      options.clean)
+    print '%d asset(s) in the manifest, %d copied, %d removed.' % \
+          (len(manifest), copied, removed)
+
+if __name__ == '__main__':
+    main()
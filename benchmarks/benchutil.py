@@ -0,0 +1,79 @@
+# $Id$
+
+"""
+Common support for the benchmark scripts in this directory. The
+scripts run outside of App Engine, so the App Engine SDK must be
+installed locally; see ``sdkpaths``.
+"""
+
+__docformat__ = 'restructuredtext'
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCH_DIR)
+
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+import sdkpaths
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def setup_paths(need_sdk=True):
+    """
+    Put the application and, optionally, the App Engine SDK on
+    ``sys.path``. See ``sdkpaths.setup_paths()``.
+
+    :Parameters:
+        need_sdk : bool
+            ``False`` if the benchmark only uses modules (such as ``rst``)
+            that don't depend on App Engine
+    """
+    sdkpaths.setup_paths(need_sdk)
+
+def time_per_call(func, iterations):
+    """
+    Time repeated calls to a function.
+
+    :Parameters:
+        func : callable
+            function to call, with no arguments
+
+        iterations : int
+            number of times to call it
+
+    :rtype: float
+    :return: the mean time per call, in seconds
+    """
+    start = time.time()
+    for i in range(iterations):
+        func()
+    return (time.time() - start) / iterations
+
+def report(label, seconds, baseline=None):
+    """
+    Print one benchmark result, in microseconds.
+
+    :Parameters:
+        label : str
+            what was measured
+
+        seconds : float
+            the measured time per call
+
+        baseline : float
+            the time to compare against, or ``None``
+    """
+    line = '%-40s %10.1f us' % (label, seconds * 1000000)
+    if baseline:
+        line += '  (%.1fx)' % (baseline / seconds)
+    print line
@@ -0,0 +1,86 @@
+# $Id$
+
+"""
+Synthetic article bodies for the benchmarks.
+"""
+
+__docformat__ = 'restructuredtext'
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+CODE_SAMPLES = [('python', '''\
+def fib_%(n)d(n):
+    """Return the n-th Fibonacci number."""
+    a, b = 0, 1
+    for i in range(n):
+        a, b = b, a + b
+    return a + %(n)d
+'''),
+                ('java', '''\
+public class Sample%(n)d {
+    public static void main(String[] args) {
+        for (int i = 0; i < %(n)d; i++)
+            System.out.println("Hello, world " + i);
+    }
+}
+'''),
+                ('scala', '''\
+object Sample%(n)d extends Application {
+  val squares = (1 to %(n)d).map(i => i * i)
+  println(squares.mkString(", "))
+}
+''')]
+
+PARAGRAPH = '''\
+Article %(n)d has some *emphasized* text, some **strong** text, an
+``inline literal`` and a `link <http://www.example.com/%(n)d>`_. It
+goes on for a while, so that the paragraph wraps across several lines,
+as the paragraphs in a real article would.
+'''
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def make_body(n, code_blocks=1, paragraphs=4):
+    """
+    Build a synthetic RST article body. Each body is unique, so that no
+    cache can serve one body's output for another.
+
+    :Parameters:
+        n : int
+            the article number
+
+        code_blocks : int
+            number of ``code-block`` directives to include
+
+        paragraphs : int
+            number of plain paragraphs to include
+
+    :rtype: unicode
+    :return: the body
+    """
+    parts = []
+    for i in range(paragraphs):
+        parts.append(PARAGRAPH % {'n' : n})
+        if i == 0:
+            parts.append('Section %d\n==========\n' % n)
+            parts.append('- first item\n- second item\n- third item\n')
+
+    for i in range(code_blocks):
+        language, code = CODE_SAMPLES[(n + i) % len(CODE_SAMPLES)]
+        code = code % {'n' : n * 100 + i}
+        parts.append('.. code-block:: %s\n\n%s' %
+                     (language,
+                      ''.join(['    ' + line + '\n'
+                               for line in code.splitlines()])))
+
+    return unicode('\n'.join(parts))
+
+def make_bodies(count, code_blocks=1, paragraphs=4):
+    """
+    Build a list of synthetic article bodies. See ``make_body()``.
+    """
+    return [make_body(n, code_blocks, paragraphs) for n in range(count)]
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# $Id$
+
+"""
+Times the static exporter (``export.py``) on a synthetic blog. It seeds
+an SQLite development datastore with the requested number of articles,
+then runs the exporter, as a separate process, three times: a full
+export, a rebuild with nothing changed, and a rebuild after a single
+article is edited. Seeding isn't timed.
+
+Usage: python benchmarks/export_time.py [options]
+"""
+
+__docformat__ = 'restructuredtext'
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import datetime
+import multiprocessing
+import optparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import benchutil
+benchutil.setup_paths()
+
+from google.appengine.ext import db
+from google.appengine.ext import testbed
+
+from models import Article
+
+import corpus
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+DEFAULT_ARTICLES = 5000
+DEFAULT_TAGS = 20
+
+APP_ID = 'export-benchmark'
+EXPORT_SCRIPT = os.path.join(benchutil.APP_DIR, 'export.py')
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def connect(datastore_file):
+    """
+    Point the App Engine APIs at an SQLite datastore file.
+
+    :Parameters:
+        datastore_file : str
+            the file
+
+    :rtype: testbed.Testbed
+    :return: the activated testbed
+    """
+    bed = testbed.Testbed()
+    bed.activate()
+    bed.setup_env(app_id=APP_ID, overwrite=True)
+    bed.init_datastore_v3_stub(datastore_file=datastore_file,
+                               use_sqlite=True)
+    bed.init_memcache_stub()
+    return bed
+
+def seed(datastore_file, count, tag_count):
+    """
+    Fill the datastore with published synthetic articles.
+
+    :Parameters:
+        datastore_file : str
+            the datastore file
+
+        count : int
+            number of articles
+
+        tag_count : int
+            number of distinct tags
+
+    :rtype: int
+    :return: the ID of an article in the middle of the blog
+    """
+    bed = connect(datastore_file)
+    try:
+        rand = random.Random(count)
+        all_tags = [db.Category(u'tag%d' % i) for i in range(tag_count)]
+        start = datetime.datetime(2008, 1, 1)
+        articles = []
+        for n in range(count):
+            tags = rand.sample(all_tags, min(tag_count, rand.randint(1, 3)))
+            article = Article.create(title=u'Article %d' % n,
+                                     body=corpus.make_body(n),
+                                     tags=tags,
+                                     draft=False)
+            article.published_when = start + datetime.timedelta(hours=n * 7)
+            articles.append(article)
+
+        Article.save_all(articles)
+        return articles[count // 2].id
+    finally:
+        bed.deactivate()
+
+def edit(datastore_file, id):
+    """
+    Change the body of one article.
+
+    :Parameters:
+        datastore_file : str
+            the datastore file
+
+        id : int
+            the article's ID
+    """
+    bed = connect(datastore_file)
+    try:
+        article = Article.get(id)
+        article.body += u'\n\nEdited.\n'
+        article.save()
+    finally:
+        bed.deactivate()
+
+def run_export(datastore_file, output_dir, processes, full=False):
+    """
+    Run the exporter, and time it.
+
+    :Parameters:
+        datastore_file : str
+            the datastore file
+
+        output_dir : str
+            the export directory
+
+        processes : int
+            number of rendering processes
+
+        full : bool
+            ``True`` to render every page
+
+    :rtype: float
+    :return: the elapsed time, in seconds
+    """
+    command = [sys.executable, EXPORT_SCRIPT,
+               '--sqlite',
+               '--datastore', datastore_file,
+               '--app-id', APP_ID,
+               '--processes', str(processes)]
+    if full:
+        command.append('--full')
+    command.append(output_dir)
+
+    start = time.time()
+    status = subprocess.call(command)
+    elapsed = time.time() - start
+    if status != 0:
+        raise RuntimeError('export.py exited with status %d' % status)
+    return elapsed
+
+# -----------------------------------------------------------------------------
+# Main program
+# -----------------------------------------------------------------------------
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--articles', type='int', default=DEFAULT_ARTICLES,
+                      help='number of articles (default: %default)')
+    parser.add_option('--tags', type='int', default=DEFAULT_TAGS,
+                      help='number of distinct tags (default: %default)')
+    parser.add_option('--processes', type='int',
+                      default=multiprocessing.cpu_count(),
+                      help='number of rendering processes (default: %default)')
+    options, args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='export-benchmark-')
+    try:
+        datastore_file = os.path.join(work_dir, 'datastore.sqlite')
+        output_dir = os.path.join(work_dir, 'export')
+
+        print 'Seeding %d article(s)...' % options.articles
+        middle = seed(datastore_file, options.articles, options.tags)
+
+        results = []
+        results.append(('full export',
+                        run_export(datastore_file, output_dir,
+                                   options.processes, full=True)))
+        results.append(('rebuild, nothing changed',
+                        run_export(datastore_file, output_dir,
+                                   options.processes)))
+        edit(datastore_file, middle)
+        results.append(('rebuild, one article edited',
+                        run_export(datastore_file, output_dir,
+                                   options.processes)))
+
+        print
+        print '%d article(s), %d process(es):' % (options.articles,
+                                                 options.processes)
+        for label, seconds in results:
+            print '%-40s %8.1f s' % (label, seconds)
+    finally:
+        shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    main()
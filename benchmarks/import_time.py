@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# $Id$
+
+"""
+Measures how long it takes to import the application's modules in a
+fresh interpreter, which is what an instance's cold start pays. Run it
+before and after a change to catch import-time regressions.
+
+Usage: python benchmarks/import_time.py [runs]
+"""
+
+__docformat__ = 'restructuredtext'
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import subprocess
+import sys
+
+import benchutil
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+MODULES = ['blog', 'admin', 'rst']
+
+# Run in the child interpreter. Prints the import time, in seconds.
+IMPORT_SCRIPT = '''\
+import sys, time
+sys.path.insert(0, %(bench_dir)r)
+import benchutil
+benchutil.setup_paths()
+start = time.time()
+import %(module)s
+print time.time() - start
+'''
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def import_time(module):
+    script = IMPORT_SCRIPT % {'bench_dir' : benchutil.BENCH_DIR,
+                              'module'    : module}
+    output = subprocess.Popen([sys.executable, '-c', script],
+                              stdout=subprocess.PIPE).communicate()[0]
+    return float(output.strip().split()[-1])
+
+def main():
+    if len(sys.argv) > 1:
+        runs = int(sys.argv[1])
+    else:
+        runs = 5
+
+    print 'Cold import time (best of %d):' % runs
+    for module in MODULES:
+        best = min([import_time(module) for i in range(runs)])
+        benchutil.report('  import %s' % module, best)
+
+if __name__ == '__main__':
+    main()
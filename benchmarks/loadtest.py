@@ -0,0 +1,640 @@
+#!/usr/bin/env python
+# $Id$
+
+"""
+Load test for the whole application, run against the local datastore,
+memcache and task queue stubs. For each synthetic corpus, it seeds a
+fresh datastore, then drives every route in ``blog.application`` and
+``admin.application`` through WSGI, and reports, per route, the p50 and
+p95 latency, the datastore and memcache calls per request, the time
+spent rendering RST per request, the response size, the time spent
+gzip-compressing responses (from the ``Server-Timing`` header) and the
+process's peak memory. Requests are sent with ``Accept-Encoding: gzip``
+unless ``--accept-encoding`` says otherwise.
+
+Blog routes are measured twice: with the page cache emptied before each
+request (``cached`` is false) and with it warm. The stubs aren't the
+real services, so the numbers are only good for comparing runs on the
+same machine.
+
+The results are written as JSON. Given a previous run's results with
+``--compare``, the p50 and p95 latencies are compared route by route,
+and the exit status is 1 if any got slower by more than the threshold.
+
+Usage: python benchmarks/loadtest.py [options]
+"""
+
+__docformat__ = 'restructuredtext'
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import datetime
+import json
+import optparse
+import platform
+import random
+import re
+import resource
+import sys
+import time
+import urllib
+from StringIO import StringIO
+
+import benchutil
+benchutil.setup_paths()
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.ext import db
+from google.appengine.ext import testbed
+
+import admin
+import blog
+import cache
+import defs
+import models
+import request
+from models import Article, ArticlePage
+
+import corpus
+
+# Measure the production code path, which skips the development-mode
+# check for modified templates.
+request.set_template_reloading(False)
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+DEFAULT_SIZES = '100,1000,10000'
+DEFAULT_TAGS = 20
+DEFAULT_CODE_BLOCKS = 1
+DEFAULT_ITERATIONS = 20
+DEFAULT_OUTPUT = 'loadtest.json'
+DEFAULT_THRESHOLD = 1.2
+DEFAULT_ACCEPT_ENCODING = 'gzip'
+
+# Routes that rebuild or rescan the whole blog are run at most this many
+# times per corpus.
+MAX_EXPENSIVE_ITERATIONS = 3
+
+# Fraction of the seeded articles that are drafts.
+DRAFT_FRACTION = 0.05
+
+SEARCH_QUERY = 'fibonacci number'
+
+GZIP_TIMING = re.compile(r'(?:^|,)\s*gzip;dur=([0-9.]+)')
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class Route(object):
+    """
+    One request to measure.
+    """
+    def __init__(self,
+                 app_name,
+                 path,
+                 method='GET',
+                 params=None,
+                 cached=False,
+                 expensive=False,
+                 setup=None):
+        """
+        :Parameters:
+            app_name : str
+                ``blog`` or ``admin``
+
+            path : str
+                the path, including any query string
+
+            method : str
+                ``GET`` or ``POST``
+
+            params : dict
+                the form fields to post, or a function (with no arguments)
+                that returns them, for routes that need fresh data for
+                each request
+
+            cached : bool
+                ``True`` to leave the page cache warm between requests
+
+            expensive : bool
+                ``True`` if the route rescans the whole blog, so it's run
+                at most ``MAX_EXPENSIVE_ITERATIONS`` times
+
+            setup : callable
+                function (with no arguments) to call before each request,
+                outside the measurement. It returns the path to request,
+                or ``None`` to use ``path``.
+        """
+        self.app_name = app_name
+        self.path = path
+        self.method = method
+        self.params = params
+        self.cached = cached
+        self.expensive = expensive
+        self.setup = setup
+
+    def name(self):
+        name = '%s %s' % (self.method, self.path)
+        if self.cached:
+            name += ' (cached)'
+        return name
+
+class CallCounter(object):
+    """
+    Counts API calls, by service. ``count()`` is installed as an API proxy
+    pre-call hook, so it sees synchronous and asynchronous calls alike.
+    """
+    def __init__(self):
+        self.counts = {}
+
+    def count(self, service, call, request, response):
+        self.counts[service] = self.counts.get(service, 0) + 1
+
+    def reset(self):
+        self.counts = {}
+
+class RSTTimer(object):
+    """
+    Wraps ``models.render_body()``, to total the time spent rendering RST.
+    """
+    def __init__(self, render_body):
+        self.render_body = render_body
+        self.seconds = 0.0
+
+    def __call__(self, body):
+        start = time.time()
+        try:
+            return self.render_body(body)
+        finally:
+            self.seconds += time.time() - start
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def start_stubs():
+    """
+    Start fresh datastore, memcache, task queue and user stubs.
+
+    :rtype: tuple
+    :return: a ``(testbed, counter)`` tuple; ``counter`` is the
+             ``CallCounter`` hooked into the new stubs
+    """
+    bed = testbed.Testbed()
+    bed.activate()
+    bed.setup_env(USER_EMAIL='loadtest@example.com',
+                  USER_ID='1',
+                  USER_IS_ADMIN='1',
+                  overwrite=True)
+    bed.init_datastore_v3_stub()
+    bed.init_memcache_stub()
+    bed.init_taskqueue_stub(root_path=benchutil.APP_DIR)
+    bed.init_urlfetch_stub()
+    bed.init_user_stub()
+
+    counter = CallCounter()
+    apiproxy_stub_map.apiproxy.GetPreCallHooks().Append('loadtest-counter',
+                                                         counter.count)
+    return (bed, counter)
+
+def seed(count, tag_count, code_blocks):
+    """
+    Fill the datastore with synthetic articles, through
+    ``Article.save_all()``, so the aggregates and search index are built
+    as they would be in production.
+
+    :Parameters:
+        count : int
+            number of articles
+
+        tag_count : int
+            number of distinct tags
+
+        code_blocks : int
+            number of ``code-block`` directives per article
+
+    :rtype: list
+    :return: the published ``Article`` objects, newest first
+    """
+    rand = random.Random(count)
+    all_tags = [db.Category(u'tag%d' % i) for i in range(tag_count)]
+    start = datetime.datetime(2008, 1, 1)
+    articles = []
+    for n in range(count):
+        tags = rand.sample(all_tags, min(tag_count, rand.randint(1, 3)))
+        article = Article.create(title=u'Article %d' % n,
+                                 body=corpus.make_body(n, code_blocks),
+                                 tags=tags,
+                                 draft=(rand.random() < DRAFT_FRACTION))
+        article.published_when = start + datetime.timedelta(hours=n * 7)
+        articles.append(article)
+
+    Article.save_all(articles)
+    published = [a for a in articles if not a.draft]
+    published.reverse()
+    return published
+
+def make_routes(published):
+    """
+    Build the routes to measure for a corpus.
+
+    :Parameters:
+        published : list
+            the published ``Article`` objects, newest first
+
+    :rtype: list
+    :return: list of ``Route`` objects
+    """
+    middle = published[len(published) // 2]
+    tag = middle.tags[0]
+    month = '%04d-%02d' % (middle.published_when.year,
+                           middle.published_when.month)
+    page_size = defs.MAX_ARTICLES_PER_PAGE
+    older = ''
+    if len(published) > page_size:
+        last = published[page_size - 1]
+        older = '/?cursor=' + ArticlePage.cursor_before(last.published_when)
+
+    blog_paths = ['/',
+                  '/%s/%s/' % (defs.TAG_URL_PATH, tag),
+                  '/%s/%s/' % (defs.DATE_URL_PATH, month),
+                  '/%s/%d' % (defs.ARTICLE_URL_PATH, middle.id),
+                  '/%s/' % defs.ARCHIVE_URL_PATH,
+                  '/%s/' % defs.RSS2_URL_PATH,
+                  '/%s/' % defs.ATOM_URL_PATH,
+                  '/%s/?%s' % (defs.SEARCH_URL_PATH,
+                               urllib.urlencode({'q' : SEARCH_QUERY})),
+                  '/no/such/page']
+    if older:
+        blog_paths.insert(1, older)
+    if len(published) >= defs.ATOM_ARCHIVE_ENTRIES:
+        blog_paths.insert(blog_paths.index('/%s/' % defs.ATOM_URL_PATH) + 1,
+                          '/%s/archive/1' % defs.ATOM_URL_PATH)
+
+    routes = []
+    for cached in (False, True):
+        for path in blog_paths:
+            routes.append(Route('blog', path, cached=cached))
+    routes.append(Route('blog', '/_ah/warmup'))
+
+    def new_article():
+        article = Article.create(title=u'Scratch article',
+                                 body=corpus.make_body(len(published)),
+                                 tags=[db.Category(tag)],
+                                 draft=True)
+        article.save()
+        return '/admin/article/delete/?id=%d' % article.id
+
+    edits = [0]
+    def edit_fields():
+        edits[0] += 1
+        return {'id'      : str(middle.id),
+                'title'   : middle.title,
+                'content' : middle.body + u'\n\nEdit %d.\n' % edits[0],
+                'tags'    : u', '.join(middle.tags)}
+
+    routes += [
+        Route('admin', '/admin/'),
+        Route('admin', '/admin/?' + urllib.urlencode({'tag' : tag})),
+        Route('admin', '/admin/?drafts=1'),
+        Route('admin', '/admin/article/new/'),
+        Route('admin', '/admin/article/edit/?id=%d' % middle.id),
+        Route('admin', '/admin/article/save/', 'POST', edit_fields),
+        Route('admin', '/admin/article/save/', 'POST',
+              {'title'   : 'New draft',
+               'content' : corpus.make_body(len(published) + 1),
+               'tags'    : tag,
+               'draft'   : 'on'}),
+        Route('admin', '/admin/articles/bulk/', 'POST',
+              {'bulk_action' : 'retag',
+               'scope'       : 'selected',
+               'id'          : [str(a.id) for a in published[:10]],
+               'add_tags'    : 'loadtest'}),
+        Route('admin', '/admin/article/delete/', setup=new_article),
+        Route('admin', '/admin/rebuild/', 'POST', {}, expensive=True),
+        Route('admin', '/admin/stats/'),
+        # Pings the development endpoints (see defs.DEV_PING_SERVICES);
+        # run mock_ping_server.py to measure it against live endpoints.
+        Route('admin', '/admin/tasks/ping/', 'POST', {}),
+        ]
+    return routes
+
+def make_environ(route, path, accept_encoding=None):
+    """
+    Build a WSGI environment for a request.
+
+    :Parameters:
+        route : Route
+            the route
+
+        path : str
+            the path and query string to request
+
+        accept_encoding : str
+            the ``Accept-Encoding`` header to send, or ``None``
+
+    :rtype: dict
+    :return: the environment
+    """
+    if '?' in path:
+        path, query = path.split('?', 1)
+    else:
+        query = ''
+
+    body = ''
+    if route.method == 'POST':
+        params = route.params
+        if callable(params):
+            params = params()
+        fields = []
+        for name, value in params.items():
+            if not isinstance(value, list):
+                value = [value]
+            for v in value:
+                if isinstance(v, unicode):
+                    v = v.encode('utf-8')
+                fields.append((name, v))
+        body = urllib.urlencode(fields)
+
+    environ = {'REQUEST_METHOD'    : route.method,
+               'SCRIPT_NAME'       : '',
+               'PATH_INFO'         : path,
+               'QUERY_STRING'      : query,
+               'SERVER_NAME'       : 'localhost',
+               'SERVER_PORT'       : '8080',
+               'SERVER_PROTOCOL'   : 'HTTP/1.1',
+               'CONTENT_TYPE'      : 'application/x-www-form-urlencoded',
+               'CONTENT_LENGTH'    : str(len(body)),
+               'wsgi.version'      : (1, 0),
+               'wsgi.url_scheme'   : 'http',
+               'wsgi.input'        : StringIO(body),
+               'wsgi.errors'       : sys.stderr,
+               'wsgi.multithread'  : False,
+               'wsgi.multiprocess' : False,
+               'wsgi.run_once'     : False}
+    if accept_encoding:
+        environ['HTTP_ACCEPT_ENCODING'] = accept_encoding
+    return environ
+
+def call_app(application, environ):
+    """
+    Call a WSGI application, consuming its whole response.
+
+    :rtype: tuple
+    :return: a ``(status, headers, length)`` tuple: the response status,
+             a dictionary of the response headers (with lower-case names)
+             and the number of bytes in the response body
+    """
+    response = {'length' : 0}
+    def write(data):
+        response['length'] += len(data)
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = status
+        response['headers'] = dict([(name.lower(), value)
+                                    for name, value in headers])
+        return write
+
+    result = application(environ, start_response)
+    try:
+        for chunk in result:
+            write(chunk)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return (response['status'], response['headers'], response['length'])
+
+def measure(route, options, counter, rst_timer):
+    """
+    Measure one route.
+
+    :rtype: dict
+    :return: the route's results
+    """
+    application = {'blog' : blog.application,
+                   'admin' : admin.application}[route.app_name]
+    iterations = options.iterations
+    if route.expensive:
+        iterations = min(iterations, MAX_EXPENSIVE_ITERATIONS)
+
+    if route.cached:
+        # Prime the cache.
+        call_app(application,
+                 make_environ(route, route.path, options.accept_encoding))
+
+    latencies = []
+    datastore_calls = 0
+    memcache_calls = 0
+    rst_seconds = 0.0
+    gzip_ms = 0.0
+    response_bytes = 0
+    statuses = {}
+    for i in range(iterations):
+        path = route.path
+        if route.setup:
+            path = route.setup() or path
+        if not route.cached:
+            cache.bump_generation()
+
+        environ = make_environ(route, path, options.accept_encoding)
+        counter.reset()
+        rst_start = rst_timer.seconds
+        start = time.time()
+        status, headers, length = call_app(application, environ)
+        latencies.append(time.time() - start)
+
+        response_bytes += length
+        match = GZIP_TIMING.search(headers.get('server-timing', ''))
+        if match:
+            gzip_ms += float(match.group(1))
+
+        datastore_calls += counter.counts.get('datastore_v3', 0)
+        memcache_calls += counter.counts.get('memcache', 0)
+        rst_seconds += rst_timer.seconds - rst_start
+        statuses[status] = statuses.get(status, 0) + 1
+
+    latencies.sort()
+    return {'name'             : route.name(),
+            'app'              : route.app_name,
+            'method'           : route.method,
+            'path'             : route.path,
+            'cached'           : route.cached,
+            'requests'         : iterations,
+            'statuses'         : statuses,
+            'p50_ms'           : percentile(latencies, 0.50) * 1000,
+            'p95_ms'           : percentile(latencies, 0.95) * 1000,
+            'mean_ms'          : sum(latencies) / iterations * 1000,
+            'datastore_calls'  : float(datastore_calls) / iterations,
+            'memcache_calls'   : float(memcache_calls) / iterations,
+            'rst_ms'           : rst_seconds / iterations * 1000,
+            'gzip_ms'          : gzip_ms / iterations,
+            'response_bytes'   : response_bytes // iterations,
+            'max_rss_kb'       : max_rss_kb()}
+
+def run_corpus(count, options, rst_timer):
+    """
+    Seed one corpus and measure every route against it.
+
+    :rtype: dict
+    :return: the corpus's results
+    """
+    bed, counter = start_stubs()
+    try:
+        start = time.time()
+        published = seed(count, options.tags, options.code_blocks)
+        seed_seconds = time.time() - start
+
+        results = []
+        for route in make_routes(published):
+            result = measure(route, options, counter, rst_timer)
+            print '  %-44s %8.1f %8.1f ms  %5.1f ds %8d bytes' % \
+                  (result['name'][:44], result['p50_ms'], result['p95_ms'],
+                   result['datastore_calls'], result['response_bytes'])
+            results.append(result)
+    finally:
+        bed.deactivate()
+
+    return {'articles'     : count,
+            'tags'         : options.tags,
+            'code_blocks'  : options.code_blocks,
+            'seed_seconds' : seed_seconds,
+            'routes'       : results}
+
+def percentile(values, fraction):
+    """
+    :Parameters:
+        values : list
+            the values, sorted
+
+        fraction : float
+            the percentile, as a fraction (e.g., 0.95)
+
+    :rtype: float
+    :return: the value at that percentile (nearest rank)
+    """
+    if not values:
+        return 0.0
+    index = int(round(fraction * (len(values) - 1)))
+    return values[index]
+
+def max_rss_kb():
+    """
+    :rtype: int
+    :return: this process's peak resident set size, in kilobytes
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # Reported in bytes, rather than kilobytes.
+        rss //= 1024
+    return rss
+
+def compare(results, baseline, threshold):
+    """
+    Compare this run's latencies to a previous run's.
+
+    :Parameters:
+        results : dict
+            this run's results
+
+        baseline : dict
+            the previous run's results
+
+        threshold : float
+            ratio of new to old latency above which a route counts as a
+            regression
+
+    :rtype: int
+    :return: number of regressions
+    """
+    old = {}
+    for corpus_result in baseline['corpora']:
+        for route in corpus_result['routes']:
+            old[(corpus_result['articles'], route['name'])] = route
+
+    regressions = 0
+    for corpus_result in results['corpora']:
+        for route in corpus_result['routes']:
+            before = old.get((corpus_result['articles'], route['name']))
+            if before is None:
+                continue
+            for field in ('p50_ms', 'p95_ms'):
+                if before[field] <= 0:
+                    continue
+                ratio = route[field] / before[field]
+                if ratio > threshold:
+                    regressions += 1
+                    print 'REGRESSION %6d articles %-40s %s %.1f -> %.1f ms' %\
+                          (corpus_result['articles'], route['name'][:40],
+                           field, before[field], route[field])
+    return regressions
+
+# -----------------------------------------------------------------------------
+# Main program
+# -----------------------------------------------------------------------------
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--sizes', default=DEFAULT_SIZES,
+                      help='comma-separated corpus sizes (default: %default)')
+    parser.add_option('--tags', type='int', default=DEFAULT_TAGS,
+                      help='number of distinct tags (default: %default)')
+    parser.add_option('--code-blocks', type='int',
+                      default=DEFAULT_CODE_BLOCKS,
+                      help='code blocks per article (default: %default)')
+    parser.add_option('--iterations', type='int', default=DEFAULT_ITERATIONS,
+                      help='requests per route (default: %default)')
+    parser.add_option('--accept-encoding', default=DEFAULT_ACCEPT_ENCODING,
+                      help='Accept-Encoding header to send, or an empty '
+                           'string for none (default: %default)')
+    parser.add_option('--output', default=DEFAULT_OUTPUT,
+                      help='file to write the JSON results to, or - for '
+                           'standard output (default: %default)')
+    parser.add_option('--compare', metavar='FILE',
+                      help='previous results to compare against')
+    parser.add_option('--threshold', type='float', default=DEFAULT_THRESHOLD,
+                      help='slowdown ratio that counts as a regression '
+                           '(default: %default)')
+    options, args = parser.parse_args()
+
+    rst_timer = RSTTimer(models.render_body)
+    models.render_body = rst_timer
+
+    results = {'started'         : datetime.datetime.utcnow().isoformat(),
+               'python'          : platform.python_version(),
+               'platform'        : platform.platform(),
+               'renderer'        : defs.RENDERER_VERSION,
+               'accept_encoding' : options.accept_encoding,
+               'corpora'         : []}
+    for size in [int(s) for s in options.sizes.split(',')]:
+        print '%d articles, %d tags, %d code block(s) per article:' % \
+              (size, options.tags, options.code_blocks)
+        print '  %-44s %8s %8s' % ('route', 'p50', 'p95')
+        results['corpora'].append(run_corpus(size, options, rst_timer))
+
+    text = json.dumps(results, indent=1, sort_keys=True)
+    if options.output == '-':
+        print text
+    else:
+        f = open(options.output, 'w')
+        try:
+            f.write(text)
+        finally:
+            f.close()
+        print 'Results written to %s' % options.output
+
+    if options.compare:
+        f = open(options.compare)
+        try:
+            baseline = json.load(f)
+        finally:
+            f.close()
+        if compare(results, baseline, options.threshold):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
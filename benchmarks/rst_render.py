@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# $Id$
+
+"""
+Benchmark for RST rendering. Compares a cold ``publish_parts()`` call
+per document (what ``rst.rst2html()`` used to do) to the reusable
+``rst.RSTRenderer``, one document at a time and in a batch.
+
+Usage: python benchmarks/rst_render.py [articles]
+"""
+
+__docformat__ = 'restructuredtext'
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import os
+import sys
+import time
+
+import benchutil
+benchutil.setup_paths(need_sdk=False)
+
+from docutils.core import publish_parts
+
+import corpus
+import rst
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def publish_parts_html(s):
+    os.environ['DOCUTILSCONFIG'] = ""
+    parts = publish_parts(source=s,
+                          writer_name='html4css1',
+                          settings_overrides={'style'  : 'colorful',
+                                              'config' : None})
+    return parts['fragment']
+
+def time_corpus(render, bodies):
+    # Highlighted code blocks are cached, so start each run cold.
+    rst._highlight_cache.clear()
+    start = time.time()
+    render(bodies)
+    return (time.time() - start) / len(bodies)
+
+def main():
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    else:
+        count = 100
+
+    bodies = corpus.make_bodies(count)
+    renderer = rst.RSTRenderer()
+
+    # Warm up imports and lexers, so that the first measurement isn't
+    # charged for them.
+    publish_parts_html(bodies[0])
+    renderer.render(bodies[0])
+
+    print 'Per-document time over %d articles:' % count
+    cold = time_corpus(lambda b: [publish_parts_html(s) for s in b], bodies)
+    benchutil.report('  publish_parts()', cold)
+
+    single = time_corpus(lambda b: [renderer.render(s) for s in b], bodies)
+    benchutil.report('  RSTRenderer.render()', single, cold)
+
+    batch = time_corpus(renderer.render_all, bodies)
+    benchutil.report('  RSTRenderer.render_all()', batch, cold)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# $Id$
+
+"""
+Micro-benchmark for template rendering. Compares rendering through
+``webapp.template.render()`` (with and without webapp's own cache) to
+rendering through the compiled-template cache in ``request``.
+
+Usage: python benchmarks/template_render.py [iterations]
+"""
+
+__docformat__ = 'restructuredtext'
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import datetime
+import sys
+
+import benchutil
+benchutil.setup_paths()
+
+from google.appengine.ext.webapp import template
+
+import defs
+import request
+
+# Measure the production code path, which skips the development-mode
+# check for modified templates.
+request.set_template_reloading(False)
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class FakeArticle(object):
+    """
+    Stands in for an ``Article``, so no datastore is needed.
+    """
+    def __init__(self, i):
+        self.id = i
+        self.title = 'Article %d' % i
+        self.html = '<p>Body of article %d.</p>' % i
+        self.path = '/%s/%d' % (defs.ARTICLE_URL_PATH, i)
+        self.url = 'http://localhost:8080' + self.path
+        self.tags = ['tag%d' % (i % 7), 'common']
+        self.draft = False
+        self.published_when = datetime.datetime(2009, 1, 1) + \
+                              datetime.timedelta(days=i)
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def sample_variables():
+    articles = [FakeArticle(i) for i in range(defs.MAX_ARTICLES_PER_PAGE)]
+    return {'blog_name'    : defs.BLOG_NAME,
+            'blog_owner'   : defs.BLOG_OWNER,
+            'blog_url'     : 'http://localhost:8080',
+            'articles'     : articles,
+            'article'      : articles[0],
+            'recent'       : articles,
+            'tag_list'     : [],
+            'date_list'    : [],
+            'last_updated' : articles[0].published_when,
+            'blog_path'    : '/'}
+
+def benchmark(template_name, variables, iterations):
+    path = request.template_path(template_name)
+    print '%s (%d renders):' % (template_name, iterations)
+
+    uncached = benchutil.time_per_call(
+        lambda: template.render(path, variables, debug=True), iterations)
+    benchutil.report('  webapp render, no cache', uncached)
+
+    webapp_cached = benchutil.time_per_call(
+        lambda: template.render(path, variables), iterations)
+    benchutil.report('  webapp render, webapp cache', webapp_cached,
+                     uncached)
+
+    handler = request.BlogRequestHandler()
+    cached = benchutil.time_per_call(
+        lambda: handler.render_template(template_name, variables),
+        iterations)
+    benchutil.report('  BlogRequestHandler.render_template', cached,
+                     uncached)
+
+def main():
+    if len(sys.argv) > 1:
+        iterations = int(sys.argv[1])
+    else:
+        iterations = 200
+
+    variables = sample_variables()
+    for template_name in ('show-articles.html', 'rss2-item.xml'):
+        benchmark(template_name, variables, iterations)
+
+if __name__ == '__main__':
+    main()
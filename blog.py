@@ -16,7 +16,11 @@ import os
 import sys
 import math
 import random
+import calendar
 import datetime
+import email.utils
+import time
+import urllib
 
 # Google AppEngine imports
 from google.appengine.api import users
@@ -24,9 +28,31 @@ from google.appengine.ext import webapp
 from google.appengine.ext.webapp import util
 
 from models import *
-from rst import rst2html
+import assets
+import cache
 import defs
+import models
+import pings
 import request
+import search
+import stats
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+# Rendered during warmup, to exercise the docutils pipeline and the
+# code-block directive.
+WARMUP_DOCUMENT = u'''\
+Warmup
+======
+
+Some *text*.
+
+.. code-block:: python
+
+    print "Hello, world"
+'''
 
 # -----------------------------------------------------------------------------
 # Classes
@@ -65,8 +91,263 @@ class AbstractPageHandler(request.BlogRequestHandler):
     """
     Abstract base class for all handlers in this module. Basically,
     this class exists to consolidate common logic.
+
+    Subclasses implement ``render_page()``, rather than ``get()``. The
+    rendered page is cached (see the ``cache`` module) until the blog's
+    content changes, and it's served with ``ETag`` and ``Last-Modified``
+    validators, so that a conditional GET for an unchanged page gets a
+    304 without any rendering. A page rendered for a missing resource
+    (see ``not_found()``) isn't cached.
     """
 
+    # MIME type of the rendered page. None means use the default.
+    content_type = None
+
+    # Names of the query parameters the page depends on. Any others are
+    # ignored, so they can't multiply the cached copies of a page.
+    query_params = ()
+
+    def initialize(self, request, response):
+        super(AbstractPageHandler, self).initialize(request, response)
+
+        # Results memoized by memoize(), for the life of this request.
+        self._request_data = {}
+        self._not_found = False
+
+    def get(self, *args):
+        """
+        Serve the page, from the cache if possible.
+
+        :Parameters:
+            args : list
+                the groups matched from the URL, passed on to
+                ``render_page()``
+        """
+        environ = self.request.environ
+        key = cache.page_key(self.__class__.__name__,
+                             environ['SERVER_NAME'],
+                             environ['SERVER_PORT'],
+                             self.request.path,
+                             urllib.urlencode(self.get_query_params()),
+                             assets.manifest_digest(),
+                             request.templates_digest())
+        headers = self.request.headers
+        page, generation = cache.get_page(key)
+        if page is not None:
+            stats.note('cache;desc=hit')
+            body, etag = self.set_validators(page)
+            if page.is_not_modified(headers.get('If-None-Match'),
+                                    headers.get('If-Modified-Since'),
+                                    etag):
+                self.response.set_status(304)
+            else:
+                self.response.out.write(body)
+            return
+
+        # Not cached. Render the page and cache it (which also compresses
+        # it), then send it in the encoding the client prefers.
+        stats.note('cache;desc=miss')
+        start = time.time()
+        rendered = self.render_page(*args)
+        if isinstance(rendered, basestring):
+            rendered = [rendered]
+
+        chunks = []
+        for chunk in rendered:
+            if isinstance(chunk, unicode):
+                chunk = chunk.encode('utf-8')
+            chunks.append(chunk)
+        stats.record('render', time.time() - start)
+
+        if self._not_found:
+            if self.content_type:
+                self.response.headers['Content-Type'] = self.content_type
+            self.response.out.write(''.join(chunks))
+            return
+
+        page = cache.put_page(key,
+                              generation,
+                              ''.join(chunks),
+                              self.content_type)
+        body, etag = self.set_validators(page)
+        self.response.out.write(body)
+
+    def get_query_params(self):
+        """
+        Get the query parameters the page depends on (see
+        ``query_params``), normalized (see ``normalize_param()``), so
+        that requests for the same page share a cache entry.
+
+        :rtype: list
+        :return: ``(name, value)`` tuples, with UTF-8 encoded values, for
+                 the parameters that are set, in ``query_params`` order
+        """
+        params = []
+        for name in self.query_params:
+            value = self.normalize_param(name, self.request.get(name))
+            if value:
+                params.append((name, value.encode('utf-8')))
+        return params
+
+    def normalize_param(self, name, value):
+        """
+        Normalize a query parameter. By default, ``cursor`` is an
+        ``ArticlePage`` cursor; other parameters are taken as they are.
+
+        :Parameters:
+            name : str
+                the parameter's name
+
+            value : unicode
+                the parameter's value, or an empty string
+
+        :rtype: unicode
+        :return: the normalized value, or ``None`` (or an empty string)
+                 if the parameter should be treated as unset
+        """
+        if name == 'cursor':
+            cursor = ArticlePage.normalize_cursor(value)
+            return cursor and unicode(cursor)
+        return value
+
+    def not_found(self):
+        """
+        Mark the response as a 404. Call this from ``render_page()``; the
+        rendered page is sent, but not cached.
+        """
+        self._not_found = True
+        self.response.set_status(404)
+
+    def set_validators(self, page):
+        """
+        Set the response headers that describe a cached page, choosing
+        the encoding (compressed or not) from the request's
+        ``Accept-Encoding`` header.
+
+        :Parameters:
+            page : cache.CachedPage
+                the page
+
+        :rtype: tuple
+        :return: a ``(body, etag)`` tuple: the page's body, in the chosen
+                 encoding, and that encoding's entity tag
+        """
+        body, etag, encoding = page.get_encoding(
+            self.request.headers.get('Accept-Encoding'))
+        headers = self.response.headers
+        headers['ETag'] = etag
+        headers['Last-Modified'] = page.last_modified_header()
+        if page.gzipped_body is not None:
+            headers['Vary'] = 'Accept-Encoding'
+        if encoding:
+            headers['Content-Encoding'] = encoding
+        if page.content_type:
+            headers['Content-Type'] = page.content_type
+        return (body, etag)
+
+    def render_page(self, *args):
+        """
+        Render the page. Subclasses must override this method.
+
+        :Parameters:
+            args : list
+                the groups matched from the URL
+
+        :rtype: str or iterable
+        :return: the rendered page, either as a single string or as an
+                 iterable (e.g., a generator) of strings that make up the
+                 page, in order
+        """
+        raise NotImplementedError
+
+    def memoize(self, key, func, *args):
+        """
+        Call a function once per request. Later calls with the same key,
+        for the rest of the request, return the first call's result, so
+        pieces of a page that need the same data share one datastore
+        call.
+
+        :Parameters:
+            key : str
+                identifies the result
+
+            func : callable
+                the function
+
+            args : list
+                arguments to the function
+
+        :return: the function's result
+        """
+        try:
+            return self._request_data[key]
+        except KeyError:
+            result = func(*args)
+            self._request_data[key] = result
+            return result
+
+    def get_article_counts(self):
+        """
+        Get the tag and day counts, loading them at most once per request.
+
+        :rtype: ArticleCounts
+        :return: the counts
+        """
+        return self.memoize('counts', ArticleCounts.load)
+
+    def get_archive_index(self):
+        """
+        Get the archive index, loading it at most once per request.
+
+        :rtype: ArchiveIndex
+        :return: the index
+        """
+        return self.memoize('archive-index', ArchiveIndex.load)
+
+    def get_newest_page(self, page_size):
+        """
+        Get the first page of published articles. The page comes from the
+        same lookup as ``get_newest()``.
+
+        :Parameters:
+            page_size : int
+                maximum number of articles on the page
+
+        :rtype: ArticlePage
+        :return: the page
+        """
+        newest = self.get_newest(page_size + 1)
+        articles = newest[:page_size]
+        older_cursor = None
+        if len(newest) > page_size:
+            older_cursor = ArticlePage.cursor_before(
+                articles[-1].published_when)
+        return ArticlePage(articles, None, older_cursor)
+
+    def get_newest(self, count):
+        """
+        Get the newest published articles. All calls in a request share a
+        single lookup, for the largest count asked for.
+
+        :Parameters:
+            count : int
+                maximum number of articles to return
+
+        :rtype: list
+        :return: list of ``Article`` objects, newest first
+        """
+        # The memoized value is a (count asked for, articles) tuple. If
+        # fewer articles came back than were asked for, that's all there
+        # are, and any larger count can be served from them too.
+        newest = self._request_data.get('newest')
+        if (newest is None) or \
+           ((count > newest[0]) and (len(newest[1]) == newest[0])):
+            newest = (count,
+                      Article.published_page(
+                          count, index=self.get_archive_index()).articles)
+            self._request_data['newest'] = newest
+        return newest[1][:count]
+
     def get_tag_counts(self):
         """
         Get tag counts and calculate tag cloud frequencies.
@@ -74,7 +355,7 @@ class AbstractPageHandler(request.BlogRequestHandler):
         :rtype: list
         :return: list of ``TagCount`` objects, in random order
         """
-        tag_counts = Article.get_all_tags()
+        tag_counts = self.get_article_counts().get_tag_counts()
         result = []
         if tag_counts:
             maximum = max(tag_counts.values())
@@ -111,30 +392,23 @@ class AbstractPageHandler(request.BlogRequestHandler):
         :rtype: list
         :return: list of ``DateCount`` objects
         """
-        hash = Article.get_all_datetimes()
-        datetimes = hash.keys()
-        date_count = {}
-        for dt in datetimes:
-            just_date = datetime.date(dt.year, dt.month, 1)
-            try:
-                date_count[just_date] += hash[dt]
-            except KeyError:
-                date_count[just_date] = hash[dt]
-
+        date_count = self.get_archive_index().get_month_counts()
         dates = date_count.keys()
         dates.sort()
         dates.reverse()
         return [DateCount(date, date_count[date]) for date in dates]
 
-    def augment_articles(self, articles, url_prefix, html=True):
+    def augment_articles(self, articles, url_prefix):
         """
-        Augment the ``Article`` objects in a list with the expanded
-        HTML, the path to the article, and the full URL of the article.
-        The augmented fields are:
+        Augment the ``Article`` objects in a list with the path to the
+        article and the full URL of the article. The augmented fields are:
         
-        - ``html``: the optionally expanded HTML
         - ``path``: the article's path
         - ``url``: the full URL to the article
+
+        The expanded HTML isn't computed here; ``Article.html`` renders it
+        on first use, so templates that never show article bodies never
+        pay for it.
         
         :Parameters:
             articles : list
@@ -142,24 +416,70 @@ class AbstractPageHandler(request.BlogRequestHandler):
 
             url_prefix : str
                 URL prefix to use when constructing full URL from path
-                
-            html : bool
-                ``True`` to generate HTML from each article's RST
         """
         for article in articles:
-            if html:
-                try:
-                    article.html = rst2html(article.body)
-                except AttributeError:
-                    article.html = ''
             article.path = '/' + defs.ARTICLE_URL_PATH + '/%s' % article.id
             article.url = url_prefix + article.path
 
+    def get_url_prefix(self, request):
+        """
+        Get the URL prefix to use when constructing full URLs from paths.
+
+        :Parameters:
+            request : HttpRequest
+                the GAE HTTP request object
+
+        :rtype: str
+        :return: the scheme, host and port, without a trailing slash
+        """
+        url_prefix = 'http://' + request.environ['SERVER_NAME']
+        port = request.environ['SERVER_PORT']
+        if port:
+            url_prefix += ':%s' % port
+        return url_prefix
+
+    def get_feed_path(self, feed, archive=None):
+        """
+        Get the path of a feed document.
+
+        :Parameters:
+            feed : str
+                ``defs.RSS2_URL_PATH`` or ``defs.ATOM_URL_PATH``
+
+            archive : int
+                the number of an Atom archive document, or ``None`` for
+                the feed itself
+
+        :rtype: str
+        :return: the path
+        """
+        path = '/' + feed
+        if archive is not None:
+            path += '/archive/%d' % archive
+        return path
+
+    def get_search_path(self):
+        """
+        :rtype: str
+        :return: the path of the search page, or ``None`` if searching
+                 isn't available
+        """
+        return '/' + defs.SEARCH_URL_PATH
+
+    def get_websub_hubs(self):
+        """
+        :rtype: list
+        :return: URLs of the WebSub hubs the feeds advertise
+        """
+        return pings.websub_hubs()
+
     def render_articles(self,
                         articles,
                         request,
                         recent,
-                        template_name='show-articles.html'):
+                        template_name='show-articles.html',
+                        page=None,
+                        extra_variables=None):
         """
         Render a list of articles.
         
@@ -171,21 +491,26 @@ class AbstractPageHandler(request.BlogRequestHandler):
                 the GAE HTTP request object
                 
             recent : list
-                list of recent ``Article`` objects. May be empty.
+                list of recent ``Article`` or ``ArticleSummary`` objects.
+                May be empty.
                 
             template_name : str
                 name of template to use
+
+            page : ArticlePage
+                the page ``articles`` came from, used to build the links
+                to newer and older pages. ``None`` if the articles aren't
+                paged.
+
+            extra_variables : dict
+                additional template variables, or ``None``
                 
         :rtype: str
         :return: the rendered articles
         """
-        url_prefix = 'http://' + request.environ['SERVER_NAME']
-        port = request.environ['SERVER_PORT']
-        if port:
-            url_prefix += ':%s' % port
-
+        url_prefix = self.get_url_prefix(request)
         self.augment_articles(articles, url_prefix)
-        self.augment_articles(recent, url_prefix, html=False)
+        self.augment_articles(recent, url_prefix)
 
         last_updated = datetime.datetime.now()
         if articles:
@@ -199,6 +524,13 @@ class AbstractPageHandler(request.BlogRequestHandler):
         media_path = '/' + defs.MEDIA_URL_PATH
         media_url = url_prefix + media_path
 
+        newer_path = older_path = None
+        if page:
+            if page.newer_cursor:
+                newer_path = self.get_page_path(request, page.newer_cursor)
+            if page.older_cursor:
+                older_path = self.get_page_path(request, page.older_cursor)
+
         template_variables = {'blog_name'    : defs.BLOG_NAME,
                               'blog_owner'   : defs.BLOG_OWNER,
                               'articles'     : articles,
@@ -213,131 +545,562 @@ class AbstractPageHandler(request.BlogRequestHandler):
                               'tag_url'      : tag_url,
                               'date_path'    : date_path,
                               'date_url'     : date_url,
-                              'rss2_path'    : '/' + defs.RSS2_URL_PATH,
+                              'rss2_path'    : self.get_feed_path(
+                                                   defs.RSS2_URL_PATH),
+                              'atom_path'    : self.get_feed_path(
+                                                   defs.ATOM_URL_PATH),
+                              'search_path'  : self.get_search_path(),
+                              'newer_path'   : newer_path,
+                              'older_path'   : older_path,
                               'recent'       : recent}
+        if extra_variables:
+            template_variables.update(extra_variables)
 
         return self.render_template(template_name, template_variables)
 
-    def get_recent(self):
+    def get_page_path(self, request, cursor):
         """
-        Get up to ``defs.TOTAL_RECENT`` recent articles.
+        Build the path to another page of the current listing, keeping
+        the page's other query parameters (e.g., a search query).
 
-        :rtype: list
-        :return: list of recent ``Article`` objects
+        :Parameters:
+            request : HttpRequest
+                the GAE HTTP request object
+
+            cursor : str
+                the other page's cursor
+
+        :rtype: str
+        :return: the path
         """
-        articles = Article.published()
+        params = [(name, value) for name, value in self.get_query_params()
+                  if name != 'cursor']
+        params.append(('cursor', cursor))
+        return '%s?%s' % (request.path, urllib.urlencode(params))
 
-        total_recent = min(len(articles), defs.TOTAL_RECENT)
-        if articles:
-            recent = articles[0:total_recent]
-        else:
-            recent = []
+    def render_feed_entries(self,
+                            template_name,
+                            articles,
+                            url_prefix,
+                            template_variables):
+        """
+        Render a feed's entries. Each entry is rendered separately and
+        cached by article fingerprint, so a poll after a new post only
+        renders the new entry.
 
-        return recent
+        :Parameters:
+            template_name : str
+                name of the template for one entry, which gets the
+                article as ``article``
+
+            articles : list
+                list of ``Article`` objects, one per entry. They're
+                augmented (see ``augment_articles()``) here.
+
+            url_prefix : str
+                URL prefix to use when constructing full URLs from paths
+
+            template_variables : dict
+                the other template variables
+
+        :rtype: generator
+        :return: the rendered entries, in order, as UTF-8 strings
+        """
+        self.augment_articles(articles, url_prefix)
+        version = request.templates_digest()
+        keys = [cache.fragment_key(template_name, version, url_prefix,
+                                   article.id, article.fingerprint())
+                for article in articles]
+        fragments = cache.get_fragments(keys)
+        new_fragments = {}
+        for key, article in zip(keys, articles):
+            fragment = fragments.get(key)
+            if fragment is None:
+                template_variables['article'] = article
+                fragment = self.render_template(template_name,
+                                                template_variables)
+                if isinstance(fragment, unicode):
+                    fragment = fragment.encode('utf-8')
+                new_fragments[key] = fragment
+            yield fragment
+
+        cache.put_fragments(new_fragments)
+
+    def get_recent(self):
+        """
+        Get up to ``defs.TOTAL_RECENT`` recent articles, from the archive
+        index.
+
+        :rtype: list
+        :return: list of ``ArticleSummary`` objects for the recent
+                 articles
+        """
+        return self.get_archive_index().newest(defs.TOTAL_RECENT)
 
 class FrontPageHandler(AbstractPageHandler):
     """
     Handles requests to display the front (or main) page of the blog.
     """
-    def get(self):
-        articles = Article.published()
-        if len(articles) > defs.MAX_ARTICLES_PER_PAGE:
-            articles = articles[:defs.MAX_ARTICLES_PER_PAGE]
+    query_params = ('cursor',)
 
-        self.response.out.write(self.render_articles(articles,
-                                                     self.request,
-                                                     self.get_recent()))
+    def render_page(self):
+        cursor = self.normalize_param('cursor', self.request.get('cursor'))
+        if cursor:
+            page = Article.published_page(defs.MAX_ARTICLES_PER_PAGE,
+                                          cursor,
+                                          self.get_archive_index())
+        else:
+            page = self.get_newest_page(defs.MAX_ARTICLES_PER_PAGE)
+        return self.render_articles(page.articles,
+                                    self.request,
+                                    self.get_recent(),
+                                    page=page)
 
 class ArticlesByTagHandler(AbstractPageHandler):
     """
     Handles requests to display a set of articles that have a
     particular tag.
     """
-    def get(self, tag):
-        articles = Article.all_for_tag(tag)
-        self.response.out.write(self.render_articles(articles,
-                                                     self.request,
-                                                     self.get_recent()))
+    query_params = ('cursor',)
+
+    def render_page(self, tag):
+        page = Article.page_for_tag(tag,
+                                    defs.MAX_ARTICLES_PER_PAGE,
+                                    self.request.get('cursor'),
+                                    self.get_archive_index())
+        return self.render_articles(page.articles,
+                                    self.request,
+                                    self.get_recent(),
+                                    page=page)
 
 class ArticlesForMonthHandler(AbstractPageHandler):
     """
     Handles requests to display a set of articles that were published
     in a given month.
     """
-    def get(self, year, month):
-        articles = Article.all_for_month(int(year), int(month))
-        self.response.out.write(self.render_articles(articles,
-                                                     self.request,
-                                                     self.get_recent()))
+    query_params = ('cursor',)
+
+    def render_page(self, year, month):
+        page = Article.page_for_month(int(year),
+                                      int(month),
+                                      defs.MAX_ARTICLES_PER_PAGE,
+                                      self.request.get('cursor'),
+                                      self.get_archive_index())
+        return self.render_articles(page.articles,
+                                    self.request,
+                                    self.get_recent(),
+                                    page=page)
+
+class SearchHandler(AbstractPageHandler):
+    """
+    Handles full-text searches of the published articles. The query is
+    in the ``q`` parameter; the ``cursor`` parameter is the page number.
+    """
+    query_params = ('q', 'cursor')
+
+    def normalize_param(self, name, value):
+        if name == 'cursor':
+            try:
+                page_number = int(value or 0)
+            except ValueError:
+                return None
+            return (page_number > 0) and unicode(page_number) or None
+        return value.strip()
+
+    def render_page(self):
+        query = self.normalize_param('q', self.request.get('q'))
+        page_number = int(self.normalize_param('cursor',
+                                               self.request.get('cursor'))
+                          or 0)
+
+        page_size = defs.SEARCH_RESULTS_PER_PAGE
+        articles, total = Article.search(query,
+                                         page_number * page_size,
+                                         page_size,
+                                         self.get_article_counts())
+
+        newer_cursor = older_cursor = None
+        if page_number > 0:
+            newer_cursor = str(page_number - 1)
+        if (page_number + 1) * page_size < total:
+            older_cursor = str(page_number + 1)
+
+        return self.render_articles(articles,
+                                    self.request,
+                                    self.get_recent(),
+                                    'search.html',
+                                    ArticlePage(articles,
+                                                newer_cursor,
+                                                older_cursor),
+                                    {'query' : query, 'total' : total})
 
 class SingleArticleHandler(AbstractPageHandler):
     """
     Handles requests to display a single article, given its unique ID.
     Handles nonexistent IDs.
     """
-    def get(self, id):
+    def render_page(self, id):
         article = Article.get(int(id))
         if article:
             template = 'show-articles.html'
             articles = [article]
-            more = None
         else:
+            self.not_found()
             template = 'not-found.html'
             articles = []
 
-        self.response.out.write(self.render_articles(articles=articles,
-                                                     request=self.request,
-                                                     recent=self.get_recent(),
-                                                     template_name=template))
+        return self.render_articles(articles=articles,
+                                    request=self.request,
+                                    recent=self.get_recent(),
+                                    template_name=template)
 
 class ArchivePageHandler(AbstractPageHandler):
     """
-    Handles requests to display the list of all articles in the blog.
+    Handles requests to display the list of all articles in the blog. The
+    list comes from the archive index, so no article bodies are loaded.
     """
-    def get(self):
-        articles = Article.published()
-        self.response.out.write(self.render_articles(articles,
-                                                     self.request,
-                                                     [],
-                                                     'archive.html'))
+    query_params = ('cursor',)
+
+    def render_page(self):
+        page = self.get_archive_index().page(
+            defs.MAX_ARCHIVE_ENTRIES_PER_PAGE, self.request.get('cursor'))
+        return self.render_articles(page.articles,
+                                    self.request,
+                                    [],
+                                    'archive.html',
+                                    page=page)
 
 class RSSFeedHandler(AbstractPageHandler):
     """
-    Handles request for an RSS2 feed of the blog's contents.
+    Handles request for an RSS2 feed of the blog's contents. The feed is
+    limited to the newest ``defs.MAX_FEED_ITEMS`` articles. The items
+    come from ``render_feed_entries()``; the document is then assembled
+    by concatenation.
+    """
+    content_type = 'text/xml'
+
+    def render_page(self):
+        articles = self.get_newest(defs.MAX_FEED_ITEMS)
+        url_prefix = self.get_url_prefix(self.request)
+
+        last_updated = datetime.datetime.now()
+        if articles:
+            last_updated = articles[0].published_when
+
+        template_variables = {'blog_name'    : defs.BLOG_NAME,
+                              'blog_owner'   : defs.BLOG_OWNER,
+                              'blog_url'     : url_prefix,
+                              'self_url'     : url_prefix +
+                                               self.get_feed_path(
+                                                   defs.RSS2_URL_PATH),
+                              'hubs'         : self.get_websub_hubs(),
+                              'last_updated' : last_updated}
+        yield self.render_template('rss2-head.xml', template_variables)
+        for fragment in self.render_feed_entries('rss2-item.xml',
+                                                 articles,
+                                                 url_prefix,
+                                                 template_variables):
+            yield fragment
+        yield self.render_template('rss2-tail.xml', template_variables)
+
+class AbstractAtomHandler(AbstractPageHandler):
+    """
+    Common logic for the Atom feed documents. The feed is split per RFC
+    5005: the subscription document (``AtomFeedHandler``) holds the
+    newest articles, and the older ones are in archive documents
+    (``AtomArchiveHandler``) of ``defs.ATOM_ARCHIVE_ENTRIES`` articles
+    each, numbered from the oldest.
+    """
+    content_type = 'application/atom+xml'
+
+    def get_archive_count(self):
+        """
+        :rtype: int
+        :return: the number of complete archive documents
+        """
+        total = len(self.get_archive_index().summaries)
+        return total // defs.ATOM_ARCHIVE_ENTRIES
+
+    def get_feed_url(self, url_prefix):
+        """
+        :rtype: str
+        :return: the subscription document's URL, which is also the
+                 feed's ID
+        """
+        return url_prefix + self.get_feed_path(defs.ATOM_URL_PATH)
+
+    def get_archive_url(self, url_prefix, number):
+        """
+        :rtype: str
+        :return: the URL of an archive document
+        """
+        return url_prefix + self.get_feed_path(defs.ATOM_URL_PATH, number)
+
+    def render_atom(self, articles, url_prefix, template_variables):
+        """
+        Render an Atom feed document.
+
+        :Parameters:
+            articles : list
+                list of ``Article`` objects in the document, newest first
+
+            url_prefix : str
+                URL prefix to use when constructing full URLs from paths
+
+            template_variables : dict
+                the document's links: ``self_url``, and (when there are
+                such documents) ``prev_archive_url`` and
+                ``next_archive_url``. ``is_archive`` marks an archive
+                document; the others advertise the WebSub hubs.
+
+        :rtype: generator
+        :return: the rendered document, in pieces
+        """
+        last_updated = datetime.datetime.utcnow()
+        if articles:
+            last_updated = articles[0].published_when
+
+        feed_id = self.get_feed_url(url_prefix)
+        template_variables.update({'blog_name'    : defs.BLOG_NAME,
+                                   'blog_owner'   : defs.BLOG_OWNER,
+                                   'blog_url'     : url_prefix,
+                                   'feed_id'      : feed_id,
+                                   'hubs'         : self.get_websub_hubs(),
+                                   'last_updated' : last_updated})
+        yield self.render_template('atom-head.xml', template_variables)
+        for fragment in self.render_feed_entries('atom-entry.xml',
+                                                 articles,
+                                                 url_prefix,
+                                                 template_variables):
+            yield fragment
+        yield self.render_template('atom-tail.xml', template_variables)
+
+class AtomFeedHandler(AbstractAtomHandler):
+    """
+    Handles requests for the Atom feed's subscription document. It holds
+    the articles newer than the last complete archive document (and at
+    least ``defs.MAX_FEED_ITEMS`` articles), so it stays small however
+    large the blog grows.
+
+    A client that polls with ``A-IM: feed`` and ``If-Modified-Since``
+    gets an RFC 3229 delta instead: a 226 response holding only the
+    articles published since then, or a 304 if there aren't any. If
+    there are more than ``defs.MAX_FEED_ITEMS`` of them, it gets the
+    whole subscription document, as if it hadn't asked for a delta.
     """
     def get(self):
-        articles = Article.published()
-        self.response.headers['Content-Type'] = 'text/xml'
-        self.response.out.write(self.render_articles(articles,
-                                                     self.request,
-                                                     [],
-                                                     'rss2.xml'))
+        since = self.get_delta_since()
+        if (since is None) or (not self.send_delta(since)):
+            AbstractAtomHandler.get(self)
+
+    def render_page(self):
+        archives = self.get_archive_count()
+        total = len(self.get_archive_index().summaries)
+        articles = self.get_newest(
+            max(defs.MAX_FEED_ITEMS,
+                total - archives * defs.ATOM_ARCHIVE_ENTRIES))
+
+        url_prefix = self.get_url_prefix(self.request)
+        template_variables = {'self_url' : self.get_feed_url(url_prefix)}
+        if archives:
+            template_variables['prev_archive_url'] = \
+                self.get_archive_url(url_prefix, archives)
+        return self.render_atom(articles, url_prefix, template_variables)
+
+    def get_delta_since(self):
+        """
+        Get the time a delta response should start from.
+
+        :rtype: datetime
+        :return: the (UTC) time in the request's ``If-Modified-Since``
+                 header, or ``None`` if the request doesn't ask for a
+                 feed delta. HTTP dates are in whole seconds, and a
+                 delta's ``Last-Modified`` time is its newest article's,
+                 truncated (see ``send_delta()``), so this is the end of
+                 the header's second.
+        """
+        headers = self.request.headers
+        instance_manipulations = [value.split(';')[0].strip().lower()
+                                  for value in headers.get('A-IM', '')
+                                                      .split(',')]
+        if 'feed' not in instance_manipulations:
+            return None
+
+        since = email.utils.parsedate_tz(
+            headers.get('If-Modified-Since') or '')
+        if since is None:
+            return None
+        return (datetime.datetime.utcfromtimestamp(
+                    email.utils.mktime_tz(since)) +
+                datetime.timedelta(seconds=1, microseconds=-1))
+
+    def send_delta(self, since):
+        """
+        Send the articles published after a given time, as an RFC 3229
+        feed delta. Deltas depend on the client's last poll, so they
+        aren't cached.
+
+        The delta's ``Last-Modified`` time is when its newest article was
+        published, so the client's next poll starts right after it. A
+        delta is never truncated, since the client would then never see
+        the articles left out.
+
+        :Parameters:
+            since : datetime
+                the (UTC) time
+
+        :rtype: bool
+        :return: ``True`` if the delta (or a 304) was sent, ``False`` if
+                 there are too many articles for one, in which case
+                 nothing was sent
+        """
+        articles = Article.published_since(since,
+                                           defs.MAX_FEED_ITEMS + 1,
+                                           self.get_archive_index())
+        if not articles:
+            self.response.set_status(304)
+            return True
+        if len(articles) > defs.MAX_FEED_ITEMS:
+            return False
+
+        stats.note('cache;desc=delta')
+        url_prefix = self.get_url_prefix(self.request)
+        template_variables = {'self_url' : self.get_feed_url(url_prefix)}
+        self.response.set_status(226, 'IM Used')
+        headers = self.response.headers
+        headers['Content-Type'] = self.content_type
+        headers['IM'] = 'feed'
+        headers['Cache-Control'] = 'no-store'
+        headers['Last-Modified'] = email.utils.formatdate(
+            calendar.timegm(articles[0].published_when.utctimetuple()),
+            usegmt=True)
+        for chunk in self.render_atom(articles,
+                                      url_prefix,
+                                      template_variables):
+            if isinstance(chunk, unicode):
+                chunk = chunk.encode('utf-8')
+            self.response.out.write(chunk)
+        return True
+
+class AtomArchiveHandler(AbstractAtomHandler):
+    """
+    Handles requests for the Atom feed's archive documents. Only
+    complete archive documents are served. They don't change when new
+    articles are published, but archives are numbered from the oldest
+    article, so deleting or backdating one shifts the archives after it.
+    So they're served like any other page, with validators (see
+    ``AbstractPageHandler``), not with a long ``max-age``: a client
+    revalidating an unchanged archive just gets a 304.
+    """
+    def get(self, number):
+        number = int(number)
+        if not (1 <= number <= self.get_archive_count()):
+            self.error(404)
+            return
+
+        AbstractAtomHandler.get(self, number)
+
+    def render_page(self, number):
+        articles = Article.archive_page(number,
+                                        defs.ATOM_ARCHIVE_ENTRIES,
+                                        self.get_archive_index())
+
+        url_prefix = self.get_url_prefix(self.request)
+        template_variables = {
+            'self_url'   : self.get_archive_url(url_prefix, number),
+            'is_archive' : True
+        }
+        if number > 1:
+            template_variables['prev_archive_url'] = \
+                self.get_archive_url(url_prefix, number - 1)
+        # The newest archive gets its next-archive link when the next one
+        # is complete. Clients walk the archives backwards from the
+        # subscription document, so a stale copy without it does no harm.
+        if number < self.get_archive_count():
+            template_variables['next_archive_url'] = \
+                self.get_archive_url(url_prefix, number + 1)
+        return self.render_atom(articles, url_prefix, template_variables)
 
 class NotFoundPageHandler(AbstractPageHandler):
     """
     Handles pages that aren't found.
     """
+    def render_page(self):
+        self.not_found()
+        return self.render_articles([],
+                                    self.request,
+                                    [],
+                                    'not-found.html')
+
+class WarmupHandler(request.BlogRequestHandler):
+    """
+    Handles App Engine warmup requests, which are sent to a new instance
+    before it takes traffic. Loads everything the first real request
+    would otherwise have to: the compiled templates, the RST stack (i.e.,
+    docutils and Pygments), the docutils pipeline and the common Pygments
+    lexers. Each step's time is logged and returned as plain text.
+
+    Warmup requests are also the first requests a newly deployed version
+    gets, so this starts rebuilding the search index if the new version
+    indexes articles differently (see ``search.rebuild_if_stale()``).
+    """
     def get(self):
-        self.response.out.write(self.render_articles([],
-                                                     self.request,
-                                                     [],
-                                                     'not-found.html'))
+        timings = []
+
+        start = time.time()
+        for template_name in os.listdir(request.TEMPLATE_DIR):
+            request.load_template(template_name)
+        timings.append(('templates', time.time() - start))
+
+        # Only report the import time if this request did the import.
+        already_loaded = models.rst_is_loaded()
+        rst = load_rst()
+        if already_loaded:
+            timings.append(('rst import', None))
+        else:
+            timings.append(('rst import', models.rst_load_seconds))
+
+        start = time.time()
+        for language in defs.WARMUP_LANGUAGES:
+            rst.get_lexer(language)
+        timings.append(('lexers', time.time() - start))
+
+        start = time.time()
+        rst.rst2html(WARMUP_DOCUMENT)
+        timings.append(('first render', time.time() - start))
+
+        if search.rebuild_if_stale():
+            logging.info('Warmup: started rebuilding the search index.')
+
+        self.response.headers['Content-Type'] = 'text/plain'
+        for label, seconds in timings:
+            if seconds is None:
+                # Something else loaded it before the warmup request.
+                message = '%s: already loaded' % label
+            else:
+                message = '%s: %.1f ms' % (label, seconds * 1000)
+            logging.info('Warmup: %s' % message)
+            self.response.out.write(message + '\n')
 
 # -----------------------------------------------------------------------------
 # Main program
 # -----------------------------------------------------------------------------
 
-application = webapp.WSGIApplication(
+application = stats.StatsMiddleware(webapp.WSGIApplication(
     [('/', FrontPageHandler),
      ('/tag/([^/]+)/*$', ArticlesByTagHandler),
      ('/date/(\d\d\d\d)-(\d\d)/?$', ArticlesForMonthHandler),
      ('/id/(\d+)/?$', SingleArticleHandler),
      ('/archive/?$', ArchivePageHandler),
+     ('/search/?$', SearchHandler),
      ('/rss2/?$', RSSFeedHandler),
+     ('/atom/?$', AtomFeedHandler),
+     ('/atom/archive/(\d+)/?$', AtomArchiveHandler),
+     ('/_ah/warmup$', WarmupHandler),
      ('/.*$', NotFoundPageHandler),
      ],
 
-    debug=True)
+    debug=True))
 
 def main():
     util.run_wsgi_app(application)
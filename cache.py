@@ -0,0 +1,615 @@
+# $Id$
+
+"""
+Memcache-backed caching of rendered pages, page fragments and query
+results.
+
+Cached pages and query results aren't invalidated individually.
+Instead, every entry records the *content generation* that was current
+when it was stored, and any change to the blog's content (see
+``bump_generation()``) starts a new generation, which makes all older
+entries stale at once.
+"""
+
+__docformat__ = 'restructuredtext'
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import email.utils
+import gzip
+import hashlib
+import logging
+import time
+from StringIO import StringIO
+
+from google.appengine.api import memcache
+from google.appengine.datastore import entity_pb
+from google.appengine.ext import db
+
+import defs
+import stats
+from lru import LRUCache
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+GENERATION_KEY = 'content-generation'
+PAGE_KEY_PREFIX = 'page:'
+FRAGMENT_KEY_PREFIX = 'fragment:'
+QUERY_KEY_PREFIX = 'query:'
+ENTITY_KEY_PREFIX = 'entity:'
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class CachedPage(object):
+    """
+    A rendered page, plus the validators sent with it. Pages of at least
+    ``defs.GZIP_MIN_BYTES`` are also kept gzip-compressed, so the
+    compression is done once per content generation, not per request.
+    The two encodings have different entity tags.
+    """
+
+    # Defaults for pages cached before these were added.
+    gzipped_body = None
+    gzip_etag = None
+
+    def __init__(self, generation, body, content_type, last_modified):
+        """
+        :Parameters:
+            generation : int
+                content generation the page was rendered in
+
+            body : str
+                the rendered page, as UTF-8 encoded bytes
+
+            content_type : str
+                the page's MIME type, or ``None`` for the default
+
+            last_modified : int
+                when the page was rendered, in seconds since the epoch
+        """
+        self.generation = generation
+        self.body = body
+        self.content_type = content_type
+        self.last_modified = last_modified
+        digest = hashlib.sha1(body).hexdigest()
+        self.etag = '"%s"' % digest
+        if len(body) >= defs.GZIP_MIN_BYTES:
+            self.gzipped_body = _gzip(body)
+            self.gzip_etag = '"%s-gzip"' % digest
+
+    def get_encoding(self, accept_encoding):
+        """
+        Choose the encoding to send the page in.
+
+        :Parameters:
+            accept_encoding : str
+                the request's ``Accept-Encoding`` header, or ``None``
+
+        :rtype: tuple
+        :return: a ``(body, etag, content_encoding)`` tuple, where
+                 ``content_encoding`` is ``gzip`` or ``None``
+        """
+        if (self.gzipped_body is not None) and accepts_gzip(accept_encoding):
+            return (self.gzipped_body, self.gzip_etag, 'gzip')
+        return (self.body, self.etag, None)
+
+    def last_modified_header(self):
+        """
+        :rtype: str
+        :return: the ``Last-Modified`` header value for this page
+        """
+        return email.utils.formatdate(self.last_modified, usegmt=True)
+
+    def is_not_modified(self, if_none_match, if_modified_since, etag=None):
+        """
+        Determine whether a conditional GET can be answered with a 304.
+
+        :Parameters:
+            if_none_match : str
+                the request's ``If-None-Match`` header, or ``None``
+
+            if_modified_since : str
+                the request's ``If-Modified-Since`` header, or ``None``
+
+            etag : str
+                the entity tag of the encoding being sent (see
+                ``get_encoding()``), or ``None`` for the uncompressed one
+
+        :rtype: bool
+        :return: ``True`` if the client's copy is current
+        """
+        if if_none_match:
+            # If-None-Match takes precedence over If-Modified-Since.
+            tags = [t.strip() for t in if_none_match.split(',')]
+            return ('*' in tags) or ((etag or self.etag) in tags)
+
+        if if_modified_since:
+            parsed = email.utils.parsedate_tz(if_modified_since)
+            if parsed is None:
+                return False
+            return self.last_modified <= email.utils.mktime_tz(parsed)
+
+        return False
+
+class QueryStats(object):
+    """
+    Counts query cache lookups in this process, for sizing the cache.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """
+        Zero the counters.
+        """
+        self.hits = 0
+        self.misses = 0
+        self.entity_hits = 0
+        self.entity_misses = 0
+
+class LocalMemcache(object):
+    """
+    An in-process stand-in for the parts of the memcache API this module
+    uses, for running outside App Engine (e.g., in tests and scripts)
+    without a memcache stub. Entries never expire, but the least
+    recently used ones are evicted once ``capacity`` is reached.
+    """
+    def __init__(self, capacity):
+        """
+        :Parameters:
+            capacity : int
+                maximum number of entries to keep
+        """
+        self.__cache = LRUCache(capacity)
+        # Values returned by gets(), by key, for cas() to compare with
+        self.__gotten = {}
+
+    def get(self, key):
+        return self.__cache.get(key)
+
+    def get_multi(self, keys):
+        result = {}
+        for key in keys:
+            value = self.__cache.get(key)
+            if value is not None:
+                result[key] = value
+        return result
+
+    def set(self, key, value):
+        self.__cache.put(key, value)
+        return True
+
+    def set_multi(self, mapping):
+        for key, value in mapping.items():
+            self.__cache.put(key, value)
+        return []
+
+    def add(self, key, value):
+        if key in self.__cache:
+            return False
+        self.__cache.put(key, value)
+        return True
+
+    def delete(self, key):
+        self.__gotten.pop(key, None)
+        return self.__cache.remove(key)
+
+    def gets(self, key):
+        value = self.__cache.get(key)
+        self.__gotten[key] = value
+        return value
+
+    def cas(self, key, value):
+        gotten = self.__gotten.pop(key, None)
+        if (gotten is None) or (self.__cache.get(key) is not gotten):
+            return False
+        self.__cache.put(key, value)
+        return True
+
+    def Client(self):
+        # The gets() and cas() calls are made on a client object.
+        return self
+
+    def incr(self, key):
+        value = self.__cache.get(key)
+        if value is None:
+            return None
+        self.__cache.put(key, value + 1)
+        return value + 1
+
+    def get_stats(self):
+        return {'items' : len(self.__cache),
+                'hits'  : self.__cache.hits,
+                'misses': self.__cache.misses}
+
+# -----------------------------------------------------------------------------
+# Globals
+# -----------------------------------------------------------------------------
+
+query_stats = QueryStats()
+
+# The cache backend: the memcache API, or a LocalMemcache (see
+# use_local_memcache()).
+_memcache = memcache
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def use_local_memcache(capacity=10000):
+    """
+    Cache in this process instead of in memcache. Call this before using
+    the cache when the memcache API isn't available.
+
+    :Parameters:
+        capacity : int
+            maximum number of entries to keep
+    """
+    global _memcache
+    _memcache = LocalMemcache(capacity)
+
+def get_generation():
+    """
+    Get the current content generation, starting a new one if memcache
+    has lost track of it.
+
+    :rtype: int
+    :return: the generation
+    """
+    generation = _memcache.get(GENERATION_KEY)
+    if generation is None:
+        generation = _new_generation()
+    return generation
+
+def bump_generation():
+    """
+    Start a new content generation, invalidating everything cached in
+    the current one. Call this whenever the blog's content changes.
+    """
+    if _memcache.incr(GENERATION_KEY) is None:
+        _new_generation()
+
+def page_key(*parts):
+    """
+    Build a memcache key for a page from the parts that identify it.
+
+    :Parameters:
+        parts : list
+            strings identifying the page (e.g., handler name and path)
+
+    :rtype: str
+    :return: the key
+    """
+    return _make_key(PAGE_KEY_PREFIX, parts)
+
+def fragment_key(*parts):
+    """
+    Build a memcache key for a page fragment from the parts that identify
+    it. Fragments aren't tied to a content generation, so the parts must
+    include something (e.g., ``Article.fingerprint()``) that changes
+    whenever the fragment's content would, and something (e.g.,
+    ``request.templates_digest()``) that changes whenever the code or
+    templates that render it do.
+
+    :Parameters:
+        parts : list
+            strings identifying the fragment
+
+    :rtype: str
+    :return: the key
+    """
+    return _make_key(FRAGMENT_KEY_PREFIX, parts)
+
+def get_fragments(keys):
+    """
+    Look up a batch of cached fragments, in a single memcache round trip.
+
+    :Parameters:
+        keys : list
+            keys from ``fragment_key()``
+
+    :rtype: dict
+    :return: a dictionary of the fragments that were found, by key
+    """
+    if not keys:
+        return {}
+    return _memcache.get_multi(keys)
+
+def put_fragments(fragments):
+    """
+    Cache a batch of fragments, in a single memcache round trip.
+
+    :Parameters:
+        fragments : dict
+            the fragments (as UTF-8 encoded strings), by key
+    """
+    if fragments:
+        failed = _memcache.set_multi(fragments)
+        if failed:
+            logging.warning('Unable to cache %d fragment(s)' % len(failed))
+
+def get_page(key):
+    """
+    Look up a cached page. This costs a single memcache round trip.
+
+    :Parameters:
+        key : str
+            the key from ``page_key()``
+
+    :rtype: tuple
+    :return: a ``(page, generation)`` tuple, where ``page`` is the
+             ``CachedPage`` (or ``None`` if there's no current entry) and
+             ``generation`` is the current content generation
+    """
+    values = _memcache.get_multi([GENERATION_KEY, key])
+    generation = values.get(GENERATION_KEY)
+    if generation is None:
+        return (None, _new_generation())
+
+    page = values.get(key)
+    if (page is not None) and (page.generation != generation):
+        page = None
+    return (page, generation)
+
+def put_page(key, generation, body, content_type=None):
+    """
+    Cache a freshly rendered page.
+
+    :Parameters:
+        key : str
+            the key from ``page_key()``
+
+        generation : int
+            the content generation returned by ``get_page()``
+
+        body : str or unicode
+            the rendered page
+
+        content_type : str
+            the page's MIME type, or ``None`` for the default
+
+    :rtype: CachedPage
+    :return: the cached page
+    """
+    if isinstance(body, unicode):
+        body = body.encode('utf-8')
+
+    page = CachedPage(generation, body, content_type, int(time.time()))
+    if not _memcache.set(key, page):
+        logging.warning('Unable to cache page under key %s' % key)
+    return page
+
+def cached_query(name, args, run_query):
+    """
+    Get the results of a datastore query through the cache. The cache
+    holds the keys of the query's results, valid for the current content
+    generation. When ``defs.CACHE_QUERY_ENTITIES`` is set, the result
+    entities are cached too, so a hit costs no datastore calls at all;
+    otherwise, a hit costs one batched key lookup instead of a query.
+
+    The results are cached under the generation current when the lookup
+    started, which ``bump_generation()`` only replaces after a change has
+    been stored. ``run_query`` must therefore see every stored change:
+    it must use strongly consistent reads (key lookups, ancestor queries
+    or transactions), never a plain, eventually consistent query, whose
+    stale result would otherwise be cached as current.
+
+    :Parameters:
+        name : str
+            name identifying the query
+
+        args : tuple
+            the query's parameters, which must be convertible to unicode
+
+        run_query : callable
+            function (with no arguments) that runs the query, returning a
+            list of ``db.Model`` objects; see above
+
+    :rtype: list
+    :return: the results
+    """
+    key = _make_key(QUERY_KEY_PREFIX, (name,) + tuple(args))
+    values = _memcache.get_multi([GENERATION_KEY, key])
+    generation = values.get(GENERATION_KEY)
+    if generation is None:
+        generation = _new_generation()
+
+    entry = values.get(key)
+    if (entry is not None) and (entry[0] == generation):
+        query_stats.hits += 1
+        return _get_entities(entry[1], generation)
+
+    query_stats.misses += 1
+    results = run_query()
+    if not _memcache.set(key, (generation, [r.key() for r in results])):
+        logging.warning('Unable to cache results of query %s' % name)
+    if defs.CACHE_QUERY_ENTITIES:
+        _put_entities(results, generation)
+    return results
+
+def get_entities(keys):
+    """
+    Look up entities by key, through the entity cache used by
+    ``cached_query()``: entities cached under the current content
+    generation cost no datastore calls, and the rest are fetched in one
+    batch, and cached.
+
+    :Parameters:
+        keys : list
+            the ``db.Key`` objects
+
+    :rtype: list
+    :return: the entities, in the order of ``keys``, leaving out any that
+             don't exist
+    """
+    return _get_entities(keys, get_generation())
+
+def get_value(key):
+    """
+    Look up a value stored with ``update_value()``.
+
+    :Parameters:
+        key : str
+            the key
+
+    :rtype: object
+    :return: the value, or ``None`` if it isn't cached
+    """
+    return _memcache.get(key)
+
+def update_value(key, update, attempts):
+    """
+    Update a value shared by all instances, with memcache's
+    compare-and-set, so that concurrent updates aren't lost.
+
+    :Parameters:
+        key : str
+            the key
+
+        update : callable
+            function taking the current value (or ``None``) and returning
+            the new value. It may be called more than once.
+
+        attempts : int
+            maximum number of attempts, should other updates keep
+            getting in first
+
+    :rtype: bool
+    :return: ``True`` if the value was updated
+    """
+    client = _memcache.Client()
+    for attempt in range(attempts):
+        value = client.gets(key)
+        if value is None:
+            if client.add(key, update(None)):
+                return True
+        elif client.cas(key, update(value)):
+            return True
+    return False
+
+def delete_value(key):
+    """
+    Remove a value stored with ``update_value()``.
+
+    :Parameters:
+        key : str
+            the key
+    """
+    _memcache.delete(key)
+
+def get_stats():
+    """
+    Get the cache statistics: this process's query cache counters, plus
+    the cache-wide memcache statistics.
+
+    :rtype: dict
+    :return: a dictionary with ``query_hits``, ``query_misses``,
+             ``entity_hits`` and ``entity_misses`` entries, plus the
+             entries returned by ``memcache.get_stats()`` (which may be
+             missing, if memcache is unavailable)
+    """
+    stats = dict(_memcache.get_stats() or {})
+    stats.update({'query_hits'    : query_stats.hits,
+                  'query_misses'  : query_stats.misses,
+                  'entity_hits'   : query_stats.entity_hits,
+                  'entity_misses' : query_stats.entity_misses})
+    return stats
+
+def _get_entities(keys, generation):
+    if not defs.CACHE_QUERY_ENTITIES:
+        return [e for e in db.get(keys) if e is not None]
+
+    cache_keys = [_entity_key(key, generation) for key in keys]
+    found = _memcache.get_multi(cache_keys)
+    entities = []
+    missing = []
+    for i, cache_key in enumerate(cache_keys):
+        data = found.get(cache_key)
+        if data is None:
+            missing.append(i)
+            entities.append(None)
+        else:
+            entity = db.model_from_protobuf(entity_pb.EntityProto(data))
+            entities.append(entity)
+
+    query_stats.entity_hits += len(keys) - len(missing)
+    query_stats.entity_misses += len(missing)
+    if missing:
+        fetched = db.get([keys[i] for i in missing])
+        for i, entity in zip(missing, fetched):
+            entities[i] = entity
+        _put_entities([e for e in fetched if e is not None], generation)
+
+    # An entity can vanish if it's deleted without a change of generation.
+    return [e for e in entities if e is not None]
+
+def _put_entities(entities, generation):
+    mapping = {}
+    for entity in entities:
+        mapping[_entity_key(entity.key(), generation)] = \
+            db.model_to_protobuf(entity).Encode()
+    if mapping:
+        failed = _memcache.set_multi(mapping)
+        if failed:
+            logging.warning('Unable to cache %d entities' % len(failed))
+
+def _entity_key(key, generation):
+    return _make_key(ENTITY_KEY_PREFIX, (generation, key))
+
+def accepts_gzip(accept_encoding):
+    """
+    Determine whether a client accepts gzip-compressed responses.
+
+    :Parameters:
+        accept_encoding : str
+            the request's ``Accept-Encoding`` header, or ``None``
+
+    :rtype: bool
+    :return: ``True`` if the header allows ``gzip``
+    """
+    if not accept_encoding:
+        return False
+
+    for coding in accept_encoding.split(','):
+        params = coding.split(';')
+        if params[0].strip().lower() not in ('gzip', 'x-gzip'):
+            continue
+        for param in params[1:]:
+            name, sep, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+
+    return False
+
+def _gzip(data):
+    start = time.time()
+    buf = StringIO()
+    f = gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=defs.GZIP_LEVEL)
+    try:
+        f.write(data)
+    finally:
+        f.close()
+    stats.record('gzip', time.time() - start)
+    return buf.getvalue()
+
+def _make_key(prefix, parts):
+    key = '\0'.join([unicode(part).encode('utf-8') for part in parts])
+    return prefix + hashlib.sha1(key).hexdigest()
+
+def _new_generation():
+    # Seed from the clock, so that a generation that memcache forgot about
+    # is never reused.
+    generation = int(time.time() * 1000)
+    if not _memcache.add(GENERATION_KEY, generation):
+        generation = _memcache.get(GENERATION_KEY) or generation
+    return generation
@@ -22,12 +22,65 @@ TAG_URL_PATH = 'tag'
 DATE_URL_PATH = 'date'
 ARTICLE_URL_PATH = 'id'
 MEDIA_URL_PATH = 'static'
+ASSET_URL_PATH = 'assets'
 ATOM_URL_PATH = 'atom'
 RSS2_URL_PATH = 'rss2'
 ARCHIVE_URL_PATH = 'archive'
+SEARCH_URL_PATH = 'search'
+
+# RST rendering. These live here, rather than in the rst module, so that
+# checking whether stored HTML is current doesn't require loading docutils.
+
+DEFAULT_PYGMENTS_STYLE = 'colorful'
+
+# Bump this whenever a change to the directives (or to anything else that
+# affects the generated HTML) is made. HTML that was stored with an article
+# under a different RENDERER_VERSION is considered stale and is re-rendered.
+RENDERER_REVISION = 1
+
+RENDERER_VERSION = '%d-%s' % (RENDERER_REVISION, DEFAULT_PYGMENTS_STYLE)
+
+# Languages whose Pygments lexers are loaded when an instance warms up.
+WARMUP_LANGUAGES = ['python', 'java', 'scala', 'ruby', 'sh', 'c', 'sql']
+
+# Publish notifications. Endpoints in the DEV_ lists are used when not
+# running on GAE; the default points at mock_ping_server.py.
+
+PING_SERVICES = ['http://rpc.technorati.com/rpc/ping',
+                 'http://rpc.pingomatic.com/']
+WEBSUB_HUBS = ['http://pubsubhubbub.appspot.com/']
+DEV_PING_SERVICES = ['http://localhost:8001/RPC2']
+DEV_WEBSUB_HUBS = ['http://localhost:8001/hub']
+
+# Seconds to wait for any one ping endpoint
+PING_TIMEOUT_SECONDS = 10
+
+# Publishes within one window of this many seconds share a single ping.
+PING_COALESCE_SECONDS = 60
+
+# Number of articles per page in the admin listing
+ADMIN_ARTICLES_PER_PAGE = 50
+
+# Maximum number of articles per datastore call in bulk admin operations
+BULK_BATCH_SIZE = 100
+
+# Whether cached query results (see cache.cached_query()) include the
+# entities themselves, rather than just their keys
+CACHE_QUERY_ENTITIES = True
+
+# Cached pages at least this large are also stored gzip-compressed, at
+# this compression level (1-9)
+GZIP_MIN_BYTES = 1024
+GZIP_LEVEL = 6
 
 MAX_ARTICLES_PER_PAGE = 5
+MAX_ARCHIVE_ENTRIES_PER_PAGE = 100
 TOTAL_RECENT = 10
+MAX_FEED_ITEMS = 20
+
+# Number of entries in each Atom feed archive document
+ATOM_ARCHIVE_ENTRIES = 20
+SEARCH_RESULTS_PER_PAGE = 10
 
 _server_software = os.environ.get('SERVER_SOFTWARE','').lower()
 if _server_software.startswith('goog'):
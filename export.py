@@ -0,0 +1,795 @@
+#!/usr/bin/env python
+# $Id$
+
+"""
+Exports the blog to a directory of static files, for serving from plain
+static hosting or a CDN. The pages are rendered by the same handlers and
+templates that serve the live blog: the front page, every article
+(``/id/N``), every tag (``/tag/X``) and month (``/date/YYYY-MM``), the
+archive, the RSS feed and the Atom feed (with its archive documents),
+plus a ``404.html`` page and a copy of the static media.
+
+Each page is written to ``index.html`` in the directory matching its
+path. Paged listings are written as ``<path>/page/2/``, ``<path>/page/3/``
+and so on, and their newer and older links are rewritten to match. The
+feeds are written as ``rss2.xml``, ``atom.xml`` and ``atom/archive/N.xml``,
+and every link to them (including the feeds' own links) points there, so
+that static hosts serve them as XML without any rewrite rules. Searching
+needs the live blog, so the exported pages have no search form.
+
+The export directory holds a manifest recording, for every page, a hash
+of everything the page depends on (the articles it shows, the templates
+and the settings, plus the sidebar contents for the pages that have a
+sidebar) and a hash of its content. A rebuild renders only the pages
+whose dependencies changed, and rewrites only the files whose content
+changed, so re-exporting after a single edit touches a handful of files.
+Pages are rendered in parallel across a pool of processes.
+
+The articles are read from a local development datastore, so download
+the live data first (e.g., with ``appcfg.py download_data``). The App
+Engine SDK must be installed locally; see ``sdkpaths``. Python 2.6 or
+later is required.
+
+Usage: python export.py [options] OUTPUT_DIR
+"""
+
+__docformat__ = 'restructuredtext'
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import hashlib
+import json
+import multiprocessing
+import optparse
+import os
+import re
+import shutil
+import time
+
+import sdkpaths
+sdkpaths.setup_paths()
+
+from google.appengine.ext import testbed
+from google.appengine.ext import webapp
+
+import assets
+import blog
+import defs
+import request
+from models import *
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+APP_DIR = sdkpaths.APP_DIR
+
+DEFAULT_DATASTORE = '/tmp/dev_appserver.datastore'
+DEFAULT_BASE_URL = defs.CANONICAL_BLOG_URL
+
+MANIFEST_NAME = 'manifest.json'
+
+# Bump this to force a full rebuild after changing how pages are exported.
+MANIFEST_VERSION = 2
+
+# Name of the file each page is written to within its directory
+INDEX_FILE = 'index.html'
+
+# Extension of the exported feed documents
+FEED_EXTENSION = '.xml'
+
+NOT_FOUND_FILE = '404.html'
+STATIC_DIR = os.path.join(APP_DIR, defs.MEDIA_URL_PATH)
+
+# Number of pages handed to a worker process at a time.
+PAGES_PER_TASK = 16
+
+# Handlers whose pages (show-articles.html) have the sidebar: the tag
+# cloud, the month list and the recent articles. Only these pages depend
+# on the sidebar's contents.
+SIDEBAR_HANDLERS = ('FrontPageHandler',
+                    'ArticlesByTagHandler',
+                    'ArticlesForMonthHandler',
+                    'SingleArticleHandler')
+
+# -----------------------------------------------------------------------------
+# Globals
+# -----------------------------------------------------------------------------
+
+# Set in each rendering process by init_renderer().
+_base_url = None
+_output_dir = None
+
+# Handler classes with StaticPageMixin mixed in, by handler name.
+_static_handlers = {}
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class PageSpec(object):
+    """
+    One page to export.
+    """
+    def __init__(self,
+                 path,
+                 file_name,
+                 handler_name,
+                 args=(),
+                 base_path=None,
+                 page_number=0,
+                 cursor=None,
+                 older_cursor=None):
+        """
+        :Parameters:
+            path : str
+                the page's path on the blog, used as its manifest key
+
+            file_name : str
+                the file to write, relative to the export directory
+
+            handler_name : str
+                name of the ``blog`` handler class that renders the page
+
+            args : tuple
+                arguments to the handler's ``render_page()``
+
+            base_path : str
+                path of the first page of the listing this page belongs to,
+                or ``None`` if the page isn't part of a paged listing
+
+            page_number : int
+                the page's position in its listing, starting at 0
+
+            cursor : str
+                the cursor that selects this page, or ``None`` for the
+                first page
+
+            older_cursor : str
+                the cursor that selects the next (older) page, or ``None``
+                if this is the last page
+        """
+        self.path = path
+        self.file_name = file_name
+        self.handler_name = handler_name
+        self.args = args
+        self.base_path = base_path
+        self.page_number = page_number
+        self.cursor = cursor
+        self.older_cursor = older_cursor
+        self.dependencies = None
+        self.old_digest = None
+
+class StaticPageMixin(object):
+    """
+    Mixed into the ``blog`` page handlers for export. Full URLs use the
+    export's base URL, links to the other pages of a listing point at the
+    exported page directories, and the sidebar data (which is the same on
+    every page) is queried once per process.
+    """
+    page_spec = None
+    _shared = {}
+
+    def get_url_prefix(self, request):
+        return _base_url
+
+    def get_feed_path(self, feed, archive=None):
+        return feed_path(feed, archive)
+
+    def get_search_path(self):
+        return None
+
+    def get_websub_hubs(self):
+        # Nothing notifies a hub about the exported feeds.
+        return []
+
+    def get_page_path(self, request, cursor):
+        # Exported listings are split at fixed positions, so the older
+        # cursor always selects the next page and the newer cursor always
+        # selects the previous one.
+        spec = self.page_spec
+        if cursor == spec.older_cursor:
+            return page_path(spec.base_path, spec.page_number + 1)
+        return page_path(spec.base_path, spec.page_number - 1)
+
+    def get_tag_counts(self):
+        return self._get_shared('tag_counts',
+                                super(StaticPageMixin, self).get_tag_counts)
+
+    def get_month_counts(self):
+        return self._get_shared('month_counts',
+                                super(StaticPageMixin, self).get_month_counts)
+
+    def get_recent(self):
+        return self._get_shared('recent',
+                                super(StaticPageMixin, self).get_recent)
+
+    def _get_shared(self, name, load):
+        try:
+            return StaticPageMixin._shared[name]
+        except KeyError:
+            value = load()
+            StaticPageMixin._shared[name] = value
+            return value
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def connect_datastore(options):
+    """
+    Point the App Engine APIs at the local development datastore (and an
+    in-memory memcache).
+
+    :Parameters:
+        options : optparse.Values
+            the command-line options
+    """
+    bed = testbed.Testbed()
+    bed.activate()
+    bed.setup_env(app_id=options.app_id, overwrite=True)
+    if options.sqlite:
+        bed.init_datastore_v3_stub(datastore_file=options.datastore,
+                                   use_sqlite=True)
+    else:
+        bed.init_datastore_v3_stub(datastore_file=options.datastore,
+                                   save_changes=False)
+    bed.init_memcache_stub()
+
+def init_renderer(options, connect=True):
+    """
+    Prepare a process to render pages.
+
+    :Parameters:
+        options : optparse.Values
+            the command-line options
+
+        connect : bool
+            ``False`` if the process is already connected to the datastore
+    """
+    global _base_url
+    global _output_dir
+
+    if connect:
+        connect_datastore(options)
+    # Nothing changes the templates during an export.
+    request.set_template_reloading(False)
+    _base_url = options.base_url.rstrip('/')
+    _output_dir = options.output_dir
+
+def render_page(spec):
+    """
+    Render one page and write it to the export directory, unless the file
+    already holds exactly that content.
+
+    :Parameters:
+        spec : PageSpec
+            the page
+
+    :rtype: tuple
+    :return: a ``(spec, digest, written)`` tuple, where ``digest`` is the
+             SHA-1 hash of the page's content and ``written`` is ``True``
+             if the file was (re)written
+    """
+    handler = get_static_handler(spec.handler_name)()
+    url = spec.path
+    if spec.cursor:
+        url += '?cursor=' + spec.cursor
+    handler.initialize(webapp.Request.blank(url), webapp.Response())
+    handler.page_spec = spec
+
+    rendered = handler.render_page(*spec.args)
+    if isinstance(rendered, basestring):
+        rendered = [rendered]
+
+    chunks = []
+    for chunk in rendered:
+        if isinstance(chunk, unicode):
+            chunk = chunk.encode('utf-8')
+        chunks.append(chunk)
+    body = ''.join(chunks)
+    digest = hashlib.sha1(body).hexdigest()
+
+    target = os.path.join(_output_dir, spec.file_name)
+    written = False
+    if (digest != spec.old_digest) or (not os.path.exists(target)):
+        write_file(target, body)
+        written = True
+
+    return (spec, digest, written)
+
+def get_static_handler(name):
+    """
+    Get a ``blog`` handler class, with ``StaticPageMixin`` mixed in.
+
+    :Parameters:
+        name : str
+            name of the handler class
+
+    :rtype: class
+    :return: the combined class
+    """
+    try:
+        return _static_handlers[name]
+    except KeyError:
+        handler_class = type('Static' + name,
+                             (StaticPageMixin, getattr(blog, name)),
+                             {})
+        _static_handlers[name] = handler_class
+        return handler_class
+
+def plan_pages(articles, base_url):
+    """
+    Determine every page to export, and what each one depends on.
+
+    :Parameters:
+        articles : list
+            all published ``Article`` objects, newest first
+
+        base_url : str
+            the URL the export will be served from
+
+    :rtype: list
+    :return: list of ``PageSpec`` objects
+    """
+    fingerprints = dict([(a.id, a.fingerprint()) for a in articles])
+    common = common_dependencies(base_url)
+    sidebar = sidebar_dependencies(articles)
+    pages = []
+
+    # extra lists anything else the page depends on, such as whether it
+    # links to an older page.
+    def add_page(spec, shown, extra=()):
+        parts = [common]
+        if spec.handler_name in SIDEBAR_HANDLERS:
+            parts.append(sidebar)
+        parts += [fingerprints[a.id] for a in shown]
+        parts += [unicode(part) for part in extra]
+        spec.dependencies = digest_parts(parts)
+        pages.append(spec)
+
+    def add_listing(handler_name, args, base_path, listed, page_size):
+        count = max(1, (len(listed) + page_size - 1) // page_size)
+        cursors = [None]
+        for n in range(1, count):
+            last = listed[n * page_size - 1]
+            cursors.append(ArticlePage.cursor_before(last.published_when))
+        cursors.append(None)
+
+        for n in range(count):
+            path = page_path(base_path, n)
+            spec = PageSpec(path,
+                            page_file(path),
+                            handler_name,
+                            args,
+                            base_path=base_path,
+                            page_number=n,
+                            cursor=cursors[n],
+                            older_cursor=cursors[n + 1])
+            add_page(spec,
+                     listed[n * page_size:(n + 1) * page_size],
+                     ['older=%s' % bool(cursors[n + 1])])
+
+    add_listing('FrontPageHandler', (), '/', articles,
+                defs.MAX_ARTICLES_PER_PAGE)
+    add_listing('ArchivePageHandler', (), '/%s/' % defs.ARCHIVE_URL_PATH,
+                articles, defs.MAX_ARCHIVE_ENTRIES_PER_PAGE)
+
+    by_tag = {}
+    by_month = {}
+    for article in articles:
+        for tag in article.tags:
+            by_tag.setdefault(tag, []).append(article)
+        month = (article.published_when.year, article.published_when.month)
+        by_month.setdefault(month, []).append(article)
+
+    for tag, tagged in by_tag.items():
+        add_listing('ArticlesByTagHandler', (tag,),
+                    u'/%s/%s/' % (defs.TAG_URL_PATH, tag), tagged,
+                    defs.MAX_ARTICLES_PER_PAGE)
+
+    for (year, month), in_month in by_month.items():
+        year_month = ('%04d' % year, '%02d' % month)
+        add_listing('ArticlesForMonthHandler', year_month,
+                    '/%s/%s-%s/' % ((defs.DATE_URL_PATH,) + year_month),
+                    in_month, defs.MAX_ARTICLES_PER_PAGE)
+
+    for article in articles:
+        path = '/%s/%d/' % (defs.ARTICLE_URL_PATH, article.id)
+        add_page(PageSpec(path,
+                          page_file(path),
+                          'SingleArticleHandler',
+                          (str(article.id),)),
+                 [article])
+
+    path = feed_path(defs.RSS2_URL_PATH)
+    add_page(PageSpec(path, page_file(path),
+                      'RSSFeedHandler'),
+             articles[:defs.MAX_FEED_ITEMS])
+
+    # The Atom subscription document holds the articles newer than the
+    # last complete archive document (see blog.AtomFeedHandler).
+    entries = defs.ATOM_ARCHIVE_ENTRIES
+    archives = len(articles) // entries
+    path = feed_path(defs.ATOM_URL_PATH)
+    add_page(PageSpec(path, page_file(path),
+                      'AtomFeedHandler'),
+             articles[:max(defs.MAX_FEED_ITEMS,
+                           len(articles) - archives * entries)],
+             ['archives=%d' % archives])
+
+    oldest_first = list(reversed(articles))
+    for number in range(1, archives + 1):
+        path = feed_path(defs.ATOM_URL_PATH, number)
+        add_page(PageSpec(path, page_file(path),
+                          'AtomArchiveHandler', (number,)),
+                 oldest_first[(number - 1) * entries:number * entries],
+                 ['next=%s' % (number < archives)])
+
+    add_page(PageSpec('/' + NOT_FOUND_FILE, NOT_FOUND_FILE,
+                      'NotFoundPageHandler'),
+             [])
+
+    return pages
+
+def common_dependencies(base_url):
+    """
+    Hash everything that every page depends on: the templates, the
+    settings, the static assets and the base URL.
+
+    :Parameters:
+        base_url : str
+            the URL the export will be served from
+
+    :rtype: str
+    :return: the hash, as a hex string
+    """
+    parts = [str(MANIFEST_VERSION), base_url, assets.manifest_digest()]
+
+    sources = [os.path.join(APP_DIR, 'defs.py')]
+    for name in sorted(os.listdir(request.TEMPLATE_DIR)):
+        sources.append(os.path.join(request.TEMPLATE_DIR, name))
+    for source in sources:
+        f = open(source, 'rb')
+        try:
+            parts.append(hashlib.sha1(f.read()).hexdigest())
+        finally:
+            f.close()
+
+    return digest_parts(parts)
+
+def sidebar_dependencies(articles):
+    """
+    Hash the sidebar contents (tag counts, month counts and recent
+    articles), which the pages of ``SIDEBAR_HANDLERS`` depend on.
+
+    :Parameters:
+        articles : list
+            all published ``Article`` objects, newest first
+
+    :rtype: str
+    :return: the hash, as a hex string
+    """
+    parts = ['%s=%d' % item
+             for item in sorted(Article.get_all_tags().items())]
+    parts += ['%s=%d' % item
+              for item in sorted(Article.get_all_datetimes().items())]
+    parts += ['%d:%s' % (a.id, a.title) for a in articles[:defs.TOTAL_RECENT]]
+    return digest_parts(parts)
+
+def digest_parts(parts):
+    """
+    Hash a list of strings.
+
+    :Parameters:
+        parts : list
+            the strings
+
+    :rtype: str
+    :return: the hash, as a hex string
+    """
+    text = u'\0'.join([unicode(part) for part in parts])
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def page_path(base_path, page_number):
+    """
+    Get the exported path of one page of a listing.
+
+    :Parameters:
+        base_path : str
+            path of the listing's first page
+
+        page_number : int
+            the page's position in the listing, starting at 0
+
+    :rtype: str
+    :return: the path
+    """
+    if page_number == 0:
+        return base_path
+    return '%spage/%d/' % (base_path, page_number + 1)
+
+def page_file(path):
+    """
+    Get the file a page is written to.
+
+    :Parameters:
+        path : str
+            the page's path: a directory (ending in ``/``), for an HTML
+            page, or a file name
+
+    :rtype: str
+    :return: the file name, relative to the export directory
+    """
+    parts = [part for part in path.split('/') if part]
+    if path.endswith('/'):
+        parts.append(INDEX_FILE)
+    return os.path.join(*parts)
+
+def feed_path(feed, archive=None):
+    """
+    Get the exported path of a feed document.
+
+    :Parameters:
+        feed : str
+            ``defs.RSS2_URL_PATH`` or ``defs.ATOM_URL_PATH``
+
+        archive : int
+            the number of an Atom archive document, or ``None`` for the
+            feed itself
+
+    :rtype: str
+    :return: the path (e.g., ``/atom/archive/3.xml``)
+    """
+    path = '/' + feed
+    if archive is not None:
+        path += '/archive/%d' % archive
+    return path + FEED_EXTENSION
+
+def write_file(path, data):
+    """
+    Write a file, creating its directory if necessary. The data is written
+    to a temporary file that then replaces the target, so a server never
+    sees a partly written file.
+
+    :Parameters:
+        path : str
+            the file to write
+
+        data : str
+            the bytes to write
+    """
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Another worker may have just created it.
+            if not os.path.isdir(directory):
+                raise
+
+    temp = '%s.%d.tmp' % (path, os.getpid())
+    f = open(temp, 'wb')
+    try:
+        f.write(data)
+    finally:
+        f.close()
+    os.rename(temp, path)
+
+def remove_file(output_dir, file_name):
+    """
+    Remove an exported file, and any directories that leaves empty.
+
+    :Parameters:
+        output_dir : str
+            the export directory
+
+        file_name : str
+            the file, relative to the export directory
+    """
+    path = os.path.join(output_dir, file_name)
+    if os.path.exists(path):
+        os.remove(path)
+
+    directory = os.path.dirname(path)
+    while os.path.abspath(directory) != os.path.abspath(output_dir):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            break
+        directory = os.path.dirname(directory)
+
+def copy_static_files(output_dir):
+    """
+    Copy the static media, and their fingerprinted copies (see the
+    ``assets`` module), to the export directory, skipping files that are
+    already up to date.
+
+    :Parameters:
+        output_dir : str
+            the export directory
+
+    :rtype: int
+    :return: number of files copied
+    """
+    copied = 0
+    for source_dir, url_path in ((STATIC_DIR, defs.MEDIA_URL_PATH),
+                                 (assets.ASSET_DIR, defs.ASSET_URL_PATH)):
+        for directory, subdirs, files in os.walk(source_dir):
+            target_dir = os.path.join(output_dir,
+                                      url_path,
+                                      os.path.relpath(directory, source_dir))
+            if not os.path.isdir(target_dir):
+                os.makedirs(target_dir)
+
+            for name in files:
+                source = os.path.join(directory, name)
+                target = os.path.join(target_dir, name)
+                if os.path.exists(target):
+                    source_stat = os.stat(source)
+                    target_stat = os.stat(target)
+                    if (source_stat.st_size == target_stat.st_size) and \
+                       (int(source_stat.st_mtime) ==
+                        int(target_stat.st_mtime)):
+                        continue
+                shutil.copy2(source, target)
+                copied += 1
+
+    return copied
+
+def load_manifest(output_dir):
+    """
+    Load the manifest from a previous export.
+
+    :Parameters:
+        output_dir : str
+            the export directory
+
+    :rtype: dict
+    :return: a dictionary mapping each page's path to a dictionary with
+             ``file``, ``dependencies`` and ``digest`` entries; empty if
+             there's no usable manifest
+    """
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+
+    f = open(path)
+    try:
+        manifest = json.load(f)
+    finally:
+        f.close()
+
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return manifest.get('pages', {})
+
+def save_manifest(output_dir, pages):
+    """
+    Save the manifest.
+
+    :Parameters:
+        output_dir : str
+            the export directory
+
+        pages : dict
+            the manifest entries, as returned by ``load_manifest()``
+    """
+    write_file(os.path.join(output_dir, MANIFEST_NAME),
+               json.dumps({'version' : MANIFEST_VERSION, 'pages' : pages},
+                          indent=1, sort_keys=True))
+
+def export(options):
+    """
+    Export the blog.
+
+    :Parameters:
+        options : optparse.Values
+            the command-line options
+    """
+    start = time.time()
+    connect_datastore(options)
+    articles = Article.published()
+    pages = plan_pages(articles, options.base_url)
+
+    old_manifest = {}
+    if not options.full:
+        old_manifest = load_manifest(options.output_dir)
+
+    to_render = []
+    manifest = {}
+    for spec in pages:
+        entry = old_manifest.get(spec.path)
+        if entry is not None:
+            spec.old_digest = entry['digest']
+            if (entry['dependencies'] == spec.dependencies) and \
+               (entry['file'] == spec.file_name) and \
+               os.path.exists(os.path.join(options.output_dir,
+                                           spec.file_name)):
+                manifest[spec.path] = entry
+                continue
+        to_render.append(spec)
+
+    print 'Exporting %d article(s): rendering %d of %d page(s).' %\
+          (len(articles), len(to_render), len(pages))
+
+    if options.processes == 1:
+        init_renderer(options, connect=False)
+        results = map(render_page, to_render)
+    else:
+        pool = multiprocessing.Pool(options.processes,
+                                    init_renderer,
+                                    (options,))
+        results = pool.imap_unordered(render_page, to_render, PAGES_PER_TASK)
+
+    written = 0
+    for spec, digest, was_written in results:
+        manifest[spec.path] = {'file'         : spec.file_name,
+                               'dependencies' : spec.dependencies,
+                               'digest'       : digest}
+        if was_written:
+            written += 1
+
+    if options.processes != 1:
+        pool.close()
+        pool.join()
+
+    removed = 0
+    for path, entry in old_manifest.items():
+        if path not in manifest:
+            remove_file(options.output_dir, entry['file'])
+            removed += 1
+
+    copied = copy_static_files(options.output_dir)
+    save_manifest(options.output_dir, manifest)
+
+    print '%d page(s) written, %d removed, %d static file(s) copied in ' \
+          '%.1f seconds.' % (written, removed, copied, time.time() - start)
+
+def default_app_id():
+    """
+    :rtype: str
+    :return: the application ID from ``app.yaml``
+    """
+    f = open(os.path.join(APP_DIR, 'app.yaml'))
+    try:
+        for line in f:
+            match = re.match(r'application:\s*(\S+)', line)
+            if match:
+                return match.group(1)
+    finally:
+        f.close()
+    return None
+
+# -----------------------------------------------------------------------------
+# Main program
+# -----------------------------------------------------------------------------
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options] OUTPUT_DIR')
+    parser.add_option('--datastore', default=DEFAULT_DATASTORE,
+                      help='development datastore file to read '
+                           '(default: %default)')
+    parser.add_option('--sqlite', action='store_true', default=False,
+                      help='the datastore file is an SQLite datastore')
+    parser.add_option('--app-id', default=default_app_id(),
+                      help='application ID (default: %default)')
+    parser.add_option('--base-url', default=DEFAULT_BASE_URL,
+                      help='URL the export will be served from '
+                           '(default: %default)')
+    parser.add_option('--processes', type='int',
+                      default=multiprocessing.cpu_count(),
+                      help='number of rendering processes (default: %default)')
+    parser.add_option('--full', action='store_true', default=False,
+                      help='ignore the manifest and render every page')
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('Specify the output directory.')
+
+    options.output_dir = args[0]
+    export(options)
+
+if __name__ == '__main__':
+    main()
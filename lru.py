@@ -0,0 +1,132 @@
+# $Id$
+
+"""
+A small, bounded, in-process least-recently-used cache.
+"""
+
+__docformat__ = 'restructuredtext'
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import threading
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class LRUCache(object):
+    """
+    Dictionary-like cache that holds at most ``capacity`` entries. When
+    the cache is full, storing a new entry evicts the entry that was
+    least recently read or written.
+    """
+    def __init__(self, capacity):
+        """
+        Create a new cache.
+
+        :Parameters:
+            capacity : int
+                maximum number of entries to keep
+        """
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self.__data = {}
+        self.__order = []
+        self.__lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Retrieve an entry, marking it as most recently used.
+
+        :Parameters:
+            key : object
+                the key to look up
+
+            default : object
+                value to return if the key isn't cached
+
+        :rtype: object
+        :return: the cached value, or ``default``
+        """
+        self.__lock.acquire()
+        try:
+            try:
+                value = self.__data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self.__touch(key)
+            return value
+        finally:
+            self.__lock.release()
+
+    def put(self, key, value):
+        """
+        Store an entry, evicting the least recently used entry if the
+        cache is full.
+
+        :Parameters:
+            key : object
+                the key
+
+            value : object
+                the value to cache
+        """
+        self.__lock.acquire()
+        try:
+            if key in self.__data:
+                self.__touch(key)
+            else:
+                if len(self.__order) >= self.capacity:
+                    del self.__data[self.__order.pop(0)]
+                self.__order.append(key)
+            self.__data[key] = value
+        finally:
+            self.__lock.release()
+
+    def remove(self, key):
+        """
+        Remove an entry, if it's cached.
+
+        :Parameters:
+            key : object
+                the key
+
+        :rtype: bool
+        :return: ``True`` if the entry was cached
+        """
+        self.__lock.acquire()
+        try:
+            if key not in self.__data:
+                return False
+            del self.__data[key]
+            self.__order.remove(key)
+            return True
+        finally:
+            self.__lock.release()
+
+    def clear(self):
+        """
+        Remove all entries from the cache.
+        """
+        self.__lock.acquire()
+        try:
+            self.__data.clear()
+            self.__order = []
+        finally:
+            self.__lock.release()
+
+    def __contains__(self, key):
+        return key in self.__data
+
+    def __len__(self):
+        return len(self.__data)
+
+    def __touch(self, key):
+        self.__order.remove(key)
+        self.__order.append(key)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# $Id$
+
+"""
+A local stand-in for the ping services and WebSub hubs the blog notifies
+when an article is published (see ``pings`` and ``defs.DEV_PING_SERVICES``).
+It answers ``weblogUpdates.ping`` at ``/RPC2`` and WebSub publish
+notifications at ``/hub``, and logs each one, so that fan-out, timeouts,
+retries and coalescing can be checked against the development server.
+
+Usage: python mock_ping_server.py [--port N] [--delay SECONDS] [--fail]
+
+``--delay`` makes every response slow (to exercise the per-endpoint
+deadline); ``--fail`` makes every response an error (to exercise the
+retry tasks).
+"""
+
+__docformat__ = 'restructuredtext'
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import logging
+import optparse
+import time
+from SimpleXMLRPCServer import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+DEFAULT_PORT = 8001
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class MockPingRequestHandler(SimpleXMLRPCRequestHandler):
+    """
+    Serves XML-RPC at ``/RPC2`` and WebSub publish notifications at
+    ``/hub``.
+    """
+    rpc_paths = ('/RPC2',)
+
+    def do_POST(self):
+        time.sleep(self.server.delay)
+        if self.path != '/hub':
+            return SimpleXMLRPCRequestHandler.do_POST(self)
+
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        self.server.hub_notifications += 1
+        logging.info('Hub notification #%d: %s' %
+                     (self.server.hub_notifications, body))
+        if self.server.fail:
+            self.send_response(500)
+        else:
+            self.send_response(204)
+        self.end_headers()
+
+class MockPingServer(SimpleXMLRPCServer):
+    """
+    XML-RPC server implementing ``weblogUpdates.ping``.
+    """
+    def __init__(self, port, delay=0, fail=False):
+        SimpleXMLRPCServer.__init__(self,
+                                    ('localhost', port),
+                                    requestHandler=MockPingRequestHandler,
+                                    logRequests=False)
+        self.delay = delay
+        self.fail = fail
+        self.pings = 0
+        self.hub_notifications = 0
+        self.register_function(self.ping, 'weblogUpdates.ping')
+
+    def ping(self, blog_name, blog_url):
+        self.pings += 1
+        logging.info('Ping #%d: %s (%s)' % (self.pings, blog_name, blog_url))
+        if self.fail:
+            return {'flerror' : True, 'message' : 'Mock failure'}
+        return {'flerror' : False, 'message' : 'Thanks for the ping.'}
+
+# -----------------------------------------------------------------------------
+# Main program
+# -----------------------------------------------------------------------------
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--port', type='int', default=DEFAULT_PORT)
+    parser.add_option('--delay', type='float', default=0)
+    parser.add_option('--fail', action='store_true', default=False)
+    options, args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(message)s')
+    server = MockPingServer(options.port, options.delay, options.fail)
+    logging.info('Mock ping server listening on port %d' % options.port)
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,100 @@
+import base64
+import calendar
+import cPickle as pickle
 import datetime
+import hashlib
+import logging
 import sys
+import time
 
 from google.appengine.ext import db
 
+import cache
+import defs
+import search
+import stats
+from lru import LRUCache
+
 # If the local platform is 64 bit, just using sys.maxint can cause problems.
 # It will evaluate to a number that's too large for GAE's 32-bit environment.
 # So, force it to a 32-bit number.
 FETCH_THEM_ALL = ((sys.maxint - 1) >> 32) & 0xffffffff
 
+# Maximum number of rendered article bodies to keep in the per-process
+# cache. The cache is only consulted for articles whose stored HTML is
+# missing or was produced by an older renderer.
+HTML_CACHE_SIZE = 200
+
+_html_cache = LRUCache(HTML_CACHE_SIZE)
+
+# The rst module, once it has been loaded, and how long loading it took.
+_rst = None
+rst_load_seconds = None
+
+# Key name of the single ArticleCounts entity.
+COUNTS_KEY_NAME = 'counts'
+
+# Key name of the single ArchiveRoot entity, and format of the key names
+# of the ArchiveChunk entities under it, by year.
+ARCHIVE_ROOT_KEY_NAME = 'archive'
+ARCHIVE_CHUNK_KEY_FORMAT = 'y%04d'
+
+# Page cursor directions
+OLDER = 'o'
+NEWER = 'n'
+
+def load_rst():
+    """
+    Get the ``rst`` module, importing it on first use. Importing it pulls
+    in docutils and Pygments, which is slow, so it's put off until some
+    request actually needs to render RST. The time the import took is
+    logged and kept in ``rst_load_seconds``.
+
+    :rtype: module
+    :return: the ``rst`` module
+    """
+    global _rst, rst_load_seconds
+    if _rst is None:
+        start = time.time()
+        import rst
+        rst_load_seconds = time.time() - start
+        logging.info('Loaded RST support in %.1f ms' %
+                     (rst_load_seconds * 1000))
+        _rst = rst
+    return _rst
+
+def rst_is_loaded():
+    """
+    :rtype: bool
+    :return: ``True`` if ``load_rst()`` has already imported the ``rst``
+             module in this process
+    """
+    return _rst is not None
+
+def render_body(body):
+    """
+    Convert an article body from RST to HTML, using the per-process
+    cache of rendered bodies, which is keyed by renderer version and a
+    hash of the body.
+
+    :Parameters:
+        body : unicode
+            the RST source. May be ``None``.
+
+    :rtype: unicode
+    :return: the HTML
+    """
+    if not body:
+        return u''
+
+    digest = hashlib.sha1(body.encode('utf-8')).hexdigest()
+    key = (defs.RENDERER_VERSION, digest)
+    html = _html_cache.get(key)
+    if html is None:
+        html = load_rst().rst2html(body)
+        _html_cache.put(key, html)
+    return html
+
 class Article(db.Model):
 
     title = db.StringProperty(required=True)
@@ -16,27 +103,99 @@ class Article(db.Model):
     tags = db.ListProperty(db.Category)
     id = db.IntegerProperty()
     draft = db.BooleanProperty(required=True, default=False)
+    rendered_html = db.TextProperty()
+    renderer_version = db.StringProperty()
+
+    def __init__(self, *args, **kwds):
+        db.Model.__init__(self, *args, **kwds)
+
+        # Remember what's in the datastore, so save() and delete() know
+        # what changed without reading it again. This works from the
+        # loaded values, rather than the properties, because projection
+        # queries load only some of the properties.
+        if kwds.get('_from_entity'):
+            draft = kwds.get('draft', False)
+            self._stored_state = (draft,
+                                  _counted_state(draft,
+                                                 kwds.get('tags') or [],
+                                                 kwds.get('published_when')))
+            self._stored_body = kwds.get('body')
+            self._stored_title = kwds.get('title')
+        else:
+            self._stored_state = (False, None)
+            self._stored_body = None
+            self._stored_title = None
 
     @classmethod
-    def get_all(cls):
-        q = db.Query(Article)
-        q.order('-published_when')
-        return q.fetch(FETCH_THEM_ALL)
+    def create(cls, **kwds):
+        """
+        Create a new, unsaved article, with its ID allocated up front, so
+        that saving it takes a single ``put()``. All new articles that
+        will be saved should be created this way.
+
+        :Parameters:
+            kwds : dict
+                property values for the article
+
+        :rtype: Article
+        :return: the article
+        """
+        id = db.allocate_ids(db.Key.from_path('Article', 1), 1)[0]
+        return cls(key=db.Key.from_path('Article', id), id=id, **kwds)
 
     @classmethod
     def get(cls, id):
-        q = db.Query(Article)
-        q.filter('id = ', id)
-        return q.get()
+        """
+        Look up an article by its ID, with a key lookup (not a query).
+
+        :Parameters:
+            id : int
+                the article's ID
+
+        :rtype: Article
+        :return: the article, or ``None`` if there isn't one (including
+                 when ``id`` isn't a valid ID)
+        """
+        # IDs are positive 64-bit integers.
+        if not (0 < id < 2 ** 63):
+            return None
+        try:
+            return db.get(db.Key.from_path('Article', id))
+        except (db.BadArgumentError, db.BadKeyError):
+            return None
 
     @classmethod
-    def published_query(cls):
-        q = db.Query(Article)
+    def published_query(cls, keys_only=False):
+        q = db.Query(Article, keys_only=keys_only)
         q.filter('draft = ', False)
         return q
 
     @classmethod
-    def published(cls):
+    def published(cls, index=None):
+        """
+        Get all published articles, newest first. The articles are listed
+        by the archive index and looked up by key, so the result always
+        reflects the latest changes; it's cached until the blog's content
+        changes.
+
+        :Parameters:
+            index : ArchiveIndex
+                the archive index, if the caller already has it
+
+        :rtype: list
+        :return: list of ``Article`` objects
+        """
+        def run_query():
+            return _get_articles(_load_index(index).summaries)
+        return cache.cached_query('Article.published', (), run_query)
+
+    @classmethod
+    def fetch_published(cls):
+        """
+        Query the datastore for all published articles, newest first. The
+        query is only eventually consistent, so use this to rebuild the
+        derived data (e.g., ``ArticleCounts``), not to serve pages.
+        """
         return Article.published_query()\
                       .order('-published_when')\
                       .fetch(FETCH_THEM_ALL)
@@ -44,36 +203,27 @@ class Article(db.Model):
     @classmethod
     def get_all_tags(cls):
         """
-        Return all tags, as TagCount objects, optionally sorted by frequency
-        (highest to lowest).
-        """
-        tag_counts = {}
-        for article in Article.published():
-            for tag in article.tags:
-                tag = unicode(tag)
-                try:
-                    tag_counts[tag] += 1
-                except KeyError:
-                    tag_counts[tag] = 1
+        Return the number of published articles for each tag.
 
-        return tag_counts
+        :rtype: dict
+        :return: a dictionary mapping each tag (a unicode string) to its
+                 count
+        """
+        return ArticleCounts.load().get_tag_counts()
 
     @classmethod
     def get_all_datetimes(cls):
-        dates = {}
-        for article in Article.published():
-            date = datetime.datetime(article.published_when.year,
-                                     article.published_when.month,
-                                     article.published_when.day)
-            try:
-                dates[date] += 1
-            except KeyError:
-                dates[date] = 1
+        """
+        Return the number of published articles for each day.
 
-        return dates
+        :rtype: dict
+        :return: a dictionary mapping each day (a ``datetime.datetime``,
+                 with a zero time component) to its count
+        """
+        return ArticleCounts.load().get_day_counts()
 
     @classmethod
-    def all_for_month(cls, year, month):
+    def month_range_query(cls, year, month, query=None):
         start_date = datetime.date(year, month, 1)
         if start_date.month == 12:
             next_year = start_date.year + 1
@@ -83,18 +233,185 @@ class Article(db.Model):
             next_month = start_date.month + 1
 
         end_date = datetime.date(next_year, next_month, 1)
-        return Article.published_query()\
-                       .filter('published_when >=', start_date)\
-                       .filter('published_when <', end_date)\
-                       .order('-published_when')\
-                       .fetch(FETCH_THEM_ALL)
+        if query is None:
+            query = db.Query(Article)
+        return query.filter('published_when >=', start_date)\
+                    .filter('published_when <', end_date)
 
     @classmethod
-    def all_for_tag(cls, tag):
-        return Article.published_query()\
-                      .filter('tags = ', tag)\
-                      .order('-published_when')\
-                      .fetch(FETCH_THEM_ALL)
+    def published_page(cls, page_size, cursor=None, index=None):
+        """
+        Get one page of published articles. The page is found in the
+        archive index, and its articles are looked up by key, through the
+        entity cache (see ``cache.get_entities()``), so a page costs no
+        queries, and it always reflects the latest changes.
+
+        :Parameters:
+            page_size : int
+                maximum number of articles on the page
+
+            cursor : str
+                opaque cursor from a previous ``ArticlePage``, or ``None``
+                for the first (newest) page. An invalid cursor is treated
+                as ``None``.
+
+            index : ArchiveIndex
+                the archive index, if the caller already has it
+
+        :rtype: ArticlePage
+        :return: the page
+        """
+        return _index_page(_load_index(index), page_size, cursor)
+
+    @classmethod
+    def page_for_month(cls, year, month, page_size, cursor=None,
+                       index=None):
+        """
+        Get one page of the published articles for a month. See
+        ``published_page()``.
+        """
+        return _index_page(_load_index(index), page_size, cursor,
+                           month=(year, month))
+
+    @classmethod
+    def page_for_tag(cls, tag, page_size, cursor=None, index=None):
+        """
+        Get one page of the published articles with a given tag. See
+        ``published_page()``.
+        """
+        return _index_page(_load_index(index), page_size, cursor, tag=tag)
+
+    @classmethod
+    def archive_page(cls, number, page_size, index=None):
+        """
+        Get one fixed-size page of the published articles, counting from
+        the oldest: page 1 holds the ``page_size`` oldest articles, page 2
+        the next ``page_size``, and so on. A full page doesn't change when
+        newer articles are published (though deleting or backdating an
+        article shifts the pages after it).
+
+        :Parameters:
+            number : int
+                the page number, starting at 1
+
+            page_size : int
+                number of articles per page
+
+            index : ArchiveIndex
+                the archive index, if the caller already has it
+
+        :rtype: list
+        :return: list of ``Article`` objects, newest first
+        """
+        return _get_articles(_load_index(index).oldest_page(number,
+                                                            page_size))
+
+    @classmethod
+    def published_since(cls, when, limit, index=None):
+        """
+        Get the articles published after a given time, newest first.
+
+        :Parameters:
+            when : datetime
+                the time
+
+            limit : int
+                maximum number of articles to return
+
+            index : ArchiveIndex
+                the archive index, if the caller already has it
+
+        :rtype: list
+        :return: list of ``Article`` objects
+        """
+        return _get_articles(_load_index(index).since(when, limit))
+
+    @classmethod
+    def summary_page(cls,
+                     page_size,
+                     cursor=None,
+                     drafts_only=False,
+                     tag=None,
+                     month=None):
+        """
+        Get one page of article summaries (ID, title, timestamp and draft
+        flag), newest first, for the admin listing. This uses a projection
+        query, so article bodies are never loaded, and the cost depends on
+        the page size, not on the number of articles.
+
+        :Parameters:
+            page_size : int
+                maximum number of summaries on the page
+
+            cursor : str
+                datastore cursor from a previous page's ``older_cursor``,
+                or ``None`` for the first page
+
+            drafts_only : bool
+                ``True`` to list only drafts
+
+            tag : str
+                list only articles with this tag, or ``None``
+
+            month : tuple
+                a ``(year, month)`` tuple, to list only articles from that
+                month, or ``None``
+
+        :rtype: ArticlePage
+        :return: the page. ``articles`` holds ``ArticleSummary`` objects.
+                 Datastore cursors only go forward, so ``newer_cursor`` is
+                 always ``None``.
+        """
+        # Properties in equality filters can't be projected.
+        if drafts_only:
+            projection = ('title', 'published_when', 'id')
+        else:
+            projection = ('title', 'published_when', 'id', 'draft')
+
+        q = db.Query(Article, projection=projection)
+        if month:
+            Article.month_range_query(month[0], month[1], q)
+
+        if drafts_only:
+            q.filter('draft = ', True)
+        if tag:
+            q.filter('tags = ', tag)
+        q.order('-published_when')
+
+        if cursor:
+            try:
+                q.with_cursor(cursor)
+            except db.BadValueError:
+                # Bad cursor; start from the first page.
+                pass
+
+        results = q.fetch(page_size)
+        summaries = [ArticleSummary(a.id,
+                                    a.title,
+                                    a.published_when,
+                                    drafts_only or a.draft)
+                     for a in results]
+
+        older_cursor = None
+        if len(results) == page_size:
+            older_cursor = q.cursor()
+
+        return ArticlePage(summaries, None, older_cursor)
+
+    @classmethod
+    def get_many(cls, ids):
+        """
+        Look up several articles by ID, with one batched key lookup.
+
+        :Parameters:
+            ids : list
+                the article IDs
+
+        :rtype: list
+        :return: the articles that exist, in the same order as ``ids``
+        """
+        keys = [db.Key.from_path('Article', id) for id in ids]
+        return [article for article in db.get(keys) if article is not None]
 
     @classmethod
     def convert_string_tags(cls, tags):
@@ -106,6 +423,72 @@ class Article(db.Model):
                 new_tags.append(db.Category(unicode(t)))
         return new_tags
 
+    def render_html(self):
+        """
+        Get the HTML for the article's body. The HTML stored with the
+        article is used if it was produced by the current renderer;
+        otherwise, the body is rendered (or pulled from the per-process
+        cache). Stale HTML is not written back here; the next ``save()``
+        does that.
+
+        :rtype: unicode
+        :return: the HTML
+        """
+        if (self.rendered_html is not None) and \
+           (self.renderer_version == defs.RENDERER_VERSION):
+            return self.rendered_html
+
+        return self._render_body()
+
+    def _render_body(self):
+        start = time.time()
+        html = render_body(self.body)
+        stats.record_render(self.id, time.time() - start)
+        return html
+
+    @property
+    def html(self):
+        """
+        The article's body, as HTML. It's computed (by ``render_html()``)
+        the first time it's used and then remembered, so pages that never
+        display article bodies never convert any RST.
+        """
+        try:
+            return self._html
+        except AttributeError:
+            self._html = self.render_html()
+            return self._html
+
+    def fingerprint(self):
+        """
+        Get a hash of everything that affects how this article is
+        displayed. The hash changes whenever the article is edited or the
+        renderer changes, so it can be used to version cached renderings
+        of the article.
+
+        :rtype: str
+        :return: the hash, as a hex string
+        """
+        parts = [defs.RENDERER_VERSION,
+                 unicode(self.id),
+                 self.title or u'',
+                 self.body or u'',
+                 u','.join([unicode(tag) for tag in self.tags]),
+                 unicode(self.published_when),
+                 unicode(self.draft)]
+        return hashlib.sha1(u'\0'.join(parts).encode('utf-8')).hexdigest()
+
+    def counted_state(self):
+        """
+        Get the portion of this article's state that contributes to the
+        ``ArticleCounts`` aggregate.
+
+        :rtype: tuple
+        :return: a ``(tags, day)`` tuple, or ``None`` if the article is a
+                 draft (and, therefore, isn't counted)
+        """
+        return _counted_state(self.draft, self.tags, self.published_when)
+
     def __unicode__(self):
         return self.__str__()
 
@@ -114,28 +497,721 @@ class Article(db.Model):
                (self.published_when.strftime('%Y/%m/%d %H:%M'), self.title)
 
     def save(self):
-        previous_version = Article.get(self.id)
-        try:
-            draft = previous_version.draft
-        except AttributeError:
-            draft = False
+        """
+        Store the article, with a single ``put()``, and update everything
+        derived from it. A single-entity ``put()`` is already atomic, so
+        it isn't wrapped in a transaction.
+        """
+        self._prepare_put()
+        self.put()
+        Article.record_changes([self._finish_put()])
 
+    def delete(self):
+        db.Model.delete(self)
+        Article.record_changes([self._finish_delete()])
+
+    @classmethod
+    def save_all(cls, articles):
+        """
+        Store many articles, using batched ``db.put()`` calls of up to
+        ``defs.BULK_BATCH_SIZE`` articles, and update everything derived
+        from them once per batch.
+
+        :Parameters:
+            articles : list
+                the ``Article`` objects to store
+        """
+        for batch in _batches(articles, defs.BULK_BATCH_SIZE):
+            for article in batch:
+                article._prepare_put()
+            db.put(batch)
+            Article.record_changes([article._finish_put()
+                                    for article in batch])
+
+    @classmethod
+    def delete_all(cls, articles):
+        """
+        Delete many articles, using batched ``db.delete()`` calls of up to
+        ``defs.BULK_BATCH_SIZE`` articles, and update everything derived
+        from them once per batch.
+
+        :Parameters:
+            articles : list
+                the ``Article`` objects to delete
+        """
+        for batch in _batches(articles, defs.BULK_BATCH_SIZE):
+            db.delete(batch)
+            Article.record_changes([article._finish_delete()
+                                    for article in batch])
+
+    def _prepare_put(self):
+        draft = self._stored_state[0]
         if draft and (not self.draft):
             # Going from draft to published. Update the timestamp.
             self.published_when = datetime.datetime.now()
 
-        try:
-            obj_id = self.key().id()
-            resave = False
-        except db.NotSavedError:
-            # No key, hence no ID yet. This one hasn't been saved.
-            # We'll save it once without the ID field; this first
-            # save will cause GAE to assign it a key. Then, we can
-            # extract the ID, put it in our ID field, and resave
-            # the object.
-            resave = True
+        # Don't re-render an unchanged body whose stored HTML is current.
+        if (self.body != self._stored_body) or \
+           (self.rendered_html is None) or \
+           (self.renderer_version != defs.RENDERER_VERSION):
+            self.rendered_html = db.Text(self._render_body())
+            self.renderer_version = defs.RENDERER_VERSION
+        self._html = self.rendered_html
 
-        self.put()
-        if resave:
-            self.id = self.key().id()
-            self.put()
+    def _finish_put(self):
+        previous_state = self._stored_state[1]
+        state = self.counted_state()
+        content_changed = (self.body != self._stored_body) or \
+                          (self.title != self._stored_title)
+        self._stored_state = (self.draft, state)
+        self._stored_body = self.body
+        self._stored_title = self.title
+        return ArticleChange(self, previous_state, state, content_changed)
+
+    def _finish_delete(self):
+        previous_state = self._stored_state[1]
+        self._stored_state = (False, None)
+        self._stored_body = None
+        self._stored_title = None
+        return ArticleChange(self, previous_state, None, True)
+
+    @classmethod
+    def record_changes(cls, changes):
+        """
+        Update everything derived from the articles after one or more of
+        them have been stored or deleted.
+
+        :Parameters:
+            changes : list
+                list of ``ArticleChange`` objects
+        """
+        ArticleCounts.apply_changes(changes)
+
+        # Index published articles that are new or whose text changed;
+        # drop articles that were deleted or unpublished.
+        to_index = [c.article for c in changes
+                    if (c.after is not None) and
+                       ((c.before is None) or c.content_changed)]
+        to_remove = [c.article.id for c in changes
+                     if (c.after is None) and (c.before is not None)]
+        search.update_index(to_index, to_remove)
+
+        ArchiveIndex.apply_changes(changes)
+        cache.bump_generation()
+
+    @classmethod
+    def search(cls, query, offset, limit, counts=None):
+        """
+        Full-text search over the published articles. See
+        ``search.search()``.
+
+        :Parameters:
+            query : unicode
+                the query
+
+            offset : int
+                number of ranked results to skip
+
+            limit : int
+                maximum number of results to return
+
+            counts : ArticleCounts
+                the current counts, if the caller already has them
+
+        :rtype: tuple
+        :return: a ``(articles, total)`` tuple, where ``articles`` holds
+                 the matching ``Article`` objects on the requested page,
+                 best first, and ``total`` is the total number of matches
+        """
+        if counts is None:
+            counts = ArticleCounts.load()
+        total_articles = sum(counts.get_day_counts().values())
+        ids, total = search.search(query, offset, limit, total_articles)
+        return (Article.get_many(ids), total)
+
+class ArticleChange(object):
+    """
+    Describes a change to one article, for ``Article.record_changes()``.
+    """
+    def __init__(self, article, before, after, content_changed):
+        """
+        :Parameters:
+            article : Article
+                the article
+
+            before : tuple
+                ``Article.counted_state()`` before the change
+
+            after : tuple
+                ``Article.counted_state()`` after the change
+
+            content_changed : bool
+                ``True`` if the article's title or body changed
+        """
+        self.article = article
+        self.before = before
+        self.after = after
+        self.content_changed = content_changed
+
+class ArticlePage(object):
+    """
+    One page of articles, as returned by the ``Article`` paging methods.
+    """
+    def __init__(self, articles, newer_cursor, older_cursor):
+        """
+        :Parameters:
+            articles : list
+                the ``Article`` objects on this page, newest first
+
+            newer_cursor : str
+                opaque cursor for the page of newer articles, or ``None``
+                if this is the newest page
+
+            older_cursor : str
+                opaque cursor for the page of older articles, or ``None``
+                if this is the oldest page
+        """
+        self.articles = articles
+        self.newer_cursor = newer_cursor
+        self.older_cursor = older_cursor
+
+    @staticmethod
+    def cursor_before(when):
+        """
+        Build the cursor for the page of articles published before a
+        given time. This is the ``older_cursor`` of a page whose last
+        article was published at ``when``.
+
+        :Parameters:
+            when : datetime
+                the publication time
+
+        :rtype: str
+        :return: the cursor
+        """
+        return _encode_cursor(OLDER, when)
+
+    @staticmethod
+    def normalize_cursor(cursor):
+        """
+        Get the canonical form of a cursor, so that equivalent cursors
+        compare (and cache) the same.
+
+        :Parameters:
+            cursor : str
+                the cursor, as received
+
+        :rtype: str
+        :return: the canonical cursor, or ``None`` if the cursor is empty
+                 or invalid (and so selects the first page)
+        """
+        direction, when = _decode_cursor(cursor)
+        if when is None:
+            return None
+        return _encode_cursor(direction, when)
+
+class ArticleSummary(object):
+    """
+    The few fields of an article needed to list it, without its body.
+    """
+    def __init__(self, id, title, published_when, draft, tags=None):
+        self.id = id
+        self.title = title
+        self.published_when = published_when
+        self.draft = draft
+        self.tags = tags or []
+
+class ArticleCounts(db.Model):
+    """
+    Denormalized counts of published articles by tag and by day, so that
+    the tag cloud and the month list can be built without fetching every
+    article. There's exactly one of these, keyed by ``COUNTS_KEY_NAME``.
+    It's kept up to date by ``Article.save()`` and ``Article.delete()``;
+    ``rebuild()`` recomputes it from scratch, should it ever drift.
+    """
+    tag_counts = db.BlobProperty()
+    day_counts = db.BlobProperty()
+
+    @classmethod
+    def load(cls):
+        """
+        Get the counts, building them if they don't exist yet.
+
+        :rtype: ArticleCounts
+        :return: the counts
+        """
+        counts = cls.get_by_key_name(COUNTS_KEY_NAME)
+        if counts is None:
+            counts = cls.rebuild()
+        return counts
+
+    @classmethod
+    def rebuild(cls, changes=None):
+        """
+        Recompute the counts from all published articles, replacing the
+        stored counts.
+
+        :Parameters:
+            changes : list
+                ``ArticleChange`` objects for articles that were just
+                stored or deleted, or ``None``. The query for the
+                published articles is only eventually consistent, so it
+                may not reflect these yet: the changed articles are
+                counted from their new state, not from the query.
+
+        :rtype: ArticleCounts
+        :return: the new counts
+        """
+        changes = changes or []
+        ids = set([change.article.id for change in changes])
+        counts = cls(key_name=COUNTS_KEY_NAME)
+        tag_counts = {}
+        day_counts = {}
+        for article in Article.fetch_published():
+            if article.id not in ids:
+                _apply_state(tag_counts, day_counts,
+                             article.counted_state(), 1)
+        for change in changes:
+            _apply_state(tag_counts, day_counts, change.after, 1)
+        counts.set_counts(tag_counts, day_counts)
+        counts.put()
+        return counts
+
+    @classmethod
+    def apply_changes(cls, changes):
+        """
+        Transactionally update the counts with a list of article changes.
+
+        :Parameters:
+            changes : list
+                list of ``ArticleChange`` objects
+        """
+        changes = [change for change in changes
+                   if change.before != change.after]
+        if not changes:
+            return
+
+        def txn():
+            counts = cls.get_by_key_name(COUNTS_KEY_NAME)
+            if counts is None:
+                return False
+
+            tag_counts = counts.get_tag_counts()
+            day_counts = counts.get_day_counts()
+            for change in changes:
+                _apply_state(tag_counts, day_counts, change.before, -1)
+                _apply_state(tag_counts, day_counts, change.after, 1)
+            counts.set_counts(tag_counts, day_counts)
+            counts.put()
+            return True
+
+        if not db.run_in_transaction(txn):
+            # Nothing to update yet. Build the counts from scratch; the
+            # query they're built from may not see these changes yet, so
+            # they're passed along.
+            cls.rebuild(changes)
+
+    def get_tag_counts(self):
+        if not self.tag_counts:
+            return {}
+        return pickle.loads(self.tag_counts)
+
+    def get_day_counts(self):
+        if not self.day_counts:
+            return {}
+        return pickle.loads(self.day_counts)
+
+    def set_counts(self, tag_counts, day_counts):
+        self.tag_counts = db.Blob(pickle.dumps(tag_counts, 2))
+        self.day_counts = db.Blob(pickle.dumps(day_counts, 2))
+
+class ArchiveRoot(db.Model):
+    """
+    The root of the archive index: lists the years that have an
+    ``ArchiveChunk``, so the index is loaded with key lookups (which are
+    strongly consistent), never with a query. There's exactly one of
+    these, keyed by ``ARCHIVE_ROOT_KEY_NAME``, once the index has been
+    built, even if the blog is empty. It's the parent of the chunks, so
+    the whole index can be updated in one transaction.
+    """
+    years = db.ListProperty(int, indexed=False)
+
+class ArchiveChunk(db.Model):
+    """
+    One year's worth of the archive index (see ``ArchiveIndex``), keyed
+    by ``ARCHIVE_CHUNK_KEY_FORMAT`` under the ``ArchiveRoot``. Each entry
+    is a small ``(id, title, published_when, tags)`` tuple, so a chunk
+    holds thousands of articles well within the entity size limit.
+    """
+    entries = db.BlobProperty()
+
+    def get_entries(self):
+        if not self.entries:
+            return []
+        return pickle.loads(self.entries)
+
+    def set_entries(self, entries):
+        self.entries = db.Blob(pickle.dumps(entries, 2))
+
+class ArchiveIndex(object):
+    """
+    A compact index of the published articles (ID, title, publication
+    time and tags), for the pages that list articles without showing
+    them: the archive, the recent-articles list and the month list. It's
+    stored in ``ArchiveChunk`` entities, one per year, so loading it
+    reads a handful of small entities, not every article. Like
+    ``ArticleCounts``, it's kept up to date by ``Article.save()`` and
+    ``Article.delete()``; ``rebuild()`` recomputes it from scratch.
+    """
+    def __init__(self, chunks):
+        """
+        :Parameters:
+            chunks : list
+                the ``ArchiveChunk`` entities
+        """
+        entries = []
+        for chunk in chunks:
+            entries += chunk.get_entries()
+        entries.sort(key=lambda entry: entry[2], reverse=True)
+        self.summaries = [ArticleSummary(id, title, published_when, False,
+                                         tags)
+                          for id, title, published_when, tags in entries]
+
+    @classmethod
+    def load(cls):
+        """
+        Get the index, building it if it doesn't exist yet. The root and
+        the chunks are read by key, and cached until the blog's content
+        changes.
+
+        :rtype: ArchiveIndex
+        :return: the index
+        """
+        def run_query():
+            root = ArchiveRoot.get(_archive_root_key())
+            if root is None:
+                return cls.rebuild()
+            chunks = db.get([_archive_chunk_key(year) for year in root.years])
+            return [root] + [chunk for chunk in chunks if chunk is not None]
+
+        entities = cache.cached_query('ArchiveIndex.load', (), run_query)
+        return cls([entity for entity in entities
+                    if isinstance(entity, ArchiveChunk)])
+
+    @classmethod
+    def rebuild(cls, changes=None):
+        """
+        Recompute the index from all published articles, replacing the
+        stored root and chunks in a single transaction.
+
+        :Parameters:
+            changes : list
+                ``ArticleChange`` objects for articles that were just
+                stored or deleted, or ``None``. As in
+                ``ArticleCounts.rebuild()``, the changed articles are
+                indexed from their new state, not from the (eventually
+                consistent) query.
+
+        :rtype: list
+        :return: the new ``ArchiveRoot`` and ``ArchiveChunk`` entities
+        """
+        changes = changes or []
+        ids = set([change.article.id for change in changes])
+        articles = [article for article in Article.fetch_published()
+                    if article.id not in ids]
+        articles += [change.article for change in changes
+                     if change.after is not None]
+
+        by_year = {}
+        for article in articles:
+            by_year.setdefault(article.published_when.year, [])\
+                   .append(_archive_entry(article))
+
+        root = ArchiveRoot(key_name=ARCHIVE_ROOT_KEY_NAME,
+                           years=sorted(by_year.keys()))
+        chunks = []
+        for year in root.years:
+            chunk = ArchiveChunk(key_name=ARCHIVE_CHUNK_KEY_FORMAT % year,
+                                 parent=root)
+            chunk.set_entries(by_year[year])
+            chunks.append(chunk)
+
+        def txn():
+            old_root = ArchiveRoot.get(_archive_root_key())
+            if old_root is not None:
+                stale = [_archive_chunk_key(year) for year in old_root.years
+                         if year not in by_year]
+                if stale:
+                    db.delete(stale)
+            db.put([root] + chunks)
+
+        db.run_in_transaction(txn)
+        return [root] + chunks
+
+    @classmethod
+    def apply_changes(cls, changes):
+        """
+        Update the index with a list of article changes, in a single
+        transaction, rewriting only the chunks for the years the changed
+        articles were, or now are, published in. If the index hasn't been
+        built yet, it's built, including the changes.
+
+        :Parameters:
+            changes : list
+                list of ``ArticleChange`` objects
+        """
+        years = set()
+        for change in changes:
+            for state in (change.before, change.after):
+                if state is not None:
+                    years.add(state[1].year)
+        if not years:
+            return
+
+        years = sorted(years)
+        ids = set([change.article.id for change in changes])
+        added = {}
+        for change in changes:
+            if change.after is not None:
+                added.setdefault(change.after[1].year, [])\
+                     .append(_archive_entry(change.article))
+
+        def txn():
+            root = ArchiveRoot.get(_archive_root_key())
+            if root is None:
+                return False
+
+            chunks = db.get([_archive_chunk_key(year) for year in years])
+            root_years = set(root.years)
+            to_put = []
+            to_delete = []
+            for year, chunk in zip(years, chunks):
+                if chunk is None:
+                    chunk = ArchiveChunk(
+                        key_name=ARCHIVE_CHUNK_KEY_FORMAT % year,
+                        parent=root)
+                entries = [entry for entry in chunk.get_entries()
+                           if entry[0] not in ids]
+                entries += added.get(year, [])
+                if entries:
+                    chunk.set_entries(entries)
+                    to_put.append(chunk)
+                    root_years.add(year)
+                else:
+                    if chunk.is_saved():
+                        to_delete.append(chunk)
+                    root_years.discard(year)
+
+            root.years = sorted(root_years)
+            db.put([root] + to_put)
+            if to_delete:
+                db.delete(to_delete)
+            return True
+
+        if not db.run_in_transaction(txn):
+            # Nothing to update yet. Build the index from scratch; the
+            # query it's built from may not see these changes yet, so
+            # they're passed along.
+            cls.rebuild(changes)
+
+    def newest(self, count):
+        """
+        :Parameters:
+            count : int
+                maximum number of articles to return
+
+        :rtype: list
+        :return: ``ArticleSummary`` objects for the newest articles,
+                 newest first
+        """
+        return self.summaries[:count]
+
+    def get_month_counts(self):
+        """
+        :rtype: dict
+        :return: a dictionary mapping each month (a ``datetime.date`` for
+                 the first of the month) to its number of articles
+        """
+        counts = {}
+        for summary in self.summaries:
+            when = summary.published_when
+            _add_count(counts, datetime.date(when.year, when.month, 1), 1)
+        return counts
+
+    def select(self, tag=None, month=None):
+        """
+        Get the summaries of the articles with a given tag, or from a
+        given month.
+
+        :Parameters:
+            tag : str
+                list only articles with this tag, or ``None``
+
+            month : tuple
+                a ``(year, month)`` tuple, to list only articles from that
+                month, or ``None``
+
+        :rtype: list
+        :return: list of ``ArticleSummary`` objects, newest first
+        """
+        summaries = self.summaries
+        if tag is not None:
+            tag = unicode(tag)
+            summaries = [s for s in summaries if tag in s.tags]
+        if month is not None:
+            summaries = [s for s in summaries
+                         if (s.published_when.year,
+                             s.published_when.month) == tuple(month)]
+        return summaries
+
+    def since(self, when, limit):
+        """
+        :Parameters:
+            when : datetime
+                the time
+
+            limit : int
+                maximum number of summaries to return
+
+        :rtype: list
+        :return: ``ArticleSummary`` objects for the articles published
+                 after ``when``, newest first
+        """
+        return [s for s in self.summaries[:limit] if s.published_when > when]
+
+    def oldest_page(self, number, page_size):
+        """
+        Get one fixed-size page, counting from the oldest article. See
+        ``Article.archive_page()``.
+
+        :rtype: list
+        :return: list of ``ArticleSummary`` objects, newest first
+        """
+        end = len(self.summaries) - (number - 1) * page_size
+        if end <= 0:
+            return []
+        return self.summaries[max(0, end - page_size):end]
+
+    def page(self, page_size, cursor=None, tag=None, month=None):
+        """
+        Get one page of the index, newest first. Paging is keyed on
+        ``published_when`` (see ``ArticlePage.cursor_before()``).
+
+        :Parameters:
+            page_size : int
+                maximum number of articles on the page
+
+            cursor : str
+                opaque cursor from a previous ``ArticlePage``, or ``None``
+                for the first (newest) page. An invalid cursor is treated
+                as ``None``.
+
+            tag : str
+                page through only the articles with this tag, or ``None``
+
+            month : tuple
+                a ``(year, month)`` tuple, to page through only the
+                articles from that month, or ``None``
+
+        :rtype: ArticlePage
+        :return: the page, holding ``ArticleSummary`` objects
+        """
+        direction, when = _decode_cursor(cursor)
+        summaries = self.select(tag, month)
+        if direction == NEWER:
+            end = len([s for s in summaries if s.published_when > when])
+            start = max(0, end - page_size)
+            return _make_page(summaries[start:end], start > 0, True)
+
+        start = 0
+        if when is not None:
+            start = len([s for s in summaries if s.published_when >= when])
+        return _make_page(summaries[start:start + page_size],
+                          when is not None,
+                          start + page_size < len(summaries))
+
+def _load_index(index):
+    if index is None:
+        index = ArchiveIndex.load()
+    return index
+
+def _get_articles(summaries):
+    keys = [db.Key.from_path('Article', s.id) for s in summaries]
+    return cache.get_entities(keys)
+
+def _index_page(index, page_size, cursor, tag=None, month=None):
+    page = index.page(page_size, cursor, tag, month)
+    page.articles = _get_articles(page.articles)
+    return page
+
+def _archive_root_key():
+    return db.Key.from_path('ArchiveRoot', ARCHIVE_ROOT_KEY_NAME)
+
+def _archive_chunk_key(year):
+    return db.Key.from_path('ArchiveRoot', ARCHIVE_ROOT_KEY_NAME,
+                            'ArchiveChunk', ARCHIVE_CHUNK_KEY_FORMAT % year)
+
+def _archive_entry(article):
+    return (article.id,
+            article.title,
+            article.published_when,
+            [unicode(tag) for tag in article.tags])
+
+def _make_page(articles, has_newer, has_older):
+    newer_cursor = older_cursor = None
+    if articles:
+        if has_newer:
+            newer_cursor = _encode_cursor(NEWER, articles[0].published_when)
+        if has_older:
+            older_cursor = _encode_cursor(OLDER, articles[-1].published_when)
+    return ArticlePage(articles, newer_cursor, older_cursor)
+
+def _counted_state(draft, tags, published_when):
+    if draft or (published_when is None):
+        return None
+
+    day = datetime.datetime(published_when.year,
+                            published_when.month,
+                            published_when.day)
+    return ([unicode(tag) for tag in tags], day)
+
+def _batches(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def _encode_cursor(direction, when):
+    micros = calendar.timegm(when.utctimetuple()) * 1000000 + when.microsecond
+    return base64.urlsafe_b64encode('%s%d' % (direction, micros)).rstrip('=')
+
+def _decode_cursor(cursor):
+    if not cursor:
+        return (OLDER, None)
+
+    try:
+        cursor = str(cursor)
+        decoded = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction, micros = decoded[0], long(decoded[1:])
+        if direction not in (OLDER, NEWER):
+            raise ValueError
+        when = datetime.datetime.utcfromtimestamp(micros // 1000000) +\
+               datetime.timedelta(microseconds=micros % 1000000)
+    except (TypeError, ValueError, IndexError, OverflowError, UnicodeError):
+        return (OLDER, None)
+
+    return (direction, when)
+
+def _apply_state(tag_counts, day_counts, state, delta):
+    if state is None:
+        return
+
+    tags, day = state
+    for tag in tags:
+        _add_count(tag_counts, tag, delta)
+    _add_count(day_counts, day, delta)
+
+def _add_count(counts, key, delta):
+    count = counts.get(key, 0) + delta
+    if count > 0:
+        counts[key] = count
+    else:
+        counts.pop(key, None)
@@ -0,0 +1,161 @@
+# $Id$
+
+"""
+Notifies ping services and WebSub hubs that the blog has been updated.
+
+All endpoints are contacted in parallel, each with its own deadline, so
+one slow or dead endpoint costs no more than its timeout and doesn't
+delay the others.
+"""
+
+__docformat__ = 'restructuredtext'
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import logging
+import sys
+import urllib
+import xmlrpclib
+
+from google.appengine.api import urlfetch
+
+import defs
+import xmlrpc
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+FORM_CONTENT_TYPE = 'application/x-www-form-urlencoded'
+
+# -----------------------------------------------------------------------------
+# Globals
+# -----------------------------------------------------------------------------
+
+# The transport is stateless, so one instance serves every ping.
+_transport = xmlrpc.GoogleXMLRPCTransport()
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def ping_services():
+    """
+    :rtype: list
+    :return: URLs of the XML-RPC ``weblogUpdates.ping`` services to notify
+    """
+    if defs.ON_GAE:
+        return defs.PING_SERVICES
+    else:
+        return defs.DEV_PING_SERVICES
+
+def websub_hubs():
+    """
+    :rtype: list
+    :return: URLs of the WebSub hubs to notify
+    """
+    if defs.ON_GAE:
+        return defs.WEBSUB_HUBS
+    else:
+        return defs.DEV_WEBSUB_HUBS
+
+def websub_topics():
+    """
+    :rtype: list
+    :return: URLs of the feeds the WebSub hubs are notified about
+    """
+    return [defs.CANONICAL_BLOG_URL + defs.RSS2_URL_PATH,
+            defs.CANONICAL_BLOG_URL + defs.ATOM_URL_PATH]
+
+def send_pings(services, hubs):
+    """
+    Notify ping services and WebSub hubs, in parallel. Each hub is told
+    about each of the feeds (see ``websub_topics()``).
+
+    :Parameters:
+        services : list
+            URLs of XML-RPC ``weblogUpdates.ping`` services
+
+        hubs : list
+            URLs of WebSub hubs
+
+    :rtype: tuple
+    :return: a ``(failed_services, failed_hubs)`` tuple listing the
+             endpoints that couldn't be notified (about every feed)
+    """
+    deadline = defs.PING_TIMEOUT_SECONDS
+    ping_body = xmlrpclib.dumps((defs.BLOG_NAME, defs.CANONICAL_BLOG_URL),
+                                'weblogUpdates.ping')
+    hub_bodies = [urllib.urlencode({'hub.mode' : 'publish',
+                                    'hub.url'  : topic})
+                  for topic in websub_topics()]
+
+    # Start every request before waiting on any of them.
+
+    service_rpcs = []
+    failed_services = []
+    for url in services:
+        logging.debug('Pinging %s' % url)
+        try:
+            service_rpcs.append((url, _transport.start_request(url,
+                                                               ping_body,
+                                                               deadline)))
+        except:
+            logging.error("Can't ping %s: %s" % (url, sys.exc_info()[1]))
+            failed_services.append(url)
+
+    hub_rpcs = []
+    failed_hubs = []
+    for url in hubs:
+        logging.debug('Notifying hub %s' % url)
+        for hub_body in hub_bodies:
+            try:
+                rpc = urlfetch.create_rpc(deadline=deadline)
+                urlfetch.make_fetch_call(rpc,
+                                         url,
+                                         payload=hub_body,
+                                         method=urlfetch.POST,
+                                         headers={'Content-Type' :
+                                                  FORM_CONTENT_TYPE})
+                hub_rpcs.append((url, rpc))
+            except:
+                logging.error("Can't notify hub %s: %s" %
+                              (url, sys.exc_info()[1]))
+                failed_hubs.append(url)
+
+    # Now collect the results.
+
+    for url, rpc in service_rpcs:
+        try:
+            result = _transport.finish_request(rpc, url)[0]
+            if result.get('flerror', False) == True:
+                logging.error('Ping error from %s: %s' %
+                              (url, result.get('message',
+                                               '(No message in RPC result)')))
+                failed_services.append(url)
+            else:
+                logging.debug('Ping to %s successful.' % url)
+        except:
+            logging.error("Can't ping %s: %s" % (url, sys.exc_info()[1]))
+            failed_services.append(url)
+
+    for url, rpc in hub_rpcs:
+        try:
+            status = rpc.get_result().status_code
+        except:
+            logging.error("Can't notify hub %s: %s" % (url, sys.exc_info()[1]))
+            failed_hubs.append(url)
+            continue
+
+        if 200 <= status < 300:
+            logging.debug('Hub %s notified.' % url)
+        else:
+            logging.error('Hub %s returned status code %s' % (url, status))
+            failed_hubs.append(url)
+
+    # List each hub once, however many of its notifications failed.
+    failed_hubs = [url for i, url in enumerate(failed_hubs)
+                   if url not in failed_hubs[:i]]
+    return (failed_services, failed_hubs)
@@ -4,12 +4,42 @@
 Base class for requests handled by this blog software.
 """
 
+import hashlib
 import os
+import time
 
 from google.appengine.ext import webapp
 from google.appengine.ext.webapp import template
 
+# Import Django only after webapp's template module has configured it.
+import django.template
+
 import defs
+import stats
+
+# Make the asset filter available to every template.
+template.register_template_library('assets')
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), defs.TEMPLATE_SUBDIR)
+
+# -----------------------------------------------------------------------------
+# Globals
+# -----------------------------------------------------------------------------
+
+# Compiled templates, by simple name. Each entry is a (template, mtime)
+# tuple; mtime is only recorded (and checked) when reloading templates.
+_template_cache = {}
+
+# Whether changed templates are recompiled (see set_template_reloading()).
+_reload_templates = not defs.ON_GAE
+
+# The templates' digest (see templates_digest()), as a (digest, mtime)
+# tuple; mtime is only recorded (and checked) when reloading templates.
+_templates_digest = None
 
 # -----------------------------------------------------------------------------
 # Classes
@@ -33,9 +63,11 @@ class BlogRequestHandler(webapp.RequestHandler):
         :return: the full path to the template. Does *not* ensure that the
                  template exists.
         """
-        return os.path.join(os.path.dirname(__file__), 
-                            defs.TEMPLATE_SUBDIR,
-                            template_name)
+        return template_path(template_name)
+
+    def initialize(self, request, response):
+        webapp.RequestHandler.initialize(self, request, response)
+        stats.set_route(self.__class__.__name__)
 
     def render_template(self, template_name, template_vars):
         """
@@ -49,5 +81,106 @@ class BlogRequestHandler(webapp.RequestHandler):
                 Dictionary of variables to make available to the template.
                 Can be empty.
         """
-        template_path = self.get_template(template_name)
-        return template.render(template_path, template_vars)
+        start = time.time()
+        try:
+            compiled = load_template(template_name)
+            return compiled.render(django.template.Context(template_vars))
+        finally:
+            stats.record('template', time.time() - start)
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def template_path(template_name):
+    """
+    Return the full path of a template. Does *not* ensure that the
+    template exists.
+
+    :Parameters:
+        template_name : str
+            Simple name of the template
+
+    :rtype: str
+    :return: the full path to the template
+    """
+    return os.path.join(TEMPLATE_DIR, template_name)
+
+def set_template_reloading(enabled):
+    """
+    Choose whether changed templates are recompiled. By default, they
+    are in development (i.e., when not running on GAE), and not on GAE.
+    Scripts that render many pages (e.g., the exporter) turn reloading
+    off, which saves checking the template files on every render.
+
+    :Parameters:
+        enabled : bool
+            ``True`` to recompile templates when they change
+    """
+    global _reload_templates
+    _reload_templates = enabled
+
+def load_template(template_name):
+    """
+    Get a compiled template, compiling it only the first time it's used
+    in this process. When reloading is on (see
+    ``set_template_reloading()``), the template is recompiled whenever
+    any file in the template directory changes, since a template's
+    ``extends`` and ``include`` chain can reach any of them.
+
+    :Parameters:
+        template_name : str
+            Simple name of the template
+
+    :rtype: django.template.Template
+    :return: the compiled template
+    """
+    entry = _template_cache.get(template_name)
+    if not _reload_templates:
+        if entry:
+            return entry[0]
+        mtime = None
+    else:
+        mtime = _templates_mtime()
+        if entry and (entry[1] == mtime):
+            return entry[0]
+
+    # When reloading, bypass webapp's own template cache, which never
+    # notices changes.
+    compiled = template.load(template_path(template_name),
+                             debug=_reload_templates)
+    _template_cache[template_name] = (compiled, mtime)
+    return compiled
+
+def templates_digest():
+    """
+    Get a hash of the templates and the application version, for keys of
+    cached renderings that must change whenever either does. It's
+    computed once per process (or, when reloading templates, whenever a
+    template changes).
+
+    :rtype: str
+    :return: the hash, as a hex string
+    """
+    global _templates_digest
+
+    mtime = None
+    if _reload_templates:
+        mtime = _templates_mtime()
+    if (_templates_digest is not None) and (_templates_digest[1] == mtime):
+        return _templates_digest[0]
+
+    digest = hashlib.sha1(os.environ.get('CURRENT_VERSION_ID', ''))
+    for name in sorted(os.listdir(TEMPLATE_DIR)):
+        f = open(os.path.join(TEMPLATE_DIR, name), 'rb')
+        try:
+            digest.update(name + '\0' + f.read())
+        finally:
+            f.close()
+
+    _templates_digest = (digest.hexdigest(), mtime)
+    return _templates_digest[0]
+
+def _templates_mtime():
+    return max([os.path.getmtime(os.path.join(TEMPLATE_DIR, name))
+                for name in os.listdir(TEMPLATE_DIR)])
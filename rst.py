@@ -8,17 +8,129 @@ RST support.
 # Imports
 # -----------------------------------------------------------------------------
 
-import logging
-import os
-import sys
+import copy
+import hashlib
+import threading
 import StringIO
 
-from docutils import core, nodes, parsers
-from docutils.parsers.rst import states, directives
-from docutils.core import publish_parts
+from docutils import core, frontend, nodes, parsers, readers, writers
+from docutils import io as docutils_io
+from docutils.parsers.rst import directives
 
 from pygments import lexers, util, highlight, formatters
-from pygments.styles import get_style_by_name
+
+from defs import DEFAULT_PYGMENTS_STYLE
+from lru import LRUCache
+
+# ---------------------------------------------------------------------------
+# Constants
+# ---------------------------------------------------------------------------
+
+# Maximum number of highlighted code blocks to keep in the per-process
+# cache.
+HIGHLIGHT_CACHE_SIZE = 500
+
+# ---------------------------------------------------------------------------
+# Globals
+# ---------------------------------------------------------------------------
+
+# Pygments lexers, by language name. None means the language isn't
+# supported.
+_lexers = {}
+
+# Pygments HTML formatters, by style name.
+_formatters = {}
+
+# Highlighted code, by (language, style, code hash).
+_highlight_cache = LRUCache(HIGHLIGHT_CACHE_SIZE)
+
+# Shared RSTRenderer objects, by Pygments style name.
+_renderers = {}
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class RSTRenderer(object):
+    """
+    Converts RST documents to HTML fragments. ``publish_parts()`` builds
+    a new option parser, settings object, reader, parser and writer for
+    every document; a renderer builds them once and reuses them for every
+    document it renders. Use ``get_renderer()`` to get the shared
+    instance for a style.
+
+    The reader, parser and writer keep per-document state while they
+    work, so each thread gets its own; the settings are copied for each
+    document, so they're shared.
+    """
+    def __init__(self, pygments_style=DEFAULT_PYGMENTS_STYLE):
+        """
+        :Parameters:
+            pygments_style : str
+                the Pygments style name
+        """
+        self.__local = threading.local()
+
+        # Don't read any config files: docutils would try to read them
+        # via the codecs module, which doesn't work with AppEngine.
+        option_parser = frontend.OptionParser(
+            components=self.get_components(),
+            defaults={'style' : pygments_style},
+            read_config_files=False)
+        self.settings = option_parser.get_default_values()
+
+    def get_components(self):
+        """
+        Get the current thread's reader, parser and writer, creating them
+        the first time the thread needs them.
+
+        :rtype: tuple
+        :return: a ``(reader, parser, writer)`` tuple
+        """
+        components = getattr(self.__local, 'components', None)
+        if components is None:
+            components = (readers.get_reader_class('standalone')(),
+                          parsers.get_parser_class('restructuredtext')(),
+                          writers.get_writer_class('html4css1')())
+            self.__local.components = components
+        return components
+
+    def render(self, s):
+        """
+        Convert one RST document to HTML.
+
+        :Parameters:
+            s : unicode
+                the RST source
+
+        :rtype: unicode
+        :return: the HTML fragment
+        """
+        reader, parser, writer = self.get_components()
+        publisher = core.Publisher(
+            reader,
+            parser,
+            writer,
+            settings=copy.copy(self.settings),
+            source_class=docutils_io.StringInput,
+            destination_class=docutils_io.StringOutput)
+        publisher.set_source(source=s, source_path=None)
+        publisher.set_destination(destination_path=None)
+        publisher.publish()
+        return publisher.writer.parts['fragment']
+
+    def render_all(self, documents):
+        """
+        Convert a batch of RST documents to HTML.
+
+        :Parameters:
+            documents : list
+                the RST sources
+
+        :rtype: list
+        :return: the HTML fragments, in the same order
+        """
+        return [self.render(s) for s in documents]
 
 # ---------------------------------------------------------------------------
 # Functions
@@ -52,9 +164,16 @@ def code_block(name, arguments, options, content, lineno,
     """
 
     def _custom_highlighter(code):
-        outfile = StringIO.StringIO()
-        highlight(code, lexer, formatter, outfile)
-        return outfile.getvalue()
+        digest = hashlib.sha1(code.encode('utf-8')).hexdigest()
+        key = (language, DEFAULT_PYGMENTS_STYLE, digest)
+        html = _highlight_cache.get(key)
+        if html is None:
+            outfile = StringIO.StringIO()
+            highlight(code, lexer, get_formatter(DEFAULT_PYGMENTS_STYLE),
+                      outfile)
+            html = outfile.getvalue()
+            _highlight_cache.put(key, html)
+        return html
     
     def _noop_highlighter(code):
         return code
@@ -66,20 +185,14 @@ def code_block(name, arguments, options, content, lineno,
     # Get the highlighter
 
     if language in ['xml', 'html']:
-        lexer = lexers.get_lexer_by_name('text')
         highlighter = _noop_highlighter
         element = 'pre'
 
     else:
-        try:
-            lexer = lexers.get_lexer_by_name(language)
-            formatter = formatters.get_formatter_by_name('html')
-    
-    
+        lexer = get_lexer(language)
+        if lexer is not None:
             highlighter = _custom_highlighter
-    
-        except util.ClassNotFound:
-            lexer = lexers.get_lexer_by_name('text')
+        else:
             highlighter = _noop_highlighter
             element = 'pre'
 
@@ -103,16 +216,75 @@ def code_block(name, arguments, options, content, lineno,
     raw = nodes.raw('', html, format='html')
     return [raw]
 
-def rst2html(s, pygments_style='colorful', stylesheet=None):
-    settings = {'style' : pygments_style, 'config' : None}
+def get_lexer(language):
+    """
+    Get the Pygments lexer for a language. Lexers are created once per
+    process and shared.
+
+    :Parameters:
+        language : str
+            the language name, as used in the ``code-block`` directive
+
+    :rtype: pygments.lexer.Lexer
+    :return: the lexer, or ``None`` if Pygments doesn't know the language
+    """
+    try:
+        return _lexers[language]
+    except KeyError:
+        try:
+            lexer = lexers.get_lexer_by_name(language)
+        except util.ClassNotFound:
+            lexer = None
+        _lexers[language] = lexer
+        return lexer
 
-    # Necessary, because otherwise docutils attempts to read a config file
-    # via the codecs module, which doesn't work with AppEngine.
-    os.environ['DOCUTILSCONFIG'] = ""
-    parts = publish_parts(source=s,
-                          writer_name='html4css1',
-                          settings_overrides=settings)
-    return parts['fragment']
+def get_formatter(style):
+    """
+    Get the Pygments HTML formatter for a style. Formatters are created
+    once per process and shared.
+
+    :Parameters:
+        style : str
+            the Pygments style name
+
+    :rtype: pygments.formatter.Formatter
+    :return: the formatter
+    """
+    try:
+        return _formatters[style]
+    except KeyError:
+        formatter = formatters.get_formatter_by_name('html', style=style)
+        _formatters[style] = formatter
+        return formatter
+
+def get_renderer(pygments_style=DEFAULT_PYGMENTS_STYLE):
+    """
+    Get the shared ``RSTRenderer`` for a Pygments style, creating it the
+    first time it's needed.
+
+    :Parameters:
+        pygments_style : str
+            the Pygments style name
+
+    :rtype: RSTRenderer
+    :return: the renderer
+    """
+    try:
+        return _renderers[pygments_style]
+    except KeyError:
+        renderer = RSTRenderer(pygments_style)
+        _renderers[pygments_style] = renderer
+        return renderer
+
+def rst2html(s, pygments_style=DEFAULT_PYGMENTS_STYLE, stylesheet=None):
+    return get_renderer(pygments_style).render(s)
+
+def rst2html_all(documents, pygments_style=DEFAULT_PYGMENTS_STYLE):
+    """
+    Convert a batch of RST documents to HTML. See
+    ``RSTRenderer.render_all()``.
+    """
+    return get_renderer(pygments_style).render_all(documents)
 
 # ---------------------------------------------------------------------------
 # Initialization
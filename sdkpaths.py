@@ -0,0 +1,51 @@
+# $Id$
+
+"""
+Sets up ``sys.path`` for the scripts that use the application's modules
+outside App Engine: the exporter, the benchmarks and the tests. The App
+Engine SDK must be installed locally; set ``GAE_SDK`` to its location if
+it isn't in ``/usr/local/google_appengine``.
+"""
+
+__docformat__ = 'restructuredtext'
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import os
+import sys
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SDK_DIR = '/usr/local/google_appengine'
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def setup_paths(need_sdk=True):
+    """
+    Put the application and, optionally, the App Engine SDK (and the
+    libraries it bundles) on ``sys.path``. If the SDK is needed but can't
+    be found, this raises ``ImportError``.
+
+    :Parameters:
+        need_sdk : bool
+            ``False`` if only modules (such as ``rst``) that don't depend
+            on App Engine will be used
+    """
+    paths = [APP_DIR]
+    if need_sdk:
+        paths.append(os.environ.get('GAE_SDK', DEFAULT_SDK_DIR))
+
+    for path in paths:
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+    if need_sdk:
+        import dev_appserver
+        dev_appserver.fix_sys_path()
@@ -0,0 +1,535 @@
+# $Id$
+
+"""
+Full-text search over published articles, backed by an inverted index
+stored in the datastore.
+
+Each (term, article) pair has its own small ``SearchPosting`` entity,
+holding the term's weighted frequency in the article and its first few
+positions; the postings for a term share a ``SearchTerm`` parent key, so
+they can be read with a (strongly consistent) ancestor query. Each
+indexed article has a ``SearchDocument`` entity listing its terms, so
+the article can be removed from (or re-indexed in) exactly the postings
+that mention it. The index is kept up to date by ``Article.save()`` and
+``Article.delete()`` (via ``update_index()``); ``rebuild()`` regenerates
+it from scratch.
+
+Since every posting belongs to a single article, indexing an article
+only ever writes that article's own entities: it never reads or
+rewrites a shared one, so concurrent saves can't lose each other's
+postings, and the cost of a save doesn't grow with the size of the
+blog. A query costs one ancestor query per query term, which reads at
+most ``MAX_POSTINGS_PER_TERM`` postings.
+
+The index is stored in *generations*: every index entity's key name
+includes its generation, and a ``SearchIndexState`` entity records which
+generation is served. ``start_rebuild()`` builds a new generation in the
+background, a batch of articles per task, while searches keep using the
+old one; once the new generation is complete, it's served, and the old
+one is removed (again a batch per task). Saves made during a rebuild
+update both generations.
+"""
+
+__docformat__ = 'restructuredtext'
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import logging
+import math
+import re
+
+from google.appengine.ext import db
+
+try:
+    from google.appengine.api import taskqueue
+except ImportError:
+    # Older SDKs
+    from google.appengine.api.labs import taskqueue
+
+import defs
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+# Title terms count this many times as much as body terms.
+TITLE_WEIGHT = 3
+
+# Number of positions kept per term per article, for phrase matching.
+MAX_POSITIONS = 10
+
+# Score bonus for each pair of query terms found next to each other.
+PHRASE_BONUS = 2.0
+
+MIN_TERM_LENGTH = 2
+MAX_TERM_LENGTH = 64
+
+# Query terms beyond this many are ignored, which bounds a query's cost.
+MAX_QUERY_TERMS = 10
+
+# Postings read per query term, highest weight first, which bounds a
+# query's cost however common the term is. A term that's in more articles
+# than this only matches the ones where it weighs the most.
+MAX_POSTINGS_PER_TERM = 1000
+
+# Version of the index format and of the tokenizer. Changing either makes
+# the stored index stale; see rebuild_if_stale().
+INDEX_VERSION = 2
+
+# Articles indexed (or index documents removed) per rebuild task
+REBUILD_BATCH_SIZE = 50
+
+# Delay before the first rebuild task, in seconds. Saves made once the
+# rebuild has started update the new generation themselves; this gives
+# the (eventually consistent) article query time to see the ones made
+# just before.
+REBUILD_START_DELAY = 10
+
+# Handler for the rebuild tasks (see admin.py)
+REBUILD_TASK_URL = '/admin/tasks/search/'
+
+STATE_KEY_NAME = 'search'
+
+STOP_WORDS = set(('an', 'and', 'are', 'as', 'at', 'be', 'by', 'for',
+                  'from', 'has', 'he', 'in', 'is', 'it', 'its', 'of', 'on',
+                  'or', 'that', 'the', 'to', 'was', 'were', 'will', 'with'))
+
+WORD_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class SearchIndexState(db.Model):
+    """
+    Which generation of the index is served, which one (if any) is being
+    built, and the ``INDEX_VERSION`` the served one was built by. There's
+    at most one of these, keyed by ``STATE_KEY_NAME``; without it,
+    generation 0 is served.
+    """
+    generation = db.IntegerProperty(default=0, indexed=False)
+    building = db.IntegerProperty(indexed=False)
+    version = db.IntegerProperty(indexed=False)
+
+class SearchTerm(db.Model):
+    """
+    The parent of one term's postings. The key name is the term, prefixed
+    with ``t<generation>:`` (key names can't start with a digit), or just
+    ``t:`` in generation 0. Only the key is used: no ``SearchTerm``
+    entity is stored. (Older versions stored all of a term's postings in
+    one; removing generation 0 removes those.)
+    """
+
+class SearchPosting(db.Model):
+    """
+    One term's occurrences in one article. The parent is the term's
+    ``SearchTerm`` key, and the key name is the article ID, prefixed with
+    ``p:``. The weight is indexed, so that the heaviest postings can be
+    read first (see ``MAX_POSTINGS_PER_TERM``).
+    """
+    weight = db.IntegerProperty()
+    positions = db.ListProperty(int, indexed=False)
+
+class SearchDocument(db.Model):
+    """
+    The terms under which one article is indexed. The key name is the
+    article ID, prefixed like a ``SearchTerm`` key name, but with ``d``.
+    """
+    terms = db.StringListProperty(indexed=False)
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def tokenize(text):
+    """
+    Split text into index terms: lower-cased words, minus stop words and
+    very short words.
+
+    :Parameters:
+        text : unicode
+            the text
+
+    :rtype: list
+    :return: the terms, in order
+    """
+    if not text:
+        return []
+    return [word for word in WORD_PATTERN.findall(text.lower())
+            if (MIN_TERM_LENGTH <= len(word) <= MAX_TERM_LENGTH) and
+               (word not in STOP_WORDS)]
+
+def update_index(articles, removed_ids):
+    """
+    Add or re-index articles, and remove others, reading and writing the
+    affected index entities in batches. During a rebuild, both the served
+    generation and the one being built are updated.
+
+    :Parameters:
+        articles : list
+            published ``Article`` objects to (re-)index
+
+        removed_ids : list
+            IDs of articles to remove from the index
+    """
+    if not (articles or removed_ids):
+        return
+
+    state = _get_state()
+    _update_generation(articles, removed_ids, state.generation)
+    if state.building is not None:
+        _update_generation(articles, removed_ids, state.building)
+
+def search(query, offset, limit, total_articles):
+    """
+    Find the published articles matching a query. Every query term must
+    appear in an article for it to match. Matches are ranked by TF-IDF,
+    with a bonus for query terms that appear next to each other.
+
+    :Parameters:
+        query : unicode
+            the query, as typed by the reader
+
+        offset : int
+            number of ranked results to skip
+
+        limit : int
+            maximum number of results to return
+
+        total_articles : int
+            number of published articles, for the IDF computation
+
+    :rtype: tuple
+    :return: a ``(ids, total)`` tuple, where ``ids`` lists the IDs of the
+             matching articles on the requested page, best first, and
+             ``total`` is the total number of matches
+    """
+    names = []
+    for name in tokenize(query):
+        if name not in names:
+            names.append(name)
+    names = names[:MAX_QUERY_TERMS]
+    if not names:
+        return ([], 0)
+
+    generation = _get_state().generation
+    postings = []
+    for name in names:
+        p = _get_postings(name, generation)
+        if not p:
+            # The term appears nowhere, so nothing can match all of them.
+            return ([], 0)
+        postings.append(p)
+
+    matches = set(postings[0].keys())
+    for p in postings[1:]:
+        matches.intersection_update(p.keys())
+
+    total_articles = max(total_articles, len(matches), 1)
+    scores = []
+    for id in matches:
+        score = 0.0
+        for p in postings:
+            weight = p[id][0]
+            idf = math.log(1.0 + float(total_articles) / len(p))
+            score += (1.0 + math.log(weight)) * idf
+
+        # Phrase bonus for consecutive query terms appearing together.
+        for first, second in zip(postings, postings[1:]):
+            following = set([pos - 1 for pos in second[id][1]])
+            if following.intersection(first[id][1]):
+                score += PHRASE_BONUS
+
+        scores.append((-score, id))
+
+    scores.sort()
+    return ([id for score, id in scores[offset:offset + limit]],
+            len(scores))
+
+def start_rebuild(only_if_stale=False):
+    """
+    Start regenerating the index from scratch, in a new generation. The
+    work is done by a chain of tasks (see ``rebuild_batch()``); until
+    it's done, searches use the current generation. Starting a rebuild
+    abandons any rebuild that's still running.
+
+    :Parameters:
+        only_if_stale : bool
+            ``True`` to start the rebuild only if the served generation
+            was built by an older version of this module and no rebuild
+            is running (see ``rebuild_if_stale()``)
+
+    :rtype: int
+    :return: the generation being built, or ``None`` if no rebuild was
+             started
+    """
+    def txn():
+        state = _get_state()
+        if only_if_stale and ((state.version == INDEX_VERSION) or
+                              (state.building is not None)):
+            return None
+
+        abandoned = state.building
+        state.building = max(state.generation, abandoned or 0) + 1
+        state.put()
+        _queue_task({'generation' : state.building},
+                    countdown=REBUILD_START_DELAY,
+                    transactional=True)
+        if abandoned is not None:
+            _queue_task({'remove' : abandoned}, transactional=True)
+        return state.building
+
+    generation = db.run_in_transaction(txn)
+    if generation is not None:
+        logging.info('Building search index generation %d.' % generation)
+    return generation
+
+def rebuild_if_stale():
+    """
+    Start a rebuild if the served generation was built by an older
+    version of this module (see ``INDEX_VERSION``), unless one is already
+    running. Call this when a new version of the application starts
+    (e.g., from the warmup request).
+
+    :rtype: bool
+    :return: ``True`` if a rebuild was started
+    """
+    return start_rebuild(only_if_stale=True) is not None
+
+def rebuild_batch(query, generation, cursor=None):
+    """
+    Index the next batch of articles into a generation being built, then
+    queue the task for the batch after it. After the last batch, switch
+    to serving the new generation, and queue the removal of the old one.
+
+    :Parameters:
+        query : db.Query
+            keys-only query for the published articles. Each article is
+            looked up by key before it's indexed, so a stale query result
+            can't put an old version of it in the index.
+
+        generation : int
+            the generation being built
+
+        cursor : str
+            the query cursor where the previous batch ended, or ``None``
+            for the first batch
+
+    :rtype: bool
+    :return: ``True`` if this completed the rebuild
+    """
+    if _get_state().building != generation:
+        logging.info('Search index generation %d is no longer being '
+                     'built.' % generation)
+        return False
+
+    if cursor:
+        query.with_cursor(cursor)
+    keys = query.fetch(REBUILD_BATCH_SIZE)
+    articles = [article for article in db.get(keys)
+                if (article is not None) and (not article.draft)]
+    _update_generation(articles, [], generation)
+    if len(keys) == REBUILD_BATCH_SIZE:
+        _queue_task({'generation' : generation, 'cursor' : query.cursor()})
+        return False
+
+    def txn():
+        state = _get_state()
+        if state.building != generation:
+            return None
+        old_generation = state.generation
+        state.generation = generation
+        state.building = None
+        state.version = INDEX_VERSION
+        state.put()
+        _queue_task({'remove' : old_generation}, transactional=True)
+        return old_generation
+
+    old_generation = db.run_in_transaction(txn)
+    if old_generation is None:
+        return False
+    logging.info('Now serving search index generation %d.' % generation)
+    return True
+
+def remove_batch(generation):
+    """
+    Remove the next batch of a generation that's no longer served or
+    being built, then queue the task for the batch after it.
+
+    :Parameters:
+        generation : int
+            the generation
+    """
+    state = _get_state()
+    if generation in (state.generation, state.building):
+        logging.error('Not removing search index generation %d: in use.' %
+                      generation)
+        return
+
+    # The documents list every posting, so the postings are removed by
+    # key. The queries are only eventually consistent, but nothing writes
+    # to this generation any more, so a document that's seen again is
+    # just deleted again.
+    prefix = _key_prefix('d', generation)
+    documents = _key_name_query(SearchDocument, prefix)\
+                .fetch(REBUILD_BATCH_SIZE)
+    postings = []
+    for document in documents:
+        id = int(document.key().name()[len(prefix):])
+        postings += [_posting_key(name, id, generation)
+                     for name in document.terms]
+    for batch in _batches(postings):
+        db.delete(batch)
+    db.delete(documents)
+
+    # Term entities stored by older versions
+    terms = _key_name_query(SearchTerm, _key_prefix('t', generation),
+                            keys_only=True).fetch(REBUILD_BATCH_SIZE)
+    db.delete(terms)
+
+    if REBUILD_BATCH_SIZE in (len(documents), len(terms)):
+        _queue_task({'remove' : generation})
+    else:
+        logging.info('Removed search index generation %d.' % generation)
+
+def _article_postings(article):
+    # term -> (weight, positions)
+    postings = {}
+    position = 0
+    for text, weight in ((article.title, TITLE_WEIGHT), (article.body, 1)):
+        for name in tokenize(text):
+            try:
+                old_weight, positions = postings[name]
+            except KeyError:
+                old_weight, positions = 0, []
+            if len(positions) < MAX_POSITIONS:
+                positions.append(position)
+            postings[name] = (old_weight + weight, positions)
+            position += 1
+
+        # Keep phrases from spanning the title and the body.
+        position += 1
+
+    return postings
+
+def _update_generation(articles, removed_ids, generation):
+    new_postings = {}
+    for article in articles:
+        new_postings[article.id] = _article_postings(article)
+
+    ids = new_postings.keys() + list(removed_ids)
+    documents = _get([_document_key(id, generation) for id in ids])
+
+    # If a batch fails part way, every posting that may have been written
+    # must still be listed in its article's document, so that the next
+    # update removes it. So any new terms are first added to the
+    # documents, and the documents are trimmed once the postings are
+    # written.
+    listed = []
+    final = []
+    postings_to_put = []
+    postings_to_delete = []
+    documents_to_delete = []
+    for id, document in zip(ids, documents):
+        postings = new_postings.get(id, {})
+        old_terms = set()
+        if document is not None:
+            old_terms = set(document.terms)
+        postings_to_delete += [_posting_key(name, id, generation)
+                               for name in old_terms
+                               if name not in postings]
+        for name, (weight, positions) in postings.items():
+            postings_to_put.append(
+                SearchPosting(parent=_term_key(name, generation),
+                              key_name=_posting_key_name(id),
+                              weight=weight,
+                              positions=positions))
+
+        key_name = _document_key_name(id, generation)
+        if id in new_postings:
+            if not old_terms.issuperset(postings.keys()):
+                listed.append(SearchDocument(
+                    key_name=key_name,
+                    terms=list(old_terms.union(postings.keys()))))
+            final.append(SearchDocument(key_name=key_name,
+                                        terms=postings.keys()))
+        elif document is not None:
+            documents_to_delete.append(document.key())
+
+    for batch in _batches(listed):
+        db.put(batch)
+    for batch in _batches(postings_to_put):
+        db.put(batch)
+    for batch in _batches(postings_to_delete):
+        db.delete(batch)
+    for batch in _batches(final):
+        db.put(batch)
+    for batch in _batches(documents_to_delete):
+        db.delete(batch)
+
+def _get_postings(name, generation):
+    # article ID -> (weight, positions), for the heaviest postings
+    q = SearchPosting.all().ancestor(_term_key(name, generation))
+    if generation > 0:
+        # Generation 0 predates the indexed weights.
+        q.order('-weight')
+    postings = {}
+    for posting in q.fetch(MAX_POSTINGS_PER_TERM):
+        id = int(posting.key().name()[2:])
+        postings[id] = (posting.weight, posting.positions)
+    return postings
+
+def _get_state():
+    state = SearchIndexState.get_by_key_name(STATE_KEY_NAME)
+    if state is None:
+        state = SearchIndexState(key_name=STATE_KEY_NAME)
+    return state
+
+def _queue_task(params, **kwds):
+    taskqueue.add(url=REBUILD_TASK_URL, params=params, **kwds)
+
+def _key_prefix(kind_prefix, generation):
+    # Generation 0 has the key names used before there were generations.
+    if generation:
+        return '%s%d:' % (kind_prefix, generation)
+    return kind_prefix + ':'
+
+def _key_name_query(model, prefix, keys_only=False):
+    # All root entities whose key names start with the prefix (which ends
+    # with ":", so the next character up is ";").
+    q = model.all(keys_only=keys_only)
+    q.filter('__key__ >=', db.Key.from_path(model.kind(), prefix))
+    q.filter('__key__ <', db.Key.from_path(model.kind(), prefix[:-1] + ';'))
+    return q
+
+def _term_key_name(name, generation):
+    return _key_prefix('t', generation) + name
+
+def _term_key(name, generation):
+    return db.Key.from_path('SearchTerm', _term_key_name(name, generation))
+
+def _posting_key_name(id):
+    return 'p:%d' % id
+
+def _posting_key(name, id, generation):
+    return db.Key.from_path('SearchTerm', _term_key_name(name, generation),
+                            'SearchPosting', _posting_key_name(id))
+
+def _document_key_name(id, generation):
+    return _key_prefix('d', generation) + str(id)
+
+def _document_key(id, generation):
+    return db.Key.from_path('SearchDocument',
+                            _document_key_name(id, generation))
+
+def _get(keys):
+    entities = []
+    for batch in _batches(keys):
+        entities += db.get(batch)
+    return entities
+
+def _batches(items):
+    for i in range(0, len(items), defs.BULK_BATCH_SIZE):
+        yield items[i:i + defs.BULK_BATCH_SIZE]
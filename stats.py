@@ -0,0 +1,458 @@
+# $Id$
+
+"""
+Per-request timing of the application's hot paths, and latency
+statistics aggregated across requests and instances.
+
+``StatsMiddleware`` wraps a WSGI application. For each request it times
+the datastore and memcache calls (through API proxy hooks), the RST
+renders (reported by ``record_render()``) and the template renders and
+page renders (reported by ``record()``), and sends the breakdown in a
+``Server-Timing`` response header. Each request's total latency goes
+into a per-route histogram. The histograms, and the slowest article
+renders, are accumulated in the process and merged into a single
+memcache entry every ``FLUSH_SECONDS``, so the cost is one memcache
+round trip every few seconds, not one per request.
+"""
+
+__docformat__ = 'restructuredtext'
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import logging
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map
+
+import cache
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+STATS_KEY = 'request-stats'
+
+# Upper bounds of the latency histogram buckets, in milliseconds. Slower
+# requests go in a final, unbounded bucket.
+LATENCY_BUCKETS_MS = [5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+
+# How often each process merges its statistics into memcache.
+FLUSH_SECONDS = 10
+
+# Number of compare-and-set attempts when merging into memcache.
+MAX_FLUSH_ATTEMPTS = 3
+
+# Number of slowest article renders to remember.
+MAX_SLOW_RENDERS = 20
+
+# API services timed for the Server-Timing header, with the names they
+# are reported under.
+TIMED_SERVICES = {'datastore_v3' : 'datastore',
+                  'memcache'     : 'memcache'}
+
+# Order of the metrics in the Server-Timing header.
+METRICS = ['datastore', 'memcache', 'rst', 'template', 'render', 'gzip']
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class RequestTimings(object):
+    """
+    The time spent in each part of one request.
+    """
+    def __init__(self):
+        self.start = time.time()
+        self.route = None
+        self.seconds = {}
+        self.calls = {}
+        self.renders = []
+        self.pending_calls = {}
+        self.notes = []
+
+    def add(self, metric, seconds):
+        """
+        Add to the time spent on a metric.
+
+        :Parameters:
+            metric : str
+                what the time was spent on (e.g., ``template``)
+
+            seconds : float
+                the time
+        """
+        self.seconds[metric] = self.seconds.get(metric, 0.0) + seconds
+        self.calls[metric] = self.calls.get(metric, 0) + 1
+
+    def elapsed(self):
+        """
+        :rtype: float
+        :return: seconds since the request started
+        """
+        return time.time() - self.start
+
+    def server_timing_header(self):
+        """
+        :rtype: str
+        :return: the ``Server-Timing`` header value for the request
+        """
+        entries = []
+        for metric in METRICS:
+            if metric in self.seconds:
+                entries.append('%s;dur=%.1f;desc="%d call(s)"' %
+                               (metric, self.seconds[metric] * 1000,
+                                self.calls[metric]))
+        for note in self.notes:
+            entries.append(note)
+        entries.append('total;dur=%.1f' % (self.elapsed() * 1000))
+        return ', '.join(entries)
+
+class Histogram(object):
+    """
+    Counts of request latencies, in ``LATENCY_BUCKETS_MS`` buckets.
+    """
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.total = 0
+
+    def add(self, ms):
+        """
+        Count one latency.
+
+        :Parameters:
+            ms : float
+                the latency, in milliseconds
+        """
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if ms <= bound:
+                break
+        else:
+            i = len(LATENCY_BUCKETS_MS)
+        self.counts[i] += 1
+        self.total += 1
+
+    def merge(self, other):
+        """
+        Add another histogram's counts to this one's.
+
+        :Parameters:
+            other : Histogram
+                the other histogram
+        """
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.total += other.total
+
+    def percentile(self, fraction):
+        """
+        Estimate a latency percentile.
+
+        :Parameters:
+            fraction : float
+                the percentile, as a fraction (e.g., 0.95)
+
+        :rtype: int
+        :return: the upper bound of the bucket holding the percentile, in
+                 milliseconds, or ``None`` if it's in the unbounded bucket
+                 (or the histogram is empty)
+        """
+        rank = fraction * self.total
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if (seen >= rank) and (count > 0):
+                if i < len(LATENCY_BUCKETS_MS):
+                    return LATENCY_BUCKETS_MS[i]
+                return None
+        return None
+
+class Stats(object):
+    """
+    Aggregated statistics: a latency histogram per route, and the slowest
+    article renders.
+    """
+    def __init__(self):
+        self.since = time.time()
+        self.routes = {}
+        self.slow_renders = {}
+
+    def add_request(self, timings):
+        """
+        Add a finished request's timings.
+
+        :Parameters:
+            timings : RequestTimings
+                the request's timings
+        """
+        route = timings.route or 'unknown'
+        try:
+            histogram = self.routes[route]
+        except KeyError:
+            histogram = Histogram()
+            self.routes[route] = histogram
+        histogram.add(timings.elapsed() * 1000)
+
+        for article_id, seconds in timings.renders:
+            self._add_render(article_id, seconds * 1000)
+
+    def merge(self, other):
+        """
+        Add another ``Stats`` object's statistics to this one's.
+
+        :Parameters:
+            other : Stats
+                the other statistics
+        """
+        self.since = min(self.since, other.since)
+        for route, histogram in other.routes.items():
+            self.routes.setdefault(route, Histogram()).merge(histogram)
+        for article_id, ms in other.slow_renders.items():
+            self._add_render(article_id, ms)
+
+    def is_empty(self):
+        """
+        :rtype: bool
+        :return: ``True`` if nothing has been recorded
+        """
+        return not (self.routes or self.slow_renders)
+
+    def get_slow_renders(self):
+        """
+        :rtype: list
+        :return: list of ``(article_id, ms)`` tuples for the slowest
+                 article renders, slowest first
+        """
+        renders = [(ms, id) for id, ms in self.slow_renders.items()]
+        renders.sort()
+        renders.reverse()
+        return [(id, ms) for ms, id in renders]
+
+    def _add_render(self, article_id, ms):
+        if ms <= self.slow_renders.get(article_id, 0):
+            return
+        self.slow_renders[article_id] = ms
+        if len(self.slow_renders) > MAX_SLOW_RENDERS:
+            fastest = min([(ms, id) for id, ms in self.slow_renders.items()])
+            del self.slow_renders[fastest[1]]
+
+class StatsMiddleware(object):
+    """
+    WSGI middleware that times each request, adds the ``Server-Timing``
+    header and records the request in the statistics.
+    """
+    def __init__(self, application):
+        """
+        :Parameters:
+            application : callable
+                the WSGI application to wrap
+        """
+        self.application = application
+
+    def __call__(self, environ, start_response):
+        timings = start_request()
+
+        def timed_start_response(status, headers, exc_info=None):
+            headers.append(('Server-Timing', timings.server_timing_header()))
+            return start_response(status, headers, exc_info)
+
+        try:
+            return self.application(environ, timed_start_response)
+        finally:
+            finish_request()
+
+# -----------------------------------------------------------------------------
+# Globals
+# -----------------------------------------------------------------------------
+
+# The current request's timings, per thread.
+_current = threading.local()
+
+# Statistics not yet merged into memcache, and when they last were.
+_pending = Stats()
+_pending_lock = threading.Lock()
+_last_flush = time.time()
+
+# The API proxy the timing hooks are installed in.
+_hooked_apiproxy = None
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def start_request():
+    """
+    Start timing a request.
+
+    :rtype: RequestTimings
+    :return: the request's timings
+    """
+    _install_hooks()
+    timings = RequestTimings()
+    _current.timings = timings
+    return timings
+
+def finish_request():
+    """
+    Stop timing the current request and record it in the statistics.
+    """
+    global _last_flush
+
+    timings = getattr(_current, 'timings', None)
+    if timings is None:
+        return
+    _current.timings = None
+
+    _pending_lock.acquire()
+    try:
+        _pending.add_request(timings)
+        flush_due = (time.time() - _last_flush) >= FLUSH_SECONDS
+        if flush_due:
+            _last_flush = time.time()
+    finally:
+        _pending_lock.release()
+
+    if flush_due:
+        flush()
+
+def current():
+    """
+    :rtype: RequestTimings
+    :return: the current request's timings, or ``None`` if the request
+             isn't being timed
+    """
+    return getattr(_current, 'timings', None)
+
+def set_route(route):
+    """
+    Name the route the current request is for.
+
+    :Parameters:
+        route : str
+            the route (e.g., the handler's class name)
+    """
+    timings = current()
+    if timings is not None:
+        timings.route = route
+
+def record(metric, seconds):
+    """
+    Add to the time the current request has spent on a metric. Does
+    nothing if the request isn't being timed.
+
+    :Parameters:
+        metric : str
+            what the time was spent on (e.g., ``template``)
+
+        seconds : float
+            the time
+    """
+    timings = current()
+    if timings is not None:
+        timings.add(metric, seconds)
+
+def record_render(article_id, seconds):
+    """
+    Record the time taken to render an article's body.
+
+    :Parameters:
+        article_id : int
+            the article's ID
+
+        seconds : float
+            the time
+    """
+    timings = current()
+    if timings is not None:
+        timings.add('rst', seconds)
+        timings.renders.append((article_id, seconds))
+
+def note(entry):
+    """
+    Add an entry (e.g., ``cache;desc=hit``) to the current request's
+    ``Server-Timing`` header.
+
+    :Parameters:
+        entry : str
+            the entry
+    """
+    timings = current()
+    if timings is not None:
+        timings.notes.append(entry)
+
+def flush():
+    """
+    Merge this process's statistics into the shared statistics in
+    memcache.
+    """
+    global _pending
+
+    _pending_lock.acquire()
+    try:
+        pending = _pending
+        _pending = Stats()
+    finally:
+        _pending_lock.release()
+
+    if pending.is_empty():
+        return
+
+    def merge(shared):
+        if shared is None:
+            return pending
+        shared.merge(pending)
+        return shared
+
+    if not cache.update_value(STATS_KEY, merge, MAX_FLUSH_ATTEMPTS):
+        logging.warning('Unable to merge request statistics into memcache.')
+
+def load():
+    """
+    Get the statistics for all instances, including this process's
+    unmerged statistics.
+
+    :rtype: Stats
+    :return: the statistics
+    """
+    flush()
+    return cache.get_value(STATS_KEY) or Stats()
+
+def reset():
+    """
+    Discard all statistics.
+    """
+    global _pending
+
+    _pending_lock.acquire()
+    try:
+        _pending = Stats()
+    finally:
+        _pending_lock.release()
+    cache.delete_value(STATS_KEY)
+
+def _install_hooks():
+    global _hooked_apiproxy
+
+    # The API proxy can be replaced (e.g., by a testbed), so check that
+    # the hooks are in the current one.
+    apiproxy = apiproxy_stub_map.apiproxy
+    if apiproxy is _hooked_apiproxy:
+        return
+    apiproxy.GetPreCallHooks().Append('stats-start', _start_call)
+    apiproxy.GetPostCallHooks().Append('stats-finish', _finish_call)
+    _hooked_apiproxy = apiproxy
+
+def _start_call(service, call, request, response):
+    timings = current()
+    if (timings is not None) and (service in TIMED_SERVICES):
+        timings.pending_calls[id(response)] = time.time()
+
+def _finish_call(service, call, request, response):
+    timings = current()
+    if timings is None:
+        return
+    start = timings.pending_calls.pop(id(response), None)
+    if start is not None:
+        timings.add(TIMED_SERVICES[service], time.time() - start)
@@ -0,0 +1,109 @@
+# $Id$
+
+"""
+Tests for the paged admin listing (``Article.summary_page()`` and
+``admin.ShowArticlesHandler``), which follows datastore cursors.
+"""
+
+__docformat__ = 'restructuredtext'
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import datetime
+import re
+import unittest
+
+import testutil
+testutil.setup_paths()
+from testutil import make_article
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+START = datetime.datetime(2010, 1, 1, 12, 0)
+
+NEXT_LINK = re.compile(r'class="older" href="([^"]+)"')
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+@testutil.requires_sdk
+class AdminListingTest(testutil.HandlerTestCase):
+
+    def setUp(self):
+        testutil.HandlerTestCase.setUp(self)
+        import defs
+        from models import Article
+
+        # Articles 1 to 5; the odd ones are drafts tagged "odd".
+        Article.save_all([make_article(n,
+                                       START + datetime.timedelta(days=n),
+                                       tags=(n % 2) and [u'odd'] or [],
+                                       draft=bool(n % 2))
+                          for n in range(1, 6)])
+        self.page_size = defs.ADMIN_ARTICLES_PER_PAGE
+        defs.ADMIN_ARTICLES_PER_PAGE = 2
+
+    def tearDown(self):
+        import defs
+        defs.ADMIN_ARTICLES_PER_PAGE = self.page_size
+        testutil.HandlerTestCase.tearDown(self)
+
+    def titles(self, page):
+        return [summary.title for summary in page.articles]
+
+    def test_summary_pages(self):
+        from models import Article
+
+        page = Article.summary_page(2)
+        self.assertEqual(self.titles(page), [u'Article 5', u'Article 4'])
+        self.assertEqual([s.draft for s in page.articles], [True, False])
+        self.assertEqual(page.newer_cursor, None)
+
+        page = Article.summary_page(2, page.older_cursor)
+        self.assertEqual(self.titles(page), [u'Article 3', u'Article 2'])
+        page = Article.summary_page(2, page.older_cursor)
+        self.assertEqual(self.titles(page), [u'Article 1'])
+        self.assertEqual(page.older_cursor, None)
+
+    def test_filtered_pages(self):
+        from models import Article
+
+        page = Article.summary_page(2, drafts_only=True)
+        self.assertEqual(self.titles(page), [u'Article 5', u'Article 3'])
+        page = Article.summary_page(2, page.older_cursor, drafts_only=True)
+        self.assertEqual(self.titles(page), [u'Article 1'])
+
+        page = Article.summary_page(10, tag=u'odd', month=(2010, 1))
+        self.assertEqual(self.titles(page),
+                         [u'Article 5', u'Article 3', u'Article 1'])
+
+    def test_bad_cursor(self):
+        from models import Article
+
+        page = Article.summary_page(2, 'garbage')
+        self.assertEqual(self.titles(page), [u'Article 5', u'Article 4'])
+
+    def test_follow_links(self):
+        import admin
+
+        titles = []
+        path = '/admin/?tag=odd'
+        for i in range(5):
+            response = self.get(admin.application, path)
+            self.assertEqual(response.status_int, 200)
+            titles += re.findall(r'Article \d', response.body)
+            match = NEXT_LINK.search(response.body)
+            if not match:
+                break
+            path = match.group(1).replace('&amp;', '&')
+            self.assertTrue('tag=odd' in path)
+
+        self.assertEqual(titles, [u'Article 5', u'Article 3', u'Article 1'])
+
+if __name__ == '__main__':
+    unittest.main()
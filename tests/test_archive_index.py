@@ -0,0 +1,131 @@
+# $Id$
+
+"""
+Tests for ``ArchiveIndex``, the index of published articles kept up to
+date as articles are saved and deleted.
+"""
+
+__docformat__ = 'restructuredtext'
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import datetime
+import unittest
+
+import testutil
+testutil.setup_paths()
+from testutil import make_article
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+@testutil.requires_sdk
+class ArchiveIndexTest(testutil.DatastoreTestCase):
+
+    def ids(self):
+        from models import ArchiveIndex
+        return [s.id for s in ArchiveIndex.load().summaries]
+
+    def years(self):
+        from models import ArchiveRoot, ARCHIVE_ROOT_KEY_NAME
+        return ArchiveRoot.get_by_key_name(ARCHIVE_ROOT_KEY_NAME).years
+
+    def test_empty_blog(self):
+        self.assertEqual(self.ids(), [])
+        self.assertEqual(self.years(), [])
+
+    def test_apply_changes(self):
+        from models import ArchiveIndex
+
+        self.assertEqual(self.ids(), [])
+        one = make_article(1, datetime.datetime(2009, 6, 1))
+        one.save()
+        two = make_article(2, datetime.datetime(2010, 6, 1))
+        two.save()
+        self.assertEqual(self.ids(), [two.id, one.id])
+        self.assertEqual(self.years(), [2009, 2010])
+
+        # Edit: the entry is replaced, not duplicated.
+        one.title = u'Renamed'
+        one.save()
+        summaries = ArchiveIndex.load().summaries
+        self.assertEqual([s.id for s in summaries], [two.id, one.id])
+        self.assertEqual(summaries[1].title, u'Renamed')
+
+        # Move to another year: the old year's chunk goes away.
+        one.published_when = datetime.datetime(2011, 1, 1)
+        one.save()
+        self.assertEqual(self.ids(), [one.id, two.id])
+        self.assertEqual(self.years(), [2010, 2011])
+
+        # Unpublish, then delete.
+        one.draft = True
+        one.save()
+        self.assertEqual(self.ids(), [two.id])
+        self.assertEqual(self.years(), [2010])
+        two.delete()
+        self.assertEqual(self.ids(), [])
+        self.assertEqual(self.years(), [])
+
+    def delete_index(self):
+        from google.appengine.ext import db
+        from models import ArchiveRoot, ARCHIVE_ROOT_KEY_NAME
+        import cache
+
+        # The root and its chunks
+        root = ArchiveRoot.get_by_key_name(ARCHIVE_ROOT_KEY_NAME)
+        db.delete(db.Query(keys_only=True).ancestor(root).fetch(100))
+        cache.bump_generation()
+
+    def test_eventual_consistency(self):
+        # The index is read and updated by key only, so it sees every
+        # change at once, even when queries don't.
+        self.assertEqual(self.ids(), [])
+        self.set_eventually_consistent()
+        one = make_article(1, datetime.datetime(2010, 6, 1))
+        one.save()
+        self.assertEqual(self.ids(), [one.id])
+
+    def test_built_by_save(self):
+        # A save with no index yet builds it. The query the index is
+        # built from doesn't see the save yet, but the change is merged
+        # in.
+        self.set_eventually_consistent()
+        one = make_article(1, datetime.datetime(2010, 6, 1))
+        one.save()
+        self.assertEqual(self.years(), [2010])
+        self.assertEqual(self.ids(), [one.id])
+
+    def test_rebuilt_by_save(self):
+        one = make_article(1, datetime.datetime(2009, 6, 1))
+        one.save()
+        two = make_article(2, datetime.datetime(2010, 6, 1))
+        two.save()
+        self.delete_index()
+
+        # From now on, the query still sees one, and never sees three.
+        self.set_eventually_consistent()
+        three = make_article(3, datetime.datetime(2011, 6, 1))
+        one.delete()
+        three.save()
+        self.assertEqual(self.ids(), [three.id, two.id])
+        self.assertEqual(self.years(), [2010, 2011])
+
+    def test_rebuild(self):
+        from models import Article, ArchiveIndex
+        import cache
+
+        articles = [make_article(n, datetime.datetime(2008 + n, 1, 1))
+                    for n in range(3)]
+        Article.save_all(articles)
+        before = self.ids()
+        ArchiveIndex.rebuild()
+        cache.bump_generation()
+        self.assertEqual(self.ids(), before)
+        self.assertEqual(self.years(), [2008, 2009, 2010])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+# $Id$
+
+"""
+Tests for looking up an article by ID, with ``Article.get()`` and the
+``/id/<id>`` pages.
+"""
+
+__docformat__ = 'restructuredtext'
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import datetime
+import unittest
+
+import testutil
+testutil.setup_paths()
+from testutil import make_article
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+# IDs no article can have
+INVALID_IDS = (0, -1, 2 ** 63, 10 ** 20)
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+@testutil.requires_sdk
+class ArticleLookupTest(testutil.HandlerTestCase):
+
+    def setUp(self):
+        testutil.HandlerTestCase.setUp(self)
+        self.article = make_article(1, datetime.datetime(2010, 1, 1))
+        self.article.save()
+
+    def get_page(self, id):
+        import blog
+        return self.get(blog.application, '/id/%s' % id)
+
+    def test_get(self):
+        from models import Article
+
+        self.assertEqual(Article.get(self.article.id).title, u'Article 1')
+        self.assertEqual(Article.get(self.article.id + 1000), None)
+        for id in INVALID_IDS:
+            self.assertEqual(Article.get(id), None, id)
+
+    def test_page(self):
+        response = self.get_page(self.article.id)
+        self.assertEqual(response.status_int, 200)
+        self.assertTrue('Body of article 1.' in response.body)
+
+    def test_not_found(self):
+        for id in (self.article.id + 1000, 0, '00', 2 ** 63, 10 ** 20):
+            response = self.get_page(id)
+            self.assertEqual(response.status_int, 404, id)
+
+if __name__ == '__main__':
+    unittest.main()
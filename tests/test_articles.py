@@ -0,0 +1,117 @@
+# $Id$
+
+"""
+Tests for the article HTML stored at save time: ``Article.save()``
+renders the body once, and displaying the article uses the stored HTML
+instead of running the RST renderer again.
+"""
+
+__docformat__ = 'restructuredtext'
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import unittest
+
+import testutil
+testutil.setup_paths()
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+BODY = u'Some *text*.\n\n.. code-block:: python\n\n    print "Hello"\n'
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+@testutil.requires_sdk
+class StoredHTMLTest(testutil.DatastoreTestCase):
+
+    def setUp(self):
+        testutil.DatastoreTestCase.setUp(self)
+        import models
+
+        # Count the renders, bypassing the per-process cache of rendered
+        # bodies, so that every render is seen.
+        self.renders = []
+        self.render_body = models.render_body
+
+        def render_body(body):
+            self.renders.append(body)
+            return models.load_rst().rst2html(body)
+
+        models.render_body = render_body
+
+    def tearDown(self):
+        import models
+        models.render_body = self.render_body
+        testutil.DatastoreTestCase.tearDown(self)
+
+    def create(self, body=BODY):
+        from models import Article
+        article = Article.create(title=u'Title', body=body, draft=False)
+        article.save()
+        return article
+
+    def test_rendered_on_save(self):
+        import defs
+        from models import Article
+
+        article = self.create()
+        self.assertEqual(self.renders, [BODY])
+
+        stored = Article.get(article.id)
+        self.assertEqual(stored.renderer_version, defs.RENDERER_VERSION)
+        self.assertTrue(u'<em>text</em>' in stored.rendered_html)
+        self.assertTrue(u'code-block' in stored.rendered_html)
+
+    def test_display_uses_stored_html(self):
+        from models import Article
+
+        article = self.create()
+        del self.renders[:]
+        stored = Article.get(article.id)
+        self.assertEqual(stored.html, stored.rendered_html)
+        self.assertEqual(self.renders, [])
+
+    def test_unchanged_body_not_rendered_again(self):
+        from models import Article
+
+        article = Article.get(self.create().id)
+        del self.renders[:]
+        article.title = u'New title'
+        article.save()
+        self.assertEqual(self.renders, [])
+
+        article.body = u'New *body*.\n'
+        article.save()
+        self.assertEqual(self.renders, [u'New *body*.\n'])
+        self.assertTrue(u'<em>body</em>' in
+                        Article.get(article.id).rendered_html)
+
+    def test_stale_html_rendered_for_display(self):
+        # HTML stored by another renderer version is ignored (but only
+        # replaced by the next save).
+        from models import Article
+
+        article = self.create()
+        article.renderer_version = 'old'
+        article.rendered_html = u'<p>stale</p>'
+        article.put()
+
+        del self.renders[:]
+        stored = Article.get(article.id)
+        self.assertTrue(u'<em>text</em>' in stored.html)
+        self.assertEqual(self.renders, [BODY])
+        self.assertEqual(Article.get(article.id).rendered_html,
+                         u'<p>stale</p>')
+
+        stored.save()
+        self.assertTrue(u'<em>text</em>' in
+                        Article.get(article.id).rendered_html)
+
+if __name__ == '__main__':
+    unittest.main()
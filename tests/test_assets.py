@@ -0,0 +1,186 @@
+# $Id$
+
+"""
+Tests for the fingerprinted static assets: building them with
+``assets.build()``, and looking up their URLs with ``assets.asset_url()``.
+Only the page test needs the App Engine SDK.
+"""
+
+__docformat__ = 'restructuredtext'
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import datetime
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+import testutil
+testutil.setup_paths()
+from testutil import make_article
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def write_file(path, content):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    f = open(path, 'wb')
+    try:
+        f.write(content)
+    finally:
+        f.close()
+
+def fingerprint(content):
+    import assets
+    return hashlib.sha1(content).hexdigest()[:assets.FINGERPRINT_LENGTH]
+
+def list_files(directory):
+    names = []
+    for parent, subdirs, files in os.walk(directory):
+        for name in files:
+            path = os.path.relpath(os.path.join(parent, name), directory)
+            names.append(path.replace(os.sep, '/'))
+    return sorted(names)
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class AssetTestCase(unittest.TestCase):
+    """
+    Builds assets in a temporary directory, and points ``assets`` at its
+    manifest.
+    """
+    def setUp(self):
+        import assets
+
+        self.dir = tempfile.mkdtemp()
+        self.static_dir = os.path.join(self.dir, 'static')
+        self.asset_dir = os.path.join(self.dir, 'assets')
+        self.manifest_file = os.path.join(self.dir, 'asset-manifest.json')
+        write_file(os.path.join(self.static_dir, 'style.css'), 'body {}')
+        write_file(os.path.join(self.static_dir, 'img', 'logo.gif'), 'GIF')
+
+        self.saved = (assets.MANIFEST_FILE, assets._manifest)
+        assets.MANIFEST_FILE = self.manifest_file
+        assets._manifest = None
+
+    def tearDown(self):
+        import assets
+        assets.MANIFEST_FILE, assets._manifest = self.saved
+        shutil.rmtree(self.dir)
+
+    def build(self, clean=False):
+        import assets
+
+        result = assets.build(self.static_dir,
+                              self.asset_dir,
+                              self.manifest_file,
+                              clean)
+        # The manifest may be rewritten within the second the last one
+        # was loaded in, so don't rely on its mtime.
+        assets._manifest = None
+        return result
+
+class BuildTest(AssetTestCase):
+
+    def test_fingerprint_name(self):
+        from assets import fingerprint_name
+
+        digest = '0123456789abcdef'
+        self.assertEqual(fingerprint_name('style.css', digest),
+                         'style.0123456789.css')
+        self.assertEqual(fingerprint_name('img/logo.gif', digest),
+                         'img/logo.0123456789.gif')
+        self.assertEqual(fingerprint_name('README', digest),
+                         'README.0123456789')
+
+    def test_build(self):
+        import assets
+
+        write_file(os.path.join(self.static_dir, '.hidden'), 'x')
+        manifest, copied, removed = self.build()
+        style = 'style.%s.css' % fingerprint('body {}')
+        logo = 'img/logo.%s.gif' % fingerprint('GIF')
+        self.assertEqual(manifest, {'style.css' : style,
+                                    'img/logo.gif' : logo})
+        self.assertEqual((copied, removed), (2, 0))
+        self.assertEqual(list_files(self.asset_dir), sorted([logo, style]))
+        self.assertEqual(assets.load_manifest()['assets'], manifest)
+
+        # Nothing changed, so nothing is copied.
+        self.assertEqual(self.build()[1:], (0, 0))
+
+    def test_changed_file(self):
+        old_style = self.build()[0]['style.css']
+        write_file(os.path.join(self.static_dir, 'style.css'), 'p {}')
+        manifest, copied, removed = self.build()
+        new_style = manifest['style.css']
+        self.assertNotEqual(new_style, old_style)
+        self.assertEqual(copied, 1)
+
+        # The old file is kept for pages rendered before the change,
+        # until a clean build.
+        self.assertTrue(old_style in list_files(self.asset_dir))
+        manifest, copied, removed = self.build(clean=True)
+        self.assertEqual((copied, removed), (0, 1))
+        self.assertEqual(list_files(self.asset_dir),
+                         sorted(manifest.values()))
+
+    def test_asset_url(self):
+        import assets
+
+        # Without a manifest, assets are served from /static.
+        self.assertEqual(assets.asset_url('style.css'), '/static/style.css')
+        self.assertEqual(assets.manifest_digest(), '')
+
+        manifest = self.build()[0]
+        self.assertEqual(assets.asset_url('style.css'),
+                         '/assets/' + manifest['style.css'])
+        self.assertEqual(assets.asset_url('img/logo.gif'),
+                         '/assets/' + manifest['img/logo.gif'])
+        self.assertEqual(assets.asset_url('missing.css'),
+                         '/static/missing.css')
+
+        digest = assets.manifest_digest()
+        self.assertNotEqual(digest, '')
+        write_file(os.path.join(self.static_dir, 'style.css'), 'p {}')
+        self.build()
+        self.assertNotEqual(assets.manifest_digest(), digest)
+
+@testutil.requires_sdk
+class AssetPageTest(AssetTestCase, testutil.HandlerTestCase):
+
+    def setUp(self):
+        testutil.HandlerTestCase.setUp(self)
+        AssetTestCase.setUp(self)
+        make_article(1, datetime.datetime(2010, 1, 1)).save()
+
+    def tearDown(self):
+        AssetTestCase.tearDown(self)
+        testutil.HandlerTestCase.tearDown(self)
+
+    def get_page(self):
+        import blog
+        response = self.get(blog.application, '/')
+        self.assertEqual(response.status_int, 200)
+        return response.body
+
+    def test_page_links(self):
+        self.assertTrue('href="/static/style.css"' in self.get_page())
+
+        # A new manifest changes the pages' cache key, so the cached
+        # page with the old URLs isn't used.
+        manifest = self.build()[0]
+        body = self.get_page()
+        self.assertTrue('href="/assets/%s"' % manifest['style.css'] in body)
+        self.assertFalse('/static/style.css' in body)
+
+if __name__ == '__main__':
+    unittest.main()
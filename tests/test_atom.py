@@ -0,0 +1,160 @@
+# $Id$
+
+"""
+Tests for the Atom feed: the subscription document and its archive
+documents (RFC 5005), and feed deltas (RFC 3229).
+"""
+
+__docformat__ = 'restructuredtext'
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import calendar
+import datetime
+import email.utils
+import re
+import unittest
+
+import testutil
+testutil.setup_paths()
+from testutil import make_article
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+START = datetime.datetime(2010, 1, 1, 12, 0, 0, 500000)
+
+TITLE = re.compile(r'<entry>\s*<title>([^<]*)</title>')
+LINK = re.compile(r'<link rel="([a-z-]+-archive)" href="[^"]*/atom([^"]*)"')
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def published_when(n):
+    return START + datetime.timedelta(days=n)
+
+def http_date(when):
+    return email.utils.formatdate(calendar.timegm(when.utctimetuple()),
+                                  usegmt=True)
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+@testutil.requires_sdk
+class AtomFeedTest(testutil.HandlerTestCase):
+
+    def setUp(self):
+        testutil.HandlerTestCase.setUp(self)
+        import defs
+        from models import Article
+
+        # Eight articles, in archives of three: archives 1 and 2 are
+        # complete, and the subscription document has the newest three.
+        self.settings = (defs.MAX_FEED_ITEMS, defs.ATOM_ARCHIVE_ENTRIES)
+        defs.MAX_FEED_ITEMS = 3
+        defs.ATOM_ARCHIVE_ENTRIES = 3
+        Article.save_all([make_article(n, published_when(n))
+                          for n in range(1, 9)])
+
+    def tearDown(self):
+        import defs
+        defs.MAX_FEED_ITEMS, defs.ATOM_ARCHIVE_ENTRIES = self.settings
+        testutil.HandlerTestCase.tearDown(self)
+
+    def get_feed(self, path='/atom', status=200, **headers):
+        import blog
+        response = self.get(blog.application, path, **headers)
+        if status is not None:
+            self.assertEqual(response.status_int, status)
+        return response
+
+    def titles(self, response):
+        return [int(title.split()[-1])
+                for title in TITLE.findall(response.body)]
+
+    def links(self, response):
+        return dict(LINK.findall(response.body))
+
+    def poll(self, since):
+        return self.get_feed(status=None, A_IM='feed',
+                             If_Modified_Since=http_date(since))
+
+    def test_subscription_document(self):
+        response = self.get_feed()
+        self.assertEqual(self.titles(response), [8, 7, 6])
+        self.assertEqual(self.links(response),
+                         {'prev-archive' : '/archive/2'})
+        self.assertFalse('fh:archive/>' in response.body)
+
+    def test_archives(self):
+        response = self.get_feed('/atom/archive/2')
+        self.assertEqual(self.titles(response), [6, 5, 4])
+        self.assertEqual(self.links(response),
+                         {'prev-archive' : '/archive/1'})
+        self.assertTrue('<fh:archive/>' in response.body)
+
+        response = self.get_feed('/atom/archive/1')
+        self.assertEqual(self.titles(response), [3, 2, 1])
+        self.assertEqual(self.links(response),
+                         {'next-archive' : '/archive/2'})
+
+        # Only complete archives are served.
+        self.get_feed('/atom/archive/3', 404)
+        self.get_feed('/atom/archive/0', 404)
+
+    def test_archive_revalidated(self):
+        # Archives can change (e.g., when an article is deleted), so
+        # they're revalidated, not cached for long.
+        from models import ArchiveIndex, Article
+
+        response = self.get_feed('/atom/archive/1')
+        self.assertFalse('max-age' in
+                         response.headers.get('Cache-Control', ''))
+        etag = response.headers['ETag']
+        self.get_feed('/atom/archive/1', 304, If_None_Match=etag)
+
+        Article.get(ArchiveIndex.load().newest(8)[-1].id).delete()
+        response = self.get_feed('/atom/archive/1', If_None_Match=etag)
+        self.assertEqual(self.titles(response), [4, 3, 2])
+
+    def test_delta(self):
+        response = self.poll(published_when(6))
+        self.assertEqual(response.status_int, 226)
+        self.assertEqual(response.headers['IM'], 'feed')
+        self.assertEqual(response.headers['Cache-Control'], 'no-store')
+        self.assertEqual(self.titles(response), [8, 7])
+
+        # The next poll starts after the newest article sent.
+        last_modified = response.headers['Last-Modified']
+        self.assertEqual(last_modified, http_date(published_when(8)))
+        response = self.get_feed(status=304, A_IM='feed',
+                                 If_Modified_Since=last_modified)
+
+        make_article(9, published_when(9)).save()
+        response = self.get_feed(status=226, A_IM='feed',
+                                 If_Modified_Since=last_modified)
+        self.assertEqual(self.titles(response), [9])
+
+    def test_too_many_for_delta(self):
+        # A delta would leave articles out, so the whole document is
+        # sent instead.
+        response = self.poll(published_when(4))
+        self.assertEqual(response.status_int, 200)
+        self.assertFalse('IM' in response.headers)
+        self.assertEqual(self.titles(response), [8, 7, 6])
+        self.assertEqual(response.body, self.get_feed().body)
+
+    def test_not_a_delta_request(self):
+        response = self.get_feed(If_Modified_Since=http_date(
+            published_when(6)))
+        self.assertEqual(self.titles(response), [8, 7, 6])
+        response = self.get_feed(A_IM='feed')
+        self.assertEqual(self.titles(response), [8, 7, 6])
+
+if __name__ == '__main__':
+    unittest.main()
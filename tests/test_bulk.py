@@ -0,0 +1,124 @@
+# $Id$
+
+"""
+Tests for the admin bulk actions (``admin.BulkArticlesHandler``), which
+publish, unpublish, retag or delete many articles at once.
+"""
+
+__docformat__ = 'restructuredtext'
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import datetime
+import unittest
+
+import testutil
+testutil.setup_paths()
+from testutil import make_article
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+START = datetime.datetime(2010, 1, 1, 12, 0)
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+@testutil.requires_sdk
+class BulkArticlesTest(testutil.HandlerTestCase):
+
+    def setUp(self):
+        testutil.HandlerTestCase.setUp(self)
+        from models import Article
+
+        # Articles 1 to 4 are published, and the even ones are tagged
+        # "even"; 5 and 6 are drafts.
+        self.articles = [make_article(n,
+                                      START + datetime.timedelta(days=n),
+                                      tags=(n % 2 == 0) and [u'even'] or [],
+                                      draft=(n > 4))
+                         for n in range(1, 7)]
+        Article.save_all(self.articles)
+
+    def bulk(self, action, scope, **params):
+        import admin
+        params.update({'bulk_action' : action, 'scope' : scope})
+        response = self.post(admin.application, '/admin/articles/bulk/',
+                             params)
+        self.assertEqual(response.status_int, 302)
+        return response
+
+    def ids(self, *numbers):
+        return [self.articles[n - 1].id for n in numbers]
+
+    def published(self):
+        from models import ArchiveIndex
+        return [s.title for s in ArchiveIndex.load().summaries]
+
+    def tag_counts(self):
+        from models import ArticleCounts
+        return ArticleCounts.load().get_tag_counts()
+
+    def get_tasks(self):
+        import admin
+        stub = self.testbed.get_stub('taskqueue')
+        return stub.GetTasks(admin.PING_QUEUE_NAME)
+
+    def test_delete_selected(self):
+        from models import Article
+
+        self.bulk('delete', 'selected', id=self.ids(2, 3, 5))
+        self.assertEqual(Article.get_many(self.ids(2, 3, 5)), [])
+        self.assertEqual(len(Article.get_many(self.ids(1, 4, 6))), 3)
+        self.assertEqual(self.published(), [u'Article 4', u'Article 1'])
+        self.assertEqual(self.tag_counts(), {u'even' : 1})
+
+    def test_publish_drafts(self):
+        self.bulk('publish', 'drafts')
+        self.assertEqual(self.published(),
+                         [u'Article %d' % n for n in (6, 5, 4, 3, 2, 1)])
+        self.assertEqual(len(self.get_tasks()), 1)
+
+    def test_publish_nothing(self):
+        # Articles that are already published are left alone, and no
+        # ping is sent.
+        self.bulk('publish', 'selected', id=self.ids(1, 2))
+        self.assertEqual(len(self.published()), 4)
+        self.assertEqual(self.get_tasks(), [])
+
+    def test_unpublish_tag(self):
+        from models import Article
+
+        self.bulk('unpublish', 'tag', scope_tag=u'even')
+        self.assertEqual(self.published(), [u'Article 3', u'Article 1'])
+        self.assertTrue(Article.get(self.ids(2)[0]).draft)
+        self.assertEqual(self.tag_counts(), {})
+
+    def test_retag(self):
+        from models import Article
+
+        self.bulk('retag', 'selected', id=self.ids(1, 2),
+                  add_tags=u'new, odd', remove_tags=u'even')
+        self.assertEqual(Article.get(self.ids(1)[0]).tags,
+                         [u'new', u'odd'])
+        self.assertEqual(Article.get(self.ids(2)[0]).tags,
+                         [u'new', u'odd'])
+        self.assertEqual(Article.get(self.ids(4)[0]).tags, [u'even'])
+        self.assertEqual(self.tag_counts(),
+                         {u'new' : 2, u'odd' : 2, u'even' : 1})
+
+    def test_unknown_action(self):
+        import admin
+
+        response = self.post(admin.application, '/admin/articles/bulk/',
+                             {'bulk_action' : 'explode',
+                              'scope' : 'drafts'})
+        self.assertEqual(response.status_int, 500)
+        self.assertEqual(len(self.published()), 4)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+# $Id$
+
+"""
+Tests for ``ArticleCounts``, the tag and day counts kept up to date as
+articles are saved and deleted.
+"""
+
+__docformat__ = 'restructuredtext'
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import datetime
+import unittest
+
+import testutil
+testutil.setup_paths()
+
+from testutil import make_article
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+@testutil.requires_sdk
+class ArticleCountsTest(testutil.DatastoreTestCase):
+
+    def load(self):
+        from models import ArticleCounts
+        counts = ArticleCounts.load()
+        return (counts.get_tag_counts(), counts.get_day_counts())
+
+    def test_save(self):
+        one = make_article(1, datetime.datetime(2010, 3, 1, 12),
+                           [u'python', u'gae'])
+        one.save()
+        two = make_article(2, datetime.datetime(2010, 3, 1, 18),
+                           [u'python'])
+        two.save()
+
+        tags, days = self.load()
+        self.assertEqual(tags, {u'python' : 2, u'gae' : 1})
+        self.assertEqual(days, {datetime.datetime(2010, 3, 1) : 2})
+
+    def test_edit_and_delete(self):
+        from google.appengine.ext import db
+
+        one = make_article(1, datetime.datetime(2010, 3, 1), [u'python'])
+        one.save()
+        two = make_article(2, datetime.datetime(2010, 4, 2), [u'gae'])
+        two.save()
+
+        one.tags = [db.Category(u'scala')]
+        one.save()
+        tags, days = self.load()
+        self.assertEqual(tags, {u'scala' : 1, u'gae' : 1})
+
+        two.delete()
+        tags, days = self.load()
+        self.assertEqual(tags, {u'scala' : 1})
+        self.assertEqual(days, {datetime.datetime(2010, 3, 1) : 1})
+
+    def test_drafts_not_counted(self):
+        draft = make_article(1, datetime.datetime(2010, 3, 1), [u'python'],
+                             draft=True)
+        draft.save()
+        self.assertEqual(self.load(), ({}, {}))
+
+        draft.draft = False
+        draft.save()
+        tags, days = self.load()
+        self.assertEqual(tags, {u'python' : 1})
+        self.assertEqual(sum(days.values()), 1)
+
+    def test_missing_counts_eventual_consistency(self):
+        # With no counts stored yet, the first save builds them from a
+        # query that can't see the article just stored; the change
+        # itself must still be counted.
+        from models import ArticleCounts, COUNTS_KEY_NAME
+
+        self.set_eventually_consistent()
+        one = make_article(1, datetime.datetime(2010, 3, 1), [u'python'])
+        one.save()
+        self.assertEqual(
+            ArticleCounts.get_by_key_name(COUNTS_KEY_NAME).get_tag_counts(),
+            {u'python' : 1})
+
+        two = make_article(2, datetime.datetime(2010, 3, 2), [u'gae'])
+        two.save()
+        tags, days = self.load()
+        self.assertEqual(tags, {u'python' : 1, u'gae' : 1})
+        self.assertEqual(len(days), 2)
+
+    def test_rebuild(self):
+        from models import Article, ArticleCounts, COUNTS_KEY_NAME
+
+        articles = [make_article(n, datetime.datetime(2010, 1, n + 1),
+                                 [u'tag%d' % (n % 2)])
+                    for n in range(4)]
+        Article.save_all(articles)
+        before = self.load()
+        ArticleCounts.get_by_key_name(COUNTS_KEY_NAME).delete()
+        ArticleCounts.rebuild()
+        self.assertEqual(self.load(), before)
+
+if __name__ == '__main__':
+    unittest.main()
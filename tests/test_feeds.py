@@ -0,0 +1,107 @@
+# $Id$
+
+"""
+Tests for the RSS feed: it's bounded to ``defs.MAX_FEED_ITEMS`` items,
+and its items are rendered once and cached as fragments.
+"""
+
+__docformat__ = 'restructuredtext'
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import datetime
+import unittest
+
+import testutil
+testutil.setup_paths()
+from testutil import make_article
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+START = datetime.datetime(2010, 1, 1, 12, 0)
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+@testutil.requires_sdk
+class RSSFeedTest(testutil.HandlerTestCase):
+
+    def setUp(self):
+        testutil.HandlerTestCase.setUp(self)
+        import blog
+        import defs
+        from models import Article
+
+        self.count = defs.MAX_FEED_ITEMS + 3
+        Article.save_all([make_article(n, START + datetime.timedelta(days=n))
+                          for n in range(1, self.count + 1)])
+
+        # Record the templates rendered.
+        self.rendered = []
+        self.render_template = blog.AbstractPageHandler.render_template
+
+        def render_template(handler, template_name, template_vars):
+            self.rendered.append(template_name)
+            return self.render_template(handler, template_name,
+                                        template_vars)
+
+        blog.AbstractPageHandler.render_template = render_template
+
+    def tearDown(self):
+        import blog
+        blog.AbstractPageHandler.render_template = self.render_template
+        testutil.HandlerTestCase.tearDown(self)
+
+    def get_feed(self):
+        import blog
+        response = self.get(blog.application, '/rss2')
+        self.assertEqual(response.status_int, 200)
+        return response.body
+
+    def test_bounded(self):
+        import defs
+
+        body = self.get_feed()
+        self.assertEqual(body.count('<item>'), defs.MAX_FEED_ITEMS)
+        self.assertTrue('Article %d<' % self.count in body)
+        oldest = self.count - defs.MAX_FEED_ITEMS + 1
+        self.assertTrue('Article %d<' % oldest in body)
+        self.assertFalse('Article %d<' % (oldest - 1) in body)
+
+    def test_items_cached(self):
+        import defs
+
+        first = self.get_feed()
+        self.assertEqual(self.rendered.count('rss2-item.xml'),
+                         defs.MAX_FEED_ITEMS)
+
+        # A new article makes the feed stale, but only the new item is
+        # rendered.
+        del self.rendered[:]
+        make_article(self.count + 1,
+                     START + datetime.timedelta(days=self.count + 1)).save()
+        body = self.get_feed()
+        self.assertEqual(self.rendered.count('rss2-item.xml'), 1)
+        self.assertEqual(body.count('<item>'), defs.MAX_FEED_ITEMS)
+        self.assertTrue('Article %d<' % (self.count + 1) in body)
+        self.assertNotEqual(body, first)
+
+    def test_edited_item_rendered_again(self):
+        from models import Article, ArchiveIndex
+
+        self.get_feed()
+        del self.rendered[:]
+        article = Article.get(ArchiveIndex.load().newest(1)[0].id)
+        article.title = u'Edited'
+        article.save()
+        body = self.get_feed()
+        self.assertEqual(self.rendered.count('rss2-item.xml'), 1)
+        self.assertTrue('Edited' in body)
+
+if __name__ == '__main__':
+    unittest.main()
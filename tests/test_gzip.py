@@ -0,0 +1,115 @@
+# $Id$
+
+"""
+Tests for serving cached pages gzip-compressed to the clients that
+accept it (``cache.CachedPage`` and ``blog.AbstractPageHandler``).
+"""
+
+__docformat__ = 'restructuredtext'
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import datetime
+import gzip
+import unittest
+from StringIO import StringIO
+
+import testutil
+testutil.setup_paths()
+from testutil import make_article
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def gunzip(data):
+    return gzip.GzipFile(fileobj=StringIO(data)).read()
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+@testutil.requires_sdk
+class AcceptsGzipTest(unittest.TestCase):
+
+    def test_accepts_gzip(self):
+        from cache import accepts_gzip
+
+        for header in ('gzip', 'GZIP', 'deflate, gzip', 'x-gzip',
+                       'gzip;q=0.5', 'deflate;q=1.0, gzip ; q=1'):
+            self.assertTrue(accepts_gzip(header), header)
+
+        for header in (None, '', 'deflate', 'identity', 'gzip;q=0',
+                       'gzip;q=0.0', 'gzip;q=bad', 'gzipx'):
+            self.assertFalse(accepts_gzip(header), header)
+
+    def test_small_pages_not_compressed(self):
+        import defs
+        from cache import CachedPage
+
+        page = CachedPage(1, 'x' * (defs.GZIP_MIN_BYTES - 1), None, 0)
+        self.assertEqual(page.gzipped_body, None)
+        self.assertEqual(page.get_encoding('gzip'),
+                         (page.body, page.etag, None))
+
+        page = CachedPage(1, 'x' * defs.GZIP_MIN_BYTES, None, 0)
+        body, etag, encoding = page.get_encoding('gzip')
+        self.assertEqual(encoding, 'gzip')
+        self.assertEqual(gunzip(body), page.body)
+        self.assertNotEqual(etag, page.etag)
+
+@testutil.requires_sdk
+class GzipResponseTest(testutil.HandlerTestCase):
+
+    def setUp(self):
+        testutil.HandlerTestCase.setUp(self)
+        for n in range(1, 6):
+            make_article(n, datetime.datetime(2010, 1, n)).save()
+
+    def get(self, path, **headers):
+        import blog
+        return testutil.HandlerTestCase.get(self, blog.application, path,
+                                            **headers)
+
+    def test_compressed(self):
+        plain = self.get('/')
+        self.assertFalse('Content-Encoding' in plain.headers)
+        self.assertEqual(plain.headers['Vary'], 'Accept-Encoding')
+
+        # Rendered and compressed (miss), then served from the cache.
+        for i in range(2):
+            compressed = self.get('/', Accept_Encoding='gzip, deflate')
+            self.assertEqual(compressed.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(compressed.headers['Vary'], 'Accept-Encoding')
+            self.assertEqual(gunzip(compressed.body), plain.body)
+            self.assertEqual(compressed.headers['ETag'],
+                             plain.headers['ETag'][:-1] + '-gzip"')
+
+    def test_refused(self):
+        response = self.get('/', Accept_Encoding='gzip;q=0')
+        self.assertFalse('Content-Encoding' in response.headers)
+        self.assertTrue('Article 5' in response.body)
+
+    def test_etag_per_encoding(self):
+        # A client's entity tag only matches the encoding it was sent.
+        plain_etag = self.get('/').headers['ETag']
+        gzip_etag = self.get('/', Accept_Encoding='gzip').headers['ETag']
+
+        response = self.get('/', Accept_Encoding='gzip',
+                            If_None_Match=gzip_etag)
+        self.assertEqual(response.status_int, 304)
+        self.assertEqual(response.headers['ETag'], gzip_etag)
+
+        response = self.get('/', If_None_Match=gzip_etag)
+        self.assertEqual(response.status_int, 200)
+        self.assertFalse('Content-Encoding' in response.headers)
+
+        response = self.get('/', Accept_Encoding='gzip',
+                            If_None_Match=plain_etag)
+        self.assertEqual(response.status_int, 200)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+# $Id$
+
+"""
+Tests for the rendered-page cache in ``blog.AbstractPageHandler``: pages
+are rendered once per content generation, conditional GETs get a 304,
+and 404s aren't cached.
+"""
+
+__docformat__ = 'restructuredtext'
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import datetime
+import unittest
+
+import testutil
+testutil.setup_paths()
+from testutil import make_article
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+START = datetime.datetime(2010, 1, 1, 12, 0)
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+@testutil.requires_sdk
+class PageCacheTest(testutil.HandlerTestCase):
+
+    def setUp(self):
+        testutil.HandlerTestCase.setUp(self)
+        self.article = make_article(1, START, tags=[u'python'])
+        self.article.save()
+
+    def get(self, path, **headers):
+        import blog
+        return testutil.HandlerTestCase.get(self, blog.application, path,
+                                            **headers)
+
+    def assertCache(self, response, result):
+        self.assertTrue('cache;desc=%s' % result in
+                        response.headers['Server-Timing'],
+                        response.headers['Server-Timing'])
+
+    def test_rendered_once(self):
+        first = self.get('/')
+        self.assertEqual(first.status_int, 200)
+        self.assertCache(first, 'miss')
+        self.assertTrue('Article 1' in first.body)
+
+        second = self.get('/')
+        self.assertEqual(second.status_int, 200)
+        self.assertCache(second, 'hit')
+        self.assertEqual(second.body, first.body)
+        self.assertEqual(second.headers['ETag'], first.headers['ETag'])
+        self.assertEqual(second.headers['Last-Modified'],
+                         first.headers['Last-Modified'])
+
+    def test_if_none_match(self):
+        etag = self.get('/').headers['ETag']
+
+        response = self.get('/', If_None_Match=etag)
+        self.assertEqual(response.status_int, 304)
+        self.assertEqual(response.body, '')
+
+        response = self.get('/', If_None_Match='"other", %s' % etag)
+        self.assertEqual(response.status_int, 304)
+
+        response = self.get('/', If_None_Match='"other"')
+        self.assertEqual(response.status_int, 200)
+        self.assertTrue('Article 1' in response.body)
+
+    def test_if_modified_since(self):
+        last_modified = self.get('/').headers['Last-Modified']
+
+        response = self.get('/', If_Modified_Since=last_modified)
+        self.assertEqual(response.status_int, 304)
+
+        response = self.get('/',
+                            If_Modified_Since='Thu, 01 Jan 2009 00:00:00 GMT')
+        self.assertEqual(response.status_int, 200)
+
+        response = self.get('/', If_Modified_Since='garbage')
+        self.assertEqual(response.status_int, 200)
+
+    def test_invalidated_by_save(self):
+        first = self.get('/')
+        make_article(2, START + datetime.timedelta(days=1)).save()
+
+        response = self.get('/')
+        self.assertCache(response, 'miss')
+        self.assertTrue('Article 2' in response.body)
+        self.assertNotEqual(response.headers['ETag'], first.headers['ETag'])
+
+        # The old validator no longer matches.
+        response = self.get('/', If_None_Match=first.headers['ETag'])
+        self.assertEqual(response.status_int, 200)
+
+    def test_not_found_not_cached(self):
+        for path in ('/no/such/page', '/id/999999'):
+            for i in range(2):
+                response = self.get(path)
+                self.assertEqual(response.status_int, 404, path)
+                self.assertCache(response, 'miss')
+                self.assertFalse('ETag' in response.headers, path)
+
+    def test_article_page(self):
+        path = '/id/%d' % self.article.id
+        response = self.get(path)
+        self.assertEqual(response.status_int, 200)
+        self.assertTrue('Body of article 1.' in response.body)
+        self.assertCache(self.get(path), 'hit')
+
+    def test_ignored_params_share_entry(self):
+        self.get('/')
+        self.assertCache(self.get('/?utm_source=feed'), 'hit')
+        self.assertCache(self.get('/?cursor=garbage'), 'hit')
+
+        self.get('/tag/python')
+        self.assertCache(self.get('/tag/python?x=1'), 'hit')
+
+if __name__ == '__main__':
+    unittest.main()
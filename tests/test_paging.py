@@ -0,0 +1,231 @@
+# $Id$
+
+"""
+Tests for paging through the published articles, which is done over the
+archive index: ``ArchiveIndex.page()`` and its relatives, and the
+``Article`` paging methods built on them.
+"""
+
+__docformat__ = 'restructuredtext'
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import datetime
+import unittest
+
+import testutil
+testutil.setup_paths()
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+START = datetime.datetime(2009, 12, 25, 12, 30)
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def published_when(n):
+    # Article n is published n days after START; 7 articles span two
+    # months and two years.
+    return START + datetime.timedelta(days=n)
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class FakeChunk(object):
+    """
+    Stands in for an ``ArchiveChunk``.
+    """
+    def __init__(self, entries):
+        self.entries = entries
+
+    def get_entries(self):
+        return self.entries
+
+@testutil.requires_sdk
+class ArchiveIndexPagingTest(unittest.TestCase):
+
+    def setUp(self):
+        from models import ArchiveIndex
+
+        # Articles 1 to 7; the odd ones are tagged "odd". The entries are
+        # split across chunks out of order, as they would be by year.
+        entries = [(n, u'Article %d' % n, published_when(n),
+                    n % 2 and [u'odd'] or [])
+                   for n in range(1, 8)]
+        self.index = ArchiveIndex([FakeChunk(entries[4:]),
+                                   FakeChunk(entries[:4])])
+
+    def ids(self, summaries):
+        return [s.id for s in summaries]
+
+    def test_newest_first(self):
+        self.assertEqual(self.ids(self.index.summaries),
+                         [7, 6, 5, 4, 3, 2, 1])
+        self.assertEqual(self.ids(self.index.newest(2)), [7, 6])
+
+    def test_page_forward_and_back(self):
+        first = self.index.page(3)
+        self.assertEqual(self.ids(first.articles), [7, 6, 5])
+        self.assertEqual(first.newer_cursor, None)
+
+        second = self.index.page(3, first.older_cursor)
+        self.assertEqual(self.ids(second.articles), [4, 3, 2])
+
+        last = self.index.page(3, second.older_cursor)
+        self.assertEqual(self.ids(last.articles), [1])
+        self.assertEqual(last.older_cursor, None)
+
+        back = self.index.page(3, last.newer_cursor)
+        self.assertEqual(self.ids(back.articles), [4, 3, 2])
+        back = self.index.page(3, back.newer_cursor)
+        self.assertEqual(self.ids(back.articles), [7, 6, 5])
+        self.assertEqual(back.newer_cursor, None)
+        self.assertEqual(back.older_cursor, first.older_cursor)
+
+    def test_page_stable_under_insert(self):
+        # A cursor is keyed on time, not on position, so a newly
+        # published article doesn't shift the pages after it.
+        from models import ArchiveIndex
+
+        first = self.index.page(3)
+        entries = [(s.id, s.title, s.published_when, s.tags)
+                   for s in self.index.summaries]
+        entries.append((8, u'Article 8', published_when(8), []))
+        index = ArchiveIndex([FakeChunk(entries)])
+        second = index.page(3, first.older_cursor)
+        self.assertEqual(self.ids(second.articles), [4, 3, 2])
+
+    def test_page_by_tag(self):
+        first = self.index.page(2, tag='odd')
+        self.assertEqual(self.ids(first.articles), [7, 5])
+        second = self.index.page(2, first.older_cursor, tag='odd')
+        self.assertEqual(self.ids(second.articles), [3, 1])
+        self.assertEqual(second.older_cursor, None)
+        self.assertEqual(self.ids(self.index.page(2, tag='none').articles),
+                         [])
+
+    def test_page_by_month(self):
+        # Articles 1 to 6 are in December 2009 (the 26th to the 31st).
+        page = self.index.page(10, month=(2009, 12))
+        self.assertEqual(self.ids(page.articles), [6, 5, 4, 3, 2, 1])
+        self.assertEqual(page.older_cursor, None)
+        page = self.index.page(10, month=(2010, 1))
+        self.assertEqual(self.ids(page.articles), [7])
+
+    def test_month_counts(self):
+        self.assertEqual(self.index.get_month_counts(),
+                         {datetime.date(2009, 12, 1) : 6,
+                          datetime.date(2010, 1, 1) : 1})
+
+    def test_oldest_page(self):
+        self.assertEqual(self.ids(self.index.oldest_page(1, 3)), [3, 2, 1])
+        self.assertEqual(self.ids(self.index.oldest_page(2, 3)), [6, 5, 4])
+        self.assertEqual(self.ids(self.index.oldest_page(3, 3)), [7])
+        self.assertEqual(self.index.oldest_page(4, 3), [])
+
+    def test_since(self):
+        self.assertEqual(self.ids(self.index.since(published_when(4), 10)),
+                         [7, 6, 5])
+        self.assertEqual(self.ids(self.index.since(published_when(4), 2)),
+                         [7, 6])
+        self.assertEqual(self.index.since(published_when(7), 10), [])
+
+    def test_invalid_cursor(self):
+        from models import ArticlePage
+
+        first = self.index.page(3)
+        for cursor in ('', 'garbage', '!!!', u'\xe9', 'eDEyMw'):
+            self.assertEqual(ArticlePage.normalize_cursor(cursor), None)
+            page = self.index.page(3, cursor)
+            self.assertEqual(self.ids(page.articles),
+                             self.ids(first.articles))
+
+    def test_normalize_cursor(self):
+        from models import ArticlePage
+
+        cursor = self.index.page(3).older_cursor
+        self.assertEqual(ArticlePage.normalize_cursor(cursor), cursor)
+        # Padding is dropped.
+        self.assertEqual(ArticlePage.normalize_cursor(cursor + '=='),
+                         cursor)
+        self.assertEqual(ArticlePage.cursor_before(published_when(5)),
+                         cursor)
+
+@testutil.requires_sdk
+class ArticlePagingTest(testutil.DatastoreTestCase):
+
+    def setUp(self):
+        testutil.DatastoreTestCase.setUp(self)
+        from models import Article, ArchiveIndex
+
+        # Build the (empty) index first, so the saves below update it.
+        ArchiveIndex.load()
+        self.articles = []
+        for n in range(1, 8):
+            article = Article.create(title=u'Article %d' % n,
+                                     body=u'Article %d.\n' % n,
+                                     draft=False)
+            article.published_when = published_when(n)
+            self.articles.append(article)
+        draft = Article.create(title=u'Draft', body=u'Draft.\n', draft=True)
+        self.articles.append(draft)
+        Article.save_all(self.articles)
+
+    def titles(self, articles):
+        return [article.title for article in articles]
+
+    def test_published_page(self):
+        from models import Article
+
+        page = Article.published_page(4)
+        self.assertEqual(self.titles(page.articles),
+                         [u'Article %d' % n for n in (7, 6, 5, 4)])
+        page = Article.published_page(4, page.older_cursor)
+        self.assertEqual(self.titles(page.articles),
+                         [u'Article %d' % n for n in (3, 2, 1)])
+        self.assertEqual(page.older_cursor, None)
+
+    def test_sees_latest_changes(self):
+        # Pages come from the index and key lookups, never from a
+        # query, so they reflect a save at once.
+        from models import Article
+
+        self.set_eventually_consistent()
+        self.articles[6].title = u'Renamed'
+        self.articles[6].save()
+        self.articles[5].delete()
+        page = Article.published_page(2)
+        self.assertEqual(self.titles(page.articles),
+                         [u'Renamed', u'Article 5'])
+
+    def test_archive_page(self):
+        from models import Article
+
+        self.assertEqual(self.titles(Article.archive_page(1, 3)),
+                         [u'Article %d' % n for n in (3, 2, 1)])
+        self.assertEqual(self.titles(Article.archive_page(3, 3)),
+                         [u'Article 7'])
+
+    def test_published_since(self):
+        from models import Article
+
+        self.assertEqual(
+            self.titles(Article.published_since(published_when(5), 10)),
+            [u'Article 7', u'Article 6'])
+
+    def test_month_and_tag(self):
+        from models import Article
+
+        page = Article.page_for_month(2010, 1, 10)
+        self.assertEqual(self.titles(page.articles), [u'Article 7'])
+        page = Article.page_for_tag(u'none', 10)
+        self.assertEqual(page.articles, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+# $Id$
+
+"""
+Tests for the publish pings, which are sent from a background task
+queued by ``admin.alert_the_media()``.
+"""
+
+__docformat__ = 'restructuredtext'
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import base64
+import cgi
+import unittest
+
+import testutil
+testutil.setup_paths()
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+# A time at the start of a coalescing window (see admin.alert_the_media())
+NOW = 1262347200
+
+SERVICES = ['http://ping.example.com/rpc', 'http://ping.example.org/rpc']
+HUBS = ['http://hub.example.com/']
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class FakeTime(object):
+    """
+    Stands in for the ``time`` module, with a settable time.
+    """
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+@testutil.requires_sdk
+class PingTaskTestCase(testutil.HandlerTestCase):
+
+    def get_tasks(self):
+        import admin
+        stub = self.testbed.get_stub('taskqueue')
+        return stub.GetTasks(admin.PING_QUEUE_NAME)
+
+@testutil.requires_sdk
+class AlertTheMediaTest(PingTaskTestCase):
+
+    def setUp(self):
+        PingTaskTestCase.setUp(self)
+        import admin
+        self.time = admin.time
+        admin.time = FakeTime(NOW)
+
+    def tearDown(self):
+        import admin
+        admin.time = self.time
+        PingTaskTestCase.tearDown(self)
+
+    def test_coalesced(self):
+        import admin
+        import defs
+
+        for i in range(3):
+            admin.alert_the_media()
+            admin.time.now += 1
+        tasks = self.get_tasks()
+        self.assertEqual(len(tasks), 1)
+        self.assertEqual(tasks[0]['url'], admin.PING_TASK_URL)
+        self.assertEqual(tasks[0]['name'],
+                         'ping-%d' % (NOW // defs.PING_COALESCE_SECONDS))
+
+    def test_next_window(self):
+        import admin
+        import defs
+
+        admin.alert_the_media()
+        admin.time.now += defs.PING_COALESCE_SECONDS
+        admin.alert_the_media()
+        self.assertEqual(len(self.get_tasks()), 2)
+
+@testutil.requires_sdk
+class PingTaskHandlerTest(PingTaskTestCase):
+
+    def setUp(self):
+        PingTaskTestCase.setUp(self)
+        import pings
+
+        # Endpoints that fail, and the pings sent.
+        self.failing = []
+        self.sent = []
+
+        def send_pings(services, hubs):
+            self.sent.append((services, hubs))
+            return ([u for u in services if u in self.failing],
+                    [u for u in hubs if u in self.failing])
+
+        self.saved = (pings.send_pings,
+                      pings.ping_services,
+                      pings.websub_hubs)
+        pings.send_pings = send_pings
+        pings.ping_services = lambda: SERVICES
+        pings.websub_hubs = lambda: HUBS
+
+    def tearDown(self):
+        import pings
+        pings.send_pings, pings.ping_services, pings.websub_hubs = \
+            self.saved
+        PingTaskTestCase.tearDown(self)
+
+    def run_task(self, params=None, **headers):
+        import admin
+        headers.setdefault('X_AppEngine_QueueName', admin.PING_QUEUE_NAME)
+        return self.post(admin.application, admin.PING_TASK_URL, params,
+                         **headers)
+
+    def get_retries(self):
+        return [cgi.parse_qs(base64.b64decode(task['body']))
+                for task in self.get_tasks()]
+
+    def test_fan_out(self):
+        response = self.run_task()
+        self.assertEqual(response.status_int, 200)
+        self.assertEqual(self.sent, [(SERVICES, HUBS)])
+        self.assertEqual(self.get_tasks(), [])
+
+    def test_retry_failed_endpoints(self):
+        self.failing = [SERVICES[1], HUBS[0]]
+        response = self.run_task()
+        self.assertEqual(response.status_int, 200)
+        retries = self.get_retries()
+        retries.sort()
+        self.assertEqual(retries, [{'hub' : [HUBS[0]]},
+                                   {'service' : [SERVICES[1]]}])
+
+    def test_retry(self):
+        params = {'service' : SERVICES[1]}
+        response = self.run_task(params)
+        self.assertEqual(response.status_int, 200)
+        self.assertEqual(self.sent, [([SERVICES[1]], [])])
+
+        # A failed retry is left to the task queue to retry.
+        self.failing = [SERVICES[1]]
+        response = self.run_task(params)
+        self.assertEqual(response.status_int, 500)
+        self.assertEqual(self.get_tasks(), [])
+
+    def test_outside_request_refused(self):
+        import admin
+        response = self.post(admin.application, admin.PING_TASK_URL)
+        self.assertEqual(response.status_int, 403)
+        self.assertEqual(self.sent, [])
+
+    def test_unknown_endpoint_refused(self):
+        for params in ({'service' : 'http://localhost:8080/'},
+                       {'hub' : 'http://169.254.169.254/'},
+                       {'hub' : SERVICES[0]}):
+            response = self.run_task(params)
+            self.assertEqual(response.status_int, 200)
+        self.assertEqual(self.sent, [])
+
+if __name__ == '__main__':
+    unittest.main()
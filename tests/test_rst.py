@@ -0,0 +1,122 @@
+# $Id$
+
+"""
+Tests for ``rst.RSTRenderer``: its output must match a plain
+``publish_parts()`` call, which is what rendering used to do. These
+don't need the App Engine SDK.
+"""
+
+__docformat__ = 'restructuredtext'
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import os
+import threading
+import unittest
+
+import testutil
+testutil.setup_paths(need_sdk=False)
+
+from docutils.core import publish_parts
+
+import rst
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+DOCUMENTS = [
+    u'A single paragraph, with *emphasis* and ``literal text``.\n',
+
+    u'Title\n=====\n\nSome text, and a list:\n\n'
+    u'- first item\n- second item\n\n'
+    u'A `link <http://www.example.org/>`_ and a footnote [#]_.\n\n'
+    u'.. [#] The footnote.\n',
+
+    u'Some code:\n\n'
+    u'.. code-block:: python\n\n'
+    u'    def main():\n'
+    u'        print "Hello, world"\n\n'
+    u'Some markup, which isn\'t highlighted:\n\n'
+    u'.. code-block:: html\n\n'
+    u'    <p>Hello, <b>world</b></p>\n',
+
+    u'Code in a language Pygments doesn\'t know:\n\n'
+    u'.. code-block:: no-such-language\n\n'
+    u'    frobnicate all the things\n',
+
+    u'Non-ASCII text: caf\xe9, na\xefve, \u65e5\u672c\u8a9e.\n',
+]
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def publish_parts_html(s):
+    os.environ['DOCUTILSCONFIG'] = ""
+    parts = publish_parts(source=s,
+                          writer_name='html4css1',
+                          settings_overrides={'style'  : 'colorful',
+                                              'config' : None})
+    return parts['fragment']
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class RSTRendererTest(unittest.TestCase):
+
+    def setUp(self):
+        rst._highlight_cache.clear()
+        self.renderer = rst.RSTRenderer()
+
+    def test_matches_publish_parts(self):
+        for s in DOCUMENTS:
+            self.assertEqual(self.renderer.render(s), publish_parts_html(s))
+
+    def test_reuse(self):
+        # Rendering a document mustn't leave state behind that changes
+        # the next one, so render them all twice, in opposite orders.
+        expected = [publish_parts_html(s) for s in DOCUMENTS]
+        self.assertEqual(self.renderer.render_all(DOCUMENTS), expected)
+        self.assertEqual(
+            self.renderer.render_all(list(reversed(DOCUMENTS))),
+            list(reversed(expected)))
+
+    def test_highlight_cache(self):
+        s = DOCUMENTS[2]
+        first = self.renderer.render(s)
+        self.assertEqual(self.renderer.render(s), first)
+
+    def test_threads(self):
+        expected = [publish_parts_html(s) for s in DOCUMENTS]
+        results = {}
+        errors = []
+
+        def render(n):
+            try:
+                for i in range(5):
+                    results[n] = self.renderer.render_all(DOCUMENTS)
+            except Exception, e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=render, args=(n,))
+                   for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        for n in range(len(threads)):
+            self.assertEqual(results[n], expected)
+
+    def test_get_renderer(self):
+        self.assertTrue(rst.get_renderer() is rst.get_renderer())
+        self.assertEqual(rst.rst2html(DOCUMENTS[0]),
+                         publish_parts_html(DOCUMENTS[0]))
+
+if __name__ == '__main__':
+    unittest.main()
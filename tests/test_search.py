@@ -0,0 +1,296 @@
+# $Id$
+
+"""
+Tests for the full-text search index: ``search.update_index()`` and
+``search.search()``, and rebuilding the index in the background.
+"""
+
+__docformat__ = 'restructuredtext'
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import base64
+import cgi
+import datetime
+import unittest
+
+import testutil
+testutil.setup_paths()
+from testutil import make_article
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class FakeArticle(object):
+    """
+    Just the fields of an ``Article`` that the index reads.
+    """
+    def __init__(self, id, title, body):
+        self.id = id
+        self.title = title
+        self.body = body
+
+@testutil.requires_sdk
+class SearchTest(testutil.DatastoreTestCase):
+
+    def setUp(self):
+        testutil.DatastoreTestCase.setUp(self)
+        self.articles = [
+            FakeArticle(1, u'Python on App Engine',
+                        u'Deploying a Python application.'),
+            FakeArticle(2, u'Scala notes',
+                        u'Scala runs on the JVM; Python does not.'),
+            FakeArticle(3, u'Cooking',
+                        u'Engine oil is not an ingredient.'),
+        ]
+
+    def search(self, query, offset=0, limit=10):
+        import search
+        return search.search(query, offset, limit, len(self.articles))
+
+    def test_tokenize(self):
+        import search
+        self.assertEqual(search.tokenize(u'The App Engine, and a JVM!'),
+                         [u'app', u'engine', u'jvm'])
+
+    def test_search(self):
+        import search
+
+        search.update_index(self.articles, [])
+        ids, total = self.search(u'python')
+        self.assertEqual(total, 2)
+        # Title terms weigh more than body terms.
+        self.assertEqual(ids, [1, 2])
+
+        # Every term must match.
+        self.assertEqual(self.search(u'python scala'), ([2], 1))
+        self.assertEqual(self.search(u'python cooking'), ([], 0))
+        self.assertEqual(self.search(u'nowhere'), ([], 0))
+
+        # Stop words and short words alone match nothing.
+        self.assertEqual(self.search(u'the a'), ([], 0))
+
+    def test_phrase_bonus(self):
+        import search
+
+        articles = [FakeArticle(1, u'Notes', u'engine app test test'),
+                    FakeArticle(2, u'Notes', u'app engine test test')]
+        search.update_index(articles, [])
+        ids, total = search.search(u'app engine', 0, 10, 2)
+        self.assertEqual(ids, [2, 1])
+
+    def test_offset_and_limit(self):
+        import search
+
+        articles = [FakeArticle(n, u'Article %d' % n, u'common word')
+                    for n in range(1, 8)]
+        search.update_index(articles, [])
+        all_ids, total = search.search(u'common', 0, 10, 7)
+        self.assertEqual(total, 7)
+        self.assertEqual(sorted(all_ids), range(1, 8))
+
+        page, total = search.search(u'common', 2, 3, 7)
+        self.assertEqual(total, 7)
+        self.assertEqual(page, all_ids[2:5])
+
+    def test_reindex(self):
+        import search
+
+        search.update_index(self.articles, [])
+        self.articles[0].title = u'Java on App Engine'
+        self.articles[0].body = u'Deploying a Java application.'
+        search.update_index([self.articles[0]], [])
+
+        self.assertEqual(self.search(u'python'), ([2], 1))
+        self.assertEqual(self.search(u'java'), ([1], 1))
+        ids, total = self.search(u'engine')
+        self.assertEqual(sorted(ids), [1, 3])
+
+        # No posting is left behind for the dropped terms.
+        document = search.SearchDocument.get(search._document_key(1, 0))
+        self.assertTrue(u'python' not in document.terms)
+        self.assertEqual(
+            search.SearchPosting.get(search._posting_key(u'python', 1, 0)),
+            None)
+
+    def test_remove(self):
+        import search
+
+        search.update_index(self.articles, [])
+        search.update_index([], [2, 42])
+        self.assertEqual(self.search(u'scala'), ([], 0))
+        self.assertEqual(self.search(u'python'), ([1], 1))
+        self.assertEqual(
+            search.SearchDocument.get(search._document_key(2, 0)), None)
+
+    def test_eventual_consistency(self):
+        # Postings are read with ancestor queries, so they're seen as
+        # soon as they're written.
+        import search
+
+        self.set_eventually_consistent()
+        search.update_index(self.articles, [])
+        self.assertEqual(self.search(u'scala'), ([2], 1))
+        search.update_index([], [2])
+        self.assertEqual(self.search(u'scala'), ([], 0))
+
+    def test_postings_capped(self):
+        # Only the heaviest postings for a term are read. (Generation 0
+        # predates the indexed weights, so this uses generation 1.)
+        import search
+
+        search.SearchIndexState(key_name=search.STATE_KEY_NAME,
+                                generation=1).put()
+        articles = [FakeArticle(1, u'Notes', u'word'),
+                    FakeArticle(2, u'Word', u'word word'),
+                    FakeArticle(3, u'Notes', u'word word')]
+        search.update_index(articles, [])
+
+        max_postings = search.MAX_POSTINGS_PER_TERM
+        search.MAX_POSTINGS_PER_TERM = 2
+        try:
+            ids, total = search.search(u'word', 0, 10, 3)
+        finally:
+            search.MAX_POSTINGS_PER_TERM = max_postings
+        self.assertEqual(total, 2)
+        self.assertEqual(ids, [2, 3])
+
+@testutil.requires_sdk
+class RebuildTest(testutil.HandlerTestCase):
+
+    def setUp(self):
+        testutil.HandlerTestCase.setUp(self)
+        import search
+        from models import Article
+
+        self.batch_size = search.REBUILD_BATCH_SIZE
+        search.REBUILD_BATCH_SIZE = 2
+
+        start = datetime.datetime(2010, 1, 1)
+        self.articles = [make_article(n, start + datetime.timedelta(days=n))
+                         for n in range(1, 6)]
+        Article.save_all(self.articles)
+
+    def tearDown(self):
+        import search
+        search.REBUILD_BATCH_SIZE = self.batch_size
+        testutil.HandlerTestCase.tearDown(self)
+
+    def run_tasks(self, limit=None):
+        """
+        Run the queued tasks, and the tasks they queue, in order: all of
+        them, or just the first ``limit``.
+        """
+        import admin
+
+        stub = self.testbed.get_stub('taskqueue')
+        run = 0
+        while (limit is None) or (run < limit):
+            tasks = stub.GetTasks('default')
+            if not tasks:
+                break
+            task = tasks[0]
+            stub.DeleteTask('default', task['name'])
+            params = cgi.parse_qs(base64.b64decode(task.get('body', '')))
+            response = self.post(admin.application, task['url'], params,
+                                 X_AppEngine_QueueName='default')
+            self.assertEqual(response.status_int, 200)
+            run += 1
+
+    def search(self, query):
+        import search
+        return sorted(search.search(query, 0, 10, len(self.articles))[0])
+
+    def get_state(self):
+        import search
+        return search._get_state()
+
+    def count_documents(self, generation):
+        import search
+        prefix = search._key_prefix('d', generation)
+        return search._key_name_query(search.SearchDocument, prefix).count()
+
+    def test_rebuild(self):
+        import search
+
+        ids = [article.id for article in self.articles]
+        # Lose an article from the index.
+        search.update_index([], [ids[0]])
+        self.assertEqual(self.search(u'article'), ids[1:])
+
+        self.assertEqual(search.start_rebuild(), 1)
+        # The first batches are done, but the old generation is still
+        # served.
+        self.run_tasks(2)
+        self.assertEqual(self.get_state().building, 1)
+        self.assertEqual(self.search(u'article'), ids[1:])
+
+        self.run_tasks()
+        state = self.get_state()
+        self.assertEqual(state.generation, 1)
+        self.assertEqual(state.building, None)
+        self.assertEqual(state.version, search.INDEX_VERSION)
+        self.assertEqual(self.search(u'article'), ids)
+        self.assertEqual(self.count_documents(1), 5)
+        # The old generation was removed.
+        self.assertEqual(self.count_documents(0), 0)
+        self.assertEqual(search.SearchPosting.all().count(), 10)
+
+    def test_changes_during_rebuild(self):
+        import search
+        from models import Article
+
+        search.start_rebuild()
+        self.run_tasks(1)
+        self.articles[0].delete()
+        new = make_article(6, datetime.datetime(2011, 1, 1))
+        new.save()
+        # Both generations are updated.
+        expected = sorted([article.id
+                           for article in self.articles[1:] + [new]])
+        self.assertEqual(self.search(u'article'), expected)
+
+        self.run_tasks()
+        self.assertEqual(self.get_state().generation, 1)
+        self.assertEqual(self.search(u'article'), expected)
+
+    def test_rebuild_if_stale(self):
+        import search
+
+        # No index has been built by this version yet.
+        self.assertTrue(search.rebuild_if_stale())
+        self.assertFalse(search.rebuild_if_stale())
+        self.run_tasks()
+        self.assertFalse(search.rebuild_if_stale())
+
+    def test_abandoned_rebuild(self):
+        import search
+
+        self.assertEqual(search.start_rebuild(), 1)
+        self.run_tasks(1)
+        self.assertEqual(search.start_rebuild(), 2)
+        self.run_tasks()
+        self.assertEqual(self.get_state().generation, 2)
+        for generation in (0, 1):
+            self.assertEqual(self.count_documents(generation), 0)
+        self.assertEqual(self.search(u'article'),
+                         sorted([article.id for article in self.articles]))
+
+    def test_rebuild_aggregates(self):
+        # The admin page's rebuild runs in tasks.
+        import admin
+        from models import ArticleCounts, COUNTS_KEY_NAME
+
+        ArticleCounts.get_by_key_name(COUNTS_KEY_NAME).delete()
+        response = self.post(admin.application, '/admin/rebuild/')
+        self.assertEqual(response.status_int, 302)
+        self.run_tasks()
+        self.assertEqual(self.get_state().generation, 1)
+        self.assertEqual(sum(ArticleCounts.load().get_day_counts().values()),
+                         5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# $Id$
+
+"""
+Tests for the per-request timings ``stats.StatsMiddleware`` sends in the
+``Server-Timing`` response header.
+"""
+
+__docformat__ = 'restructuredtext'
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import datetime
+import re
+import unittest
+
+import testutil
+testutil.setup_paths()
+from testutil import make_article
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def metric_names(header):
+    return [entry.split(';')[0] for entry in header.split(', ')]
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+@testutil.requires_sdk
+class ServerTimingTest(testutil.HandlerTestCase):
+
+    def test_header(self):
+        import stats
+
+        def application(environ, start_response):
+            stats.record('render', 0.25)
+            stats.record('template', 0.001)
+            stats.record('template', 0.002)
+            stats.note('cache;desc=miss')
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return ['OK']
+
+        response = self.get(stats.StatsMiddleware(application), '/')
+        header = response.headers['Server-Timing']
+        # Metrics in METRICS order, then the notes, then the total.
+        self.assertEqual(metric_names(header),
+                         ['template', 'render', 'cache', 'total'])
+        self.assertTrue('template;dur=3.0;desc="2 call(s)"' in header)
+        self.assertTrue('render;dur=250.0;desc="1 call(s)"' in header)
+        self.assertTrue(re.search(r'total;dur=\d+\.\d$', header))
+
+    def test_not_timed_outside_requests(self):
+        import stats
+
+        stats.record('render', 1.0)
+        stats.note('cache;desc=hit')
+        self.assertEqual(stats.current(), None)
+
+    def test_page(self):
+        import blog
+
+        make_article(1, datetime.datetime(2010, 1, 1)).save()
+        names = metric_names(
+            self.get(blog.application, '/').headers['Server-Timing'])
+        for name in ('datastore', 'memcache', 'template', 'render', 'cache',
+                     'total'):
+            self.assertTrue(name in names, name)
+
+        # A cached page isn't rendered.
+        names = metric_names(
+            self.get(blog.application, '/').headers['Server-Timing'])
+        self.assertFalse('render' in names)
+        self.assertFalse('template' in names)
+        self.assertTrue('memcache' in names)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,221 @@
+# $Id$
+
+"""
+Common support for the tests in this directory. Most of the tests run
+against the App Engine SDK's datastore and memcache stubs, through
+``testbed``, so the SDK must be installed locally (see ``sdkpaths``).
+Without it, those tests are skipped.
+
+Run the tests from the top of the source tree with::
+
+    python -m unittest discover -s tests
+"""
+
+__docformat__ = 'restructuredtext'
+
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import os
+import sys
+import unittest
+import urllib
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(TEST_DIR)
+
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+import sdkpaths
+
+# -----------------------------------------------------------------------------
+# Globals
+# -----------------------------------------------------------------------------
+
+# Whether the App Engine SDK was found (see setup_paths()).
+_have_sdk = False
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def setup_paths(need_sdk=True):
+    """
+    Put the application and, optionally, the App Engine SDK on
+    ``sys.path``. See ``sdkpaths.setup_paths()``; unlike it, this doesn't
+    fail if the SDK can't be found, since the tests that need it are
+    skipped (see ``requires_sdk()``).
+
+    :Parameters:
+        need_sdk : bool
+            ``False`` if the tests only use modules (such as ``rst``) that
+            don't depend on App Engine
+    """
+    global _have_sdk
+
+    if not need_sdk:
+        sdkpaths.setup_paths(need_sdk=False)
+        return
+
+    try:
+        sdkpaths.setup_paths()
+        _have_sdk = True
+    except ImportError:
+        sdkpaths.setup_paths(need_sdk=False)
+
+def make_article(n, when, tags=(), draft=False):
+    """
+    Create an unsaved article.
+
+    :Parameters:
+        n : int
+            a number, used in the article's title and body
+
+        when : datetime
+            the article's publication time
+
+        tags : list
+            the article's tags, as strings
+
+        draft : bool
+            ``True`` for a draft
+
+    :rtype: Article
+    :return: the article
+    """
+    from google.appengine.ext import db
+    from models import Article
+
+    article = Article.create(title=u'Article %d' % n,
+                             body=u'Body of article %d.\n' % n,
+                             tags=[db.Category(tag) for tag in tags],
+                             draft=draft)
+    article.published_when = when
+    return article
+
+def requires_sdk(test_class):
+    """
+    Class decorator for tests that need the App Engine SDK: they're
+    skipped if ``setup_paths()`` didn't find it.
+
+    :Parameters:
+        test_class : class
+            the ``unittest.TestCase`` subclass
+
+    :rtype: class
+    :return: the class
+    """
+    return unittest.skipUnless(_have_sdk,
+                               'App Engine SDK not found')(test_class)
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class DatastoreTestCase(unittest.TestCase):
+    """
+    Base class for tests that use the datastore and memcache. Each test
+    gets fresh stubs. The datastore starts out strongly consistent; see
+    ``set_eventually_consistent()``.
+    """
+    def setUp(self):
+        from google.appengine.ext import testbed
+        import cache
+
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        cache.query_stats.reset()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def set_eventually_consistent(self):
+        """
+        Make the datastore stub as inconsistent as it can be: from now
+        on, queries that aren't ancestor queries never see new writes.
+        Key lookups still do.
+        """
+        from google.appengine.datastore import datastore_stub_util
+
+        policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=0)
+        stub = self.testbed.get_stub('datastore_v3')
+        stub.SetConsistencyPolicy(policy)
+
+class HandlerTestCase(DatastoreTestCase):
+    """
+    Base class for tests that send requests to one of the application's
+    WSGI applications (e.g., ``blog.application``). The task queue stub
+    reads the application's queue.yaml.
+    """
+    def setUp(self):
+        DatastoreTestCase.setUp(self)
+        self.testbed.init_taskqueue_stub(root_path=APP_DIR)
+        self.testbed.init_user_stub()
+
+    def send(self, application, path, method='GET', params=None,
+             headers=None):
+        """
+        Send a request to a WSGI application.
+
+        :Parameters:
+            application : callable
+                the application
+
+            path : str
+                the path, with any query string
+
+            method : str
+                the HTTP method
+
+            params : dict
+                form parameters, for a ``POST``
+
+            headers : dict
+                request headers
+
+        :rtype: webob.Response
+        :return: the response
+        """
+        import webob
+
+        req = webob.Request.blank(path)
+        req.environ['REQUEST_METHOD'] = method
+        if params is not None:
+            req.environ['CONTENT_TYPE'] = 'application/x-www-form-urlencoded'
+            req.body = urllib.urlencode(params, True)
+        for name, value in (headers or {}).items():
+            req.headers[name] = value
+        return req.get_response(application)
+
+    def get(self, application, path, **headers):
+        """
+        Send a ``GET``. Header names are given with underscores, which
+        become dashes (e.g., ``If_None_Match``).
+
+        :rtype: webob.Response
+        :return: the response
+        """
+        return self.send(application, path, headers=_headers(headers))
+
+    def post(self, application, path, params=None, **headers):
+        """
+        Send a ``POST``. See ``get()``.
+
+        :rtype: webob.Response
+        :return: the response
+        """
+        return self.send(application, path, 'POST', params or {},
+                         _headers(headers))
+
+# -----------------------------------------------------------------------------
+# Private functions
+# -----------------------------------------------------------------------------
+
+def _headers(headers):
+    return dict([(name.replace('_', '-'), value)
+                 for name, value in headers.items()])
@@ -1,7 +1,7 @@
 # $Id$
 
 """
-Handles pinging Technorati for the blog.
+XML-RPC transport for the blog's outbound pings, built on urlfetch.
 """
 
 __docformat__ = 'restructuredtext' # for Epydoc
@@ -49,21 +49,65 @@ class GoogleXMLRPCTransport(object):
 
         # issue XML-RPC request
 
-        result = None
         url = 'http://%s%s' % (host, handler)
+        return self.finish_request(self.start_request(url, request_body), url)
+
+    def start_request(self, url, request_body, deadline=None):
+        """
+        Start an XML-RPC request, without waiting for the response. Any
+        number of requests can be in flight at once; collect each one's
+        response with ``finish_request()``. The transport holds no
+        per-request state, so a single instance can be shared by all of
+        them.
+
+        :Parameters:
+            url : str
+                URL of the XML-RPC server
+
+            request_body : str
+                XML-RPC request body
+
+            deadline : float
+                seconds to wait for the server, or ``None`` for the
+                urlfetch default
+
+        :rtype: object
+        :return: the in-flight urlfetch RPC
+        """
+        rpc = urlfetch.create_rpc(deadline=deadline)
+        urlfetch.make_fetch_call(rpc,
+                                 url,
+                                 payload=request_body,
+                                 method=urlfetch.POST,
+                                 headers={'Content-Type': 'text/xml'})
+        return rpc
+
+    def finish_request(self, rpc, url):
+        """
+        Wait for a request started by ``start_request()`` to complete, and
+        parse its response.
+
+        :Parameters:
+            rpc : object
+                the RPC returned by ``start_request()``
+
+            url : str
+                the URL passed to ``start_request()``
+
+        :rtype: dict
+        :return: parsed response, as key/value pairs
+        """
+        result = None
         try:
-            response = urlfetch.fetch(url,
-                                      payload=request_body,
-                                      method=urlfetch.POST,
-                                      headers={'Content-Type': 'text/xml'})
+            response = rpc.get_result()
         except:
             msg = 'Failed to fetch %s' % url
-            raise xmlrpclib.ProtocolError(host + handler, 500, msg, {})
+            raise xmlrpclib.ProtocolError(url, 500, msg, {})
                                           
         if response.status_code != 200:
             logging.error('%s returned status code %s' % 
                           (url, response.status_code))
-            raise xmlrpclib.ProtocolError(host + handler,
+            raise xmlrpclib.ProtocolError(url,
                                           response.status_code,
                                           "",
                                           response.headers)